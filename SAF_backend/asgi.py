@@ -2,6 +2,8 @@
 ASGI config for SAF_backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Long-lived responses such as the catalog event stream (``/api/events/programs/``)
+should be served through this entry point, e.g. ``uvicorn SAF_backend.asgi:application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
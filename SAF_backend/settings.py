@@ -5,11 +5,16 @@ Django settings for SAF_backend project.
 from pathlib import Path
 import os
 from datetime import timedelta
-from dotenv import load_dotenv
-load_dotenv()
 # Base directory
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# The nearest .env file from this directory upwards, as `load_dotenv()` finds it; python-dotenv is
+# only imported when there is one
+DOTENV_PATH = next((directory / '.env' for directory in Path(__file__).resolve().parents if (directory / '.env').is_file()), None)
+if DOTENV_PATH is not None:
+    from dotenv import load_dotenv
+    load_dotenv(DOTENV_PATH)
+
 # SECURITY WARNING: keep the secret key used in production secret!
 
 SECRET_KEY = os.getenv('SECRET_KEY', 'jlkjohihgihigu7f67fukopjhyugouyg')
@@ -42,10 +47,12 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'activities.compression.CompressionMiddleware', # before any middleware that reads or changes the body
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'activities.tenants.TenantMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -71,8 +78,6 @@ TEMPLATES = [
 WSGI_APPLICATION = 'SAF_backend.wsgi.application'
 
 # Database configuration (PostgreSQL)
-import os
-
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -115,6 +120,16 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Uploads are content-addressed: deduplicated and stored under the hash of their bytes
+STORAGES = {
+    'default': {
+        'BACKEND': 'activities.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -124,11 +139,21 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.TokenAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'activities.authentication.JWTAuthentication', # simplejwt's, plus the logout-everywhere check
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    # orjson-backed when installed, byte-identical to DRF's JSON classes otherwise (see `activities.renderers`)
+    'DEFAULT_RENDERER_CLASSES': [
+        'activities.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'activities.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
         'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
         'rest_framework.filters.SearchFilter',
@@ -148,6 +173,15 @@ DJOSER = {
     'ACTIVATION_URL': 'activate/{uid}/{token}',
     'SEND_ACTIVATION_EMAIL': True,
     'TOKEN_MODEL': None,
+    # Rendered in the request, sent by the `send_email` background task
+    'EMAIL': {
+        'activation': 'activities.email.ActivationEmail',
+        'confirmation': 'activities.email.ConfirmationEmail',
+        'password_reset': 'activities.email.PasswordResetEmail',
+        'password_changed_confirmation': 'activities.email.PasswordChangedConfirmationEmail',
+        'username_changed_confirmation': 'activities.email.UsernameChangedConfirmationEmail',
+        'username_reset': 'activities.email.UsernameResetEmail',
+    },
 }
 
 # JWT configuration
@@ -163,7 +197,199 @@ SIMPLE_JWT = {
     'USER_ID_CLAIM': 'user_id',
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
     'TOKEN_TYPE_CLAIM': 'token_type',
+    # Revocation through `activities.revocation` instead of the token_blacklist app
+    'TOKEN_OBTAIN_SERIALIZER': 'activities.authentication.TokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'activities.authentication.TokenRefreshSerializer',
+    'TOKEN_VERIFY_SERIALIZER': 'activities.authentication.TokenVerifySerializer',
+    'TOKEN_BLACKLIST_SERIALIZER': 'activities.authentication.TokenBlacklistSerializer',
+}
+
+# Revoked JWTs (see `activities.revocation`) are `RevokedToken` rows (purge with `manage.py purge_revoked_tokens`); every process
+# keeps a Bloom filter of them so that most checks need no query
+JWT_REVOCATION = {
+    'CAPACITY': 100000, # revocations per refresh token lifetime the Bloom filter is sized for
+    'ERROR_RATE': 0.001, # share of valid tokens still confirmed in the database
+    'SYNC_INTERVAL': 1.0, # seconds a token revoked by another process may still be accepted here
 }
 
 # CORS
 CORS_ALLOW_ALL_ORIGINS = True
+
+# Cache (Redis when REDIS_URL is set, so invalidations are shared by every worker)
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Seconds a user's favorites feed stays cached (signals invalidate it on change)
+FAVORITES_FEED_CACHE_TIMEOUT = 60 * 60
+
+# Catalog change events streamed at /api/events/programs/ (the cache backend is shared by all workers)
+# The in-memory backend only streams events published by the same process: deployments running the
+# ASGI stream apart from WSGI workers need REDIS_URL (a shared cache) for the cache backend
+CATALOG_EVENTS = {
+    'BACKEND': (
+        'activities.events.CacheEventBackend' if os.getenv('REDIS_URL')
+        else 'activities.events.InMemoryEventBackend'
+    ),
+    'OPTIONS': {},
+    'POLL_INTERVAL': 1, # seconds between backend reads while the stream is idle
+    'HEARTBEAT_INTERVAL': 15,
+    'STREAM_TIMEOUT': 300, # clients reconnect with Last-Event-ID after this many seconds
+    'RETRY_MS': 3000,
+}
+
+# Delta sync at /api/programs/sync/
+PROGRAM_SYNC = {
+    'PAGE_SIZE': 200,
+    'MAX_PAGE_SIZE': 1000,
+    'SAFETY_LAG': 5, # seconds; recent rows wait for the next sync so in-flight transactions are not skipped
+}
+
+# Media serving (activities.media.serve_media)
+MEDIA_SERVING = {
+    # 'X-Accel-Redirect' (nginx) or 'X-Sendfile' (Apache/lighttpd); None streams from Django
+    'SENDFILE_HEADER': os.getenv('MEDIA_SENDFILE_HEADER') or None,
+    # nginx `internal` location aliased to MEDIA_ROOT, used with X-Accel-Redirect
+    'ACCEL_REDIRECT_PREFIX': '/protected-media/',
+    'PRIVATE_PREFIXES': ['user_profiles/'],
+    'IMMUTABLE_MAX_AGE': 60 * 60 * 24 * 365, # content-addressed files never change
+    'MAX_AGE': 60 * 60,
+}
+
+# Background tasks (activities.taskqueue): 'database' rows run by `manage.py runworker`,
+# 'memory' for an in-process thread pool, 'immediate' to run inline
+TASKS = {
+    'BACKEND': os.getenv('TASKS_BACKEND', 'database'),
+    'OPTIONS': {
+        'memory': {'workers': 4},
+    },
+    'LEASE': 10 * 60, # seconds after which a task left running by a dead worker is claimed again
+    'HEARTBEAT': 60, # seconds between renewals of the lease of running tasks, well below LEASE
+}
+
+# Contact messages
+CONTACT_MESSAGES = {
+    'DEDUPE_WINDOW': 10 * 60, # seconds during which an identical (email, message) is not stored again
+    'NOTIFY_EMAILS': [email for email in os.getenv('CONTACT_NOTIFY_EMAILS', '').split(',') if email],
+}
+
+# Related programs, precomputed by `manage.py refresh_related_programs`
+RELATED_PROGRAMS = {
+    'TOP_N': 6,
+    'WEIGHTS': {
+        'requirement': 1.0, # per shared requirement
+        'category': 0.5,
+        'audience': 0.25,
+    },
+}
+
+# Analytics events, buffered per process and written in batches (see `activities.analytics`)
+ANALYTICS = {
+    'ENABLED': True,
+    'BUFFER_SIZE': 10000, # events held in memory per process
+    'BATCH_SIZE': 500, # events per bulk insert
+    'FLUSH_INTERVAL': 5.0, # seconds; None disables the background flush thread
+    'OVERFLOW': 'drop_oldest', # or 'drop_newest'
+    'RETENTION_DAYS': 90, # raw events older than this are deleted by `manage.py rollup_analytics`
+}
+
+# Trending programs (see `activities.trending`); `manage.py decay_trending` should run every few hours
+TRENDING = {
+    'HALF_LIFE': 3 * 24 * 60 * 60, # seconds after which a favorite or view counts half as much
+    'WEIGHTS': {
+        'favorite': 1.0,
+        'view': 0.05,
+    },
+}
+
+# Search suggestions (see `activities.suggest`)
+SUGGEST = {
+    'LIMIT': 10,
+    'MAX_LIMIT': 20,
+    'VERSION_CHECK_INTERVAL': 1.0, # seconds between checks that another process changed the catalog
+}
+
+# Tenants (student federations) sharing this deployment (see `activities.tenants`)
+TENANTS = {
+    'DEFAULT': 'default', # slug of the tenant used when neither the header nor the host names one
+    'HEADER': 'X-Tenant',
+    'CACHE_TIMEOUT': 60, # seconds a resolved tenant is remembered by each process
+    'CACHE_SIZE': 256, # resolved header values and hosts remembered by each process
+}
+
+# Email delivery ledger (`EmailLog`), purged by `manage.py purge_email_logs`
+EMAIL_LOG = {
+    'RETENTION_DAYS': 180, # sent and pending deliveries
+    'FAILED_RETENTION_DAYS': 365,
+    'PURGE_BATCH_SIZE': 5000,
+}
+
+# Response compression (see `activities.compression`); `br` needs `brotli`, `zstd` needs `zstandard`
+COMPRESSION = {
+    'ENCODINGS': ['br', 'zstd', 'gzip'], # server preference when the client accepts several equally
+    'LEVELS': {'br': 4, 'zstd': 3, 'gzip': 6},
+    'MIN_SIZE': 1024, # bytes; smaller bodies gain too little to be worth the CPU
+    # Prefixes. text/event-stream is left out so events are never held back, text/html because
+    # its pages carry CSRF tokens (BREACH)
+    'CONTENT_TYPES': [
+        'application/json',
+        'application/javascript',
+        'text/plain',
+        'text/css',
+        'text/csv',
+        'text/calendar',
+    ],
+}
+
+# Batched API calls at /api/batch/ (see `activities.batch`)
+BATCH = {
+    'MAX_REQUESTS': 20,
+    'MAX_CONCURRENCY': 4, # GETs run at once, each in a worker thread with its own connection; 1 runs them in turn
+}
+
+# Slow query sampling, reviewed with `manage.py advise_indexes` (see `activities.slowlog`)
+SLOW_QUERIES = {
+    'ENABLED': os.getenv('SLOW_QUERIES', 'on') != 'off',
+    'THRESHOLD_MS': 100, # queries at least this slow are sampled
+    'SAMPLE_RATE': 1.0, # fraction of the slow queries recorded
+    'MAX_FINGERPRINTS': 1000, # distinct query shapes held in memory per process between flushes
+    'FLUSH_INTERVAL': 10.0, # seconds; None disables the background flush thread
+    # Reads of these tables are recorded without their text parameters (emails, hashes, tokens, ...)
+    'SENSITIVE_TABLES': [
+        'activities_user',
+        'activities_emaillog',
+        'activities_messagecontact',
+        'authtoken_token',
+        'django_session',
+    ],
+}
+
+# Start-date reminders of favorited programs, sent daily by `manage.py send_reminders` (see `activities.reminders`)
+REMINDERS = {
+    'DAYS_BEFORE': 3, # programs starting within this many days are announced
+    'BATCH_SIZE': 500, # users per transaction; their emails go out before the next batch is claimed
+    'CHUNK_SIZE': 2000, # due rows fetched per database round-trip
+}
+
+# iCalendar feeds at /api/calendar/ (see `activities.calendar`)
+CALENDAR = {
+    'CHUNK_SIZE': 500, # programs read per query and sent per chunk of the stream
+    'CACHE_TIMEOUT': 60 * 60, # seconds each feed's ETag/Last-Modified are cached
+    'MAX_AGE': 5 * 60, # seconds a calendar app may reuse a feed without revalidating it
+}
+
+# Batched backfills run by migrations or `manage.py resume_backfills` (see `activities.backfill`)
+BACKFILL = {
+    'BATCH_SIZE': 1000, # rows updated per transaction
+    'PAUSE': 0.1, # seconds between batches, leaving room for production queries
+}
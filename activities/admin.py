@@ -1,23 +1,158 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
 from .models import (
-    User, 
-    Program, 
-    Requirement, 
-    Favorite, 
-    EmailLog, 
-    WeeklyEmail, 
+    Tenant,
+    User,
+    Program,
+    Requirement,
+    Favorite,
+    EmailLog,
+    WeeklyEmail,
     MessageContact,
     ProgramImage , # Add this if you want to manage program images in admin
-    ProgramRequirement
+    ProgramRequirement,
+    SlowQuery,
 )
 
-# Register your models here
-admin.site.register(User)
-admin.site.register(Program)
-admin.site.register(Requirement)
-admin.site.register(Favorite)
-admin.site.register(EmailLog)
-admin.site.register(WeeklyEmail)
-admin.site.register(MessageContact)
-admin.site.register(ProgramImage)  # Add this if needed
-admin.site.register(ProgramRequirement)
\ No newline at end of file
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that avoids a full `COUNT(*)` on large tables.
+    - On PostgreSQL, an unfiltered changelist uses the planner estimate from `pg_class.reltuples`.
+    - Estimates below `exact_count_threshold` (and every filtered queryset) fall back to an exact count.
+    """
+    exact_count_threshold = 10000
+
+    def _estimated_count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql' or queryset.query.where:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    @cached_property
+    def count(self):
+        estimate = self._estimated_count()
+        if estimate is not None and estimate >= self.exact_count_threshold:
+            return estimate
+        return super().count
+
+
+class PerformanceModelAdmin(admin.ModelAdmin):
+    """
+    Base admin for the activities models, tuned for large changelists.
+    - Skips the second unfiltered `COUNT(*)` query (`show_full_result_count`).
+    - Uses `EstimatedCountPaginator` for the filtered count.
+    """
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    list_per_page = 50
+
+
+@admin.register(Tenant)
+class TenantAdmin(PerformanceModelAdmin):
+    list_display = ('name', 'slug', 'domain')
+    search_fields = ('name', 'slug', 'domain')
+    ordering = ('name',)
+
+
+@admin.register(User)
+class UserAdmin(PerformanceModelAdmin):
+    list_display = ('username', 'email', 'type', 'is_active', 'date_joined')
+    list_filter = ('tenant', 'type', 'is_staff', 'is_active')
+    search_fields = ('username', 'email', 'first_name', 'last_name')
+    ordering = ('-id',)
+
+
+@admin.register(Program)
+class ProgramAdmin(PerformanceModelAdmin):
+    list_display = ('title', 'kind', 'category', 'audience', 'start_date', 'end_date')
+    list_filter = ('tenant', 'kind', 'category', 'audience', 'type')
+    search_fields = ('title',)
+    date_hierarchy = 'start_date'
+    ordering = ('-start_date',)
+
+
+@admin.register(Requirement)
+class RequirementAdmin(PerformanceModelAdmin):
+    list_display = ('description', 'created_at')
+    search_fields = ('description',)
+
+
+@admin.register(Favorite)
+class FavoriteAdmin(PerformanceModelAdmin):
+    list_display = ('__str__', 'created_at')
+    list_select_related = ('user', 'program') # Favorite.__str__ dereferences both FKs
+    raw_id_fields = ('user',)
+    autocomplete_fields = ('program',)
+    ordering = ('-id',)
+
+
+@admin.register(EmailLog)
+class EmailLogAdmin(PerformanceModelAdmin):
+    list_display = ('__str__', 'to_email', 'subject', 'status', 'attempts', 'timestamp')
+    list_filter = ('status',)
+    search_fields = ('to_email',)
+    raw_id_fields = ('recipient', 'campaign')
+    ordering = ('-id',)
+    actions = ['retry_deliveries']
+
+    @admin.action(description='Retry the selected failed deliveries')
+    def retry_deliveries(self, request, queryset):
+        from .email import requeue_failed  # deferred: keeps djoser.email and the tasks out of app loading
+
+        queued = requeue_failed(queryset)
+        self.message_user(request, f'Queued {queued} failed deliveries.')
+
+
+@admin.register(WeeklyEmail)
+class WeeklyEmailAdmin(PerformanceModelAdmin):
+    list_display = ('subject', 'sent_date')
+    search_fields = ('subject',)
+    raw_id_fields = ('users',) # avoid rendering every user in a select widget
+    autocomplete_fields = ('programs',)
+    ordering = ('-sent_date',)
+
+
+@admin.register(MessageContact)
+class MessageContactAdmin(PerformanceModelAdmin):
+    list_display = ('name', 'email', 'status', 'created_at')
+    list_filter = ('tenant', 'status')
+    search_fields = ('email', 'name')
+    ordering = ('-created_at',)
+
+
+@admin.register(ProgramImage)
+class ProgramImageAdmin(PerformanceModelAdmin):
+    list_display = ('__str__', 'caption', 'created_at')
+    list_select_related = ('program',) # ProgramImage.__str__ dereferences the program
+    autocomplete_fields = ('program',)
+    ordering = ('-id',)
+
+
+@admin.register(ProgramRequirement)
+class ProgramRequirementAdmin(PerformanceModelAdmin):
+    list_display = ('__str__', 'created_at')
+    list_select_related = ('program', 'requirement')
+    autocomplete_fields = ('program', 'requirement')
+    ordering = ('-id',)
+
+
+@admin.register(SlowQuery)
+class SlowQueryAdmin(PerformanceModelAdmin):
+    list_display = ('__str__', 'calls', 'total_time', 'max_time', 'last_seen')
+    search_fields = ('sql',)
+    ordering = ('-total_time',) # served by slowquery_total_time_idx
+    readonly_fields = [field.name for field in SlowQuery._meta.fields]
+
+    def has_add_permission(self, request):
+        return False # rows are written by activities.slowlog
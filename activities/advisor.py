@@ -0,0 +1,177 @@
+"""
+Index suggestions for the slow queries recorded by `activities.slowlog`.
+
+`advise(slow_query)` runs `EXPLAIN` on the query's slowest sample (`EXPLAIN QUERY PLAN` on SQLite,
+`EXPLAIN (FORMAT JSON)` on PostgreSQL) and looks for full table scans and sorts of `activities`
+tables. For each, it proposes a composite index from the columns the query filters on with equality,
+then its `ORDER BY` columns, then its first range filter (so a sorted `LIMIT` reads the index in
+order), unless an existing index already starts with those columns. The SQL is read with regular
+expressions over Django's quoted `"table"."column"` references: the suggestions are a starting point
+for review, not a planner.
+"""
+import json
+import re
+
+from django.apps import apps
+from django.db import NotSupportedError, connections
+
+from .slowlog import get_recorder
+
+SQLITE_SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(\w+)\b') # with or without an index, every row is read
+SQLITE_SORT_RE = re.compile(r'USE TEMP B-TREE FOR (?:RIGHT PART OF )?ORDER BY')
+COLUMN_RE = re.compile(r'"(\w+)"\."(\w+)"\s*(=|IN\b|IS\b|<=|>=|<|>|BETWEEN\b)', re.IGNORECASE)
+ORDER_COLUMN_RE = re.compile(r'"(\w+)"\."(\w+)"(\s+DESC)?', re.IGNORECASE)
+FROM_RE = re.compile(r'\bFROM\s+"(\w+)"', re.IGNORECASE)
+CLAUSE_END_RE = re.compile(r'\b(?:GROUP BY|ORDER BY|HAVING|LIMIT|OFFSET)\b', re.IGNORECASE)
+EQUALITY_OPERATORS = {'=', 'IN', 'IS'}
+
+# Longest index name Django accepts
+MAX_NAME_LENGTH = 30
+
+
+class Suggestion:
+    """
+    A proposed index.
+    - `model`: The model to declare it on.
+    - `fields`: Its fields, `-` marking descending ones.
+    - `name`: A name within Django's length limit.
+    """
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields
+        base = f"{model._meta.model_name}_{'_'.join(field.lstrip('-') for field in fields)}"
+        self.name = base[:MAX_NAME_LENGTH - 4].rstrip('_') + '_idx'
+
+    def __str__(self):
+        return f'{self.model._meta.label}: models.Index(fields={self.fields!r}, name={self.name!r})'
+
+
+def explain(connection, sql, params):
+    """
+    Returns the plan of a query as `(lines, findings)`: readable plan lines, and `(table, kind)` pairs
+    where `kind` is `scan` (a full table scan) or `sort` (a sort without index).
+    """
+    findings = []
+    with get_recorder().paused(), connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            lines = [row[3] for row in cursor.fetchall()]
+            first_table = FROM_RE.search(sql)
+            for line in lines:
+                scan = SQLITE_SCAN_RE.match(line)
+                if scan:
+                    findings.append((scan.group(1), 'scan'))
+                elif SQLITE_SORT_RE.search(line) and first_table:
+                    findings.append((first_table.group(1), 'sort'))
+        elif connection.vendor == 'postgresql':
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            lines = []
+            _walk_postgresql_plan(plan[0]['Plan'], lines, findings, FROM_RE.search(sql))
+        else:
+            raise NotSupportedError(f'Cannot explain queries on {connection.vendor}')
+    return lines, findings
+
+
+def _walk_postgresql_plan(node, lines, findings, first_table, depth=0):
+    relation = node.get('Relation Name')
+    line = node['Node Type'] + (f' on {relation}' if relation else '')
+    if node.get('Filter'):
+        line += f" (filter: {node['Filter']})"
+    if node.get('Sort Key'):
+        line += f" (sort: {', '.join(node['Sort Key'])})"
+    lines.append('  ' * depth + line)
+    if node['Node Type'] == 'Seq Scan' and relation:
+        findings.append((relation, 'scan'))
+    elif node['Node Type'] in ('Sort', 'Incremental Sort') and first_table:
+        findings.append((first_table.group(1), 'sort'))
+    for child in node.get('Plans', []):
+        _walk_postgresql_plan(child, lines, findings, first_table, depth + 1)
+
+
+def _where_clause(sql):
+    where = re.search(r'\bWHERE\b', sql, re.IGNORECASE)
+    if where is None:
+        return ''
+    clause = sql[where.end():]
+    end = CLAUSE_END_RE.search(clause)
+    return clause[:end.start()] if end else clause
+
+
+def _order_clause(sql):
+    order = re.search(r'\bORDER BY\b', sql, re.IGNORECASE)
+    if order is None:
+        return ''
+    clause = sql[order.end():]
+    end = re.search(r'\b(?:LIMIT|OFFSET)\b', clause, re.IGNORECASE)
+    return clause[:end.start()] if end else clause
+
+
+def candidate_columns(sql, table):
+    """Returns the columns of `table` worth indexing for `sql`, in index order, `-` marking descending ones."""
+    equalities, ranges = [], []
+    for column_table, column, operator in COLUMN_RE.findall(_where_clause(sql)):
+        if column_table != table:
+            continue
+        target = equalities if operator.upper() in EQUALITY_OPERATORS else ranges
+        if column not in target:
+            target.append(column)
+    columns = list(equalities)
+    for column_table, column, descending in ORDER_COLUMN_RE.findall(_order_clause(sql)):
+        if column_table == table and column not in columns:
+            columns.append(('-' if descending else '') + column)
+    plain = [column.lstrip('-') for column in columns]
+    return columns + [column for column in ranges[:1] if column not in plain]
+
+
+def _activities_models():
+    return {model._meta.db_table: model for model in apps.get_app_config('activities').get_models()}
+
+
+def existing_indexes(model):
+    """Returns the column lists of the indexes a model already has (its primary key, FKs, unique fields and `Meta`)."""
+    def column(name):
+        return model._meta.get_field(name.lstrip('-')).column
+
+    indexes = []
+    for field in model._meta.concrete_fields:
+        if field.primary_key or field.unique or field.db_index:
+            indexes.append([field.column])
+    for index in model._meta.indexes:
+        if index.fields:
+            indexes.append([column(name) for name in index.fields])
+    for constraint in model._meta.constraints:
+        if getattr(constraint, 'fields', None):
+            indexes.append([column(name) for name in constraint.fields])
+    for fields in model._meta.unique_together:
+        indexes.append([column(name) for name in fields])
+    return indexes
+
+
+def suggest(sql, findings):
+    """Returns a `Suggestion` per scanned or sorted `activities` table that no existing index serves."""
+    models = _activities_models()
+    suggestions = []
+    for table in dict.fromkeys(table for table, kind in findings):
+        model = models.get(table)
+        if model is None:
+            continue
+        columns = candidate_columns(sql, table)
+        if not columns:
+            continue # nothing filters or orders this table: an index would not help
+        plain = [column.lstrip('-') for column in columns]
+        if any(index[:len(plain)] == plain for index in existing_indexes(model)):
+            continue
+        fields_by_column = {field.column: field.name for field in model._meta.concrete_fields}
+        fields = [('-' if column.startswith('-') else '') + fields_by_column[column.lstrip('-')] for column in columns]
+        suggestions.append(Suggestion(model, fields))
+    return suggestions
+
+
+def advise(slow_query):
+    """Explains the slowest sample of a `SlowQuery`; returns `(plan lines, suggestions)`."""
+    connection = connections[slow_query.database]
+    sql, params = slow_query.example_sql, slow_query.example_params
+    lines, findings = explain(connection, sql, params)
+    return lines, suggest(sql, findings)
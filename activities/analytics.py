@@ -0,0 +1,227 @@
+"""
+Buffered analytics events.
+
+    record(AnalyticsEventKind.VIEW, program_id=program.pk, user_id=request.user.pk)
+
+`record` only appends to an in-process ring buffer, so request handlers never wait on the database.
+A daemon thread per worker process drains the buffer every `ANALYTICS['FLUSH_INTERVAL']` seconds (or
+as soon as `BATCH_SIZE` events are waiting) and writes them with one `bulk_create` per batch. Flushed views also bump the programs' trending scores.
+When the buffer is full, `ANALYTICS['OVERFLOW']` decides which event is lost:
+- `drop_oldest`: the oldest buffered event makes room for the new one.
+- `drop_newest`: the new event is discarded.
+`rollup` aggregates a day of raw events into `ProgramDailyStat` and `SearchDailyStat`, and `purge_events`
+deletes the raw events of the days rolled up.
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import Counter, deque
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Q
+from django.utils.timezone import get_current_timezone, now
+
+from . import trending
+from .models import AnalyticsEvent, AnalyticsEventKind, AnalyticsRollup, Program, ProgramDailyStat, SearchDailyStat
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query):
+    """Returns search terms case-folded, whitespace collapsed and cut to the column size."""
+    return ' '.join(query.split()).casefold()[:255]
+
+
+class EventBuffer:
+    """
+    A bounded, thread-safe buffer of unsaved `AnalyticsEvent` instances.
+    - `size`: The most events held in memory.
+    - `batch_size`: Events per `bulk_create`; reaching it wakes the flusher early.
+    - `flush_interval`: Seconds between flushes. `None` starts no thread; call `flush()` yourself.
+    - `overflow`: `drop_oldest` or `drop_newest`.
+    """
+    def __init__(self, size=10000, batch_size=500, flush_interval=5.0, overflow='drop_oldest'):
+        if overflow not in ('drop_oldest', 'drop_newest'):
+            raise ValueError(f'Unknown overflow policy {overflow!r}')
+        self.size = size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.events = deque(maxlen=size)
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.pid = None
+
+    def append(self, event):
+        with self.lock:
+            if len(self.events) >= self.size:
+                self.dropped += 1
+                if self.overflow == 'drop_newest':
+                    return
+            self.events.append(event) # a full deque drops its oldest item
+            waiting = len(self.events)
+        if waiting >= self.batch_size:
+            self.wakeup.set()
+        self.ensure_started()
+
+    def ensure_started(self):
+        # A forked worker inherits the buffer but not the thread: start one per process
+        if self.flush_interval is None or (self.thread is not None and self.pid == os.getpid()):
+            return
+        with self.lock:
+            if self.thread is not None and self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self.run, name='analytics-flusher', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Analytics flush failed')
+            finally:
+                close_old_connections()
+
+    def drain(self):
+        with self.lock:
+            events = list(self.events)
+            self.events.clear()
+        return events
+
+    def flush(self):
+        """Writes every buffered event. Returns the number written; a failed batch is dropped and logged."""
+        events = self.drain()
+        written = 0
+        views = Counter()
+        for start in range(0, len(events), self.batch_size):
+            batch = events[start:start + self.batch_size]
+            try:
+                AnalyticsEvent.objects.bulk_create(batch)
+            except Exception:
+                logger.exception('Dropped %d analytics events', len(batch))
+                continue
+            written += len(batch)
+            views.update(event.program_id for event in batch if event.kind == AnalyticsEventKind.VIEW and event.program_id)
+        trending.views_recorded(views)
+        return written
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """Returns the process-wide event buffer, configured from `ANALYTICS`."""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                config = settings.ANALYTICS
+                _buffer = EventBuffer(
+                    size=config['BUFFER_SIZE'],
+                    batch_size=config['BATCH_SIZE'],
+                    flush_interval=config['FLUSH_INTERVAL'],
+                    overflow=config['OVERFLOW'],
+                )
+    return _buffer
+
+
+def set_buffer(buffer):
+    """Replaces the event buffer, e.g. with one that has no flush thread in tests."""
+    global _buffer
+    _buffer = buffer
+
+
+def record(kind, program_id=None, user_id=None, query='', results=None):
+    """Buffers an analytics event; it is written by the next flush."""
+    if not settings.ANALYTICS['ENABLED']:
+        return
+    get_buffer().append(AnalyticsEvent(
+        kind=kind,
+        program_id=program_id,
+        user_id=user_id,
+        query=normalize_query(query),
+        results=results,
+        occurred_at=now(),
+    ))
+
+
+@atexit.register
+def _flush_on_exit():
+    if _buffer is not None and _buffer.events:
+        _buffer.flush()
+
+
+def rollup(day):
+    """
+    Recomputes the `ProgramDailyStat` and `SearchDailyStat` rows of `day` from the raw events.
+    Counters are overwritten rather than incremented, so running it again for a day is harmless.
+    The day is recorded as an `AnalyticsRollup`, which lets `purge_events` delete its raw events.
+    Returns `(program rows, search rows)`.
+    """
+    tz = get_current_timezone()
+    start = datetime.combine(day, time.min, tzinfo=tz)
+    events = AnalyticsEvent.objects.filter(occurred_at__gte=start, occurred_at__lt=start + timedelta(days=1))
+
+    programs = list(
+        events.filter(program_id__isnull=False, kind__in=[AnalyticsEventKind.VIEW, AnalyticsEventKind.FAVORITE])
+        .values('program_id')
+        .annotate(
+            views=Count('pk', filter=Q(kind=AnalyticsEventKind.VIEW)),
+            favorites=Count('pk', filter=Q(kind=AnalyticsEventKind.FAVORITE)),
+        )
+    )
+    # Events may outlive their program; stats rows need an existing one
+    existing = set(Program.objects.filter(pk__in=[row['program_id'] for row in programs]).values_list('pk', flat=True))
+    program_stats = [
+        ProgramDailyStat(program_id=row['program_id'], date=day, views=row['views'], favorites=row['favorites'])
+        for row in programs if row['program_id'] in existing
+    ]
+
+    searches = (
+        events.filter(kind=AnalyticsEventKind.SEARCH)
+        .values('query')
+        .annotate(searches=Count('pk'), empty_searches=Count('pk', filter=Q(results=0)))
+    )
+    search_stats = [SearchDailyStat(date=day, **row) for row in searches]
+
+    with transaction.atomic():
+        ProgramDailyStat.objects.bulk_create(
+            program_stats, batch_size=500,
+            update_conflicts=True, unique_fields=['program', 'date'], update_fields=['views', 'favorites'],
+        )
+        SearchDailyStat.objects.bulk_create(
+            search_stats, batch_size=500,
+            update_conflicts=True, unique_fields=['date', 'query'], update_fields=['searches', 'empty_searches'],
+        )
+        AnalyticsRollup.objects.update_or_create(date=day)
+    return len(program_stats), len(search_stats)
+
+
+def purge_events(before, batch_size=5000):
+    """
+    Deletes the raw events of the days before `before` that were rolled up; the events of the other
+    days are kept until they are. Each delete covers a primary key range of at most `batch_size`
+    events, so no statement holds its locks for long. Returns the number of events deleted.
+    """
+    tz = get_current_timezone()
+    deleted = 0
+    days = AnalyticsRollup.objects.filter(date__lt=before.astimezone(tz).date()).order_by('date')
+    for day in days.values_list('date', flat=True):
+        start = datetime.combine(day, time.min, tzinfo=tz)
+        events = AnalyticsEvent.objects.filter(occurred_at__gte=start, occurred_at__lt=start + timedelta(days=1))
+        while True:
+            ids = list(events.order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            deleted += events.filter(pk__gte=ids[0], pk__lte=ids[-1]).delete()[0]
+    return deleted
@@ -0,0 +1,121 @@
+"""
+JWT revocation on top of `rest_framework_simplejwt`.
+
+- Refresh tokens are revoked through `activities.revocation` (`RevokedToken` rows) instead of the
+  `token_blacklist` app's tables: on rotation, on `POST /api/auth/token/blacklist/` (logout).
+- Every token carries the user's `token_generation`. `POST /api/users/logout-all/` increments it,
+  which invalidates all tokens issued to the user so far, access tokens included.
+"""
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.utils.translation import gettext_lazy as _
+from rest_framework import serializers
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt import authentication
+from rest_framework_simplejwt import serializers as jwt_serializers
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken, UntypedToken
+
+TOKEN_GENERATION_CLAIM = 'token_generation'
+
+
+def get_store():
+    """Returns the revocation store; `activities.revocation` is imported on first use, not when DRF loads this module."""
+    from . import revocation
+
+    return revocation.get_store()
+
+
+def is_current_generation(token, user):
+    # Tokens issued before the claim existed belong to generation 0
+    return token.get(TOKEN_GENERATION_CLAIM, 0) == user.token_generation
+
+
+def revoke_all_tokens(user):
+    """Invalidates every token issued to `user` so far (logout everywhere)."""
+    get_user_model().objects.filter(pk=user.pk).update(token_generation=F('token_generation') + 1)
+
+
+class RevocableRefreshToken(RefreshToken):
+    """A refresh token checked against, and revoked into, the revocation store."""
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token[TOKEN_GENERATION_CLAIM] = user.token_generation
+        return token
+
+    def verify(self, *args, **kwargs):
+        super().verify(*args, **kwargs)
+        if get_store().is_revoked(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_('Token is blacklisted'))
+
+    def blacklist(self):
+        """Revokes this token until it expires; returns `False` when it was revoked already."""
+        return get_store().revoke(self.payload[api_settings.JTI_CLAIM], self.payload['exp'])
+
+    def outstand(self):
+        # Only revocations are recorded (see `activities.revocation`); no outstanding token rows
+        return None
+
+
+class TokenObtainPairSerializer(jwt_serializers.TokenObtainPairSerializer):
+    token_class = RevocableRefreshToken
+
+
+class TokenRefreshSerializer(jwt_serializers.TokenRefreshSerializer):
+    """
+    Refreshes like simplejwt's serializer, and also rejects tokens of an older generation. A rotated
+    token is revoked atomically, so of two concurrent refreshes with the same token only one succeeds.
+    """
+    token_class = RevocableRefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        user = get_user_model().objects.filter(
+            **{api_settings.USER_ID_FIELD: refresh.payload.get(api_settings.USER_ID_CLAIM)}
+        ).first()
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        if not is_current_generation(refresh, user):
+            raise InvalidToken(_('Token has been revoked'))
+
+        data = {'access': str(refresh.access_token)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION and not refresh.blacklist():
+                raise InvalidToken(_('Token is blacklisted'))
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            data['refresh'] = str(refresh)
+        return data
+
+
+class TokenVerifySerializer(serializers.Serializer):
+    """Verifies a token's signature and expiry, and that it was neither revoked nor superseded."""
+    token = serializers.CharField(write_only=True)
+
+    def validate(self, attrs):
+        token = UntypedToken(attrs['token'])
+        if get_store().is_revoked(token.get(api_settings.JTI_CLAIM)):
+            raise serializers.ValidationError(_('Token is blacklisted'))
+        user = get_user_model().objects.filter(
+            **{api_settings.USER_ID_FIELD: token.get(api_settings.USER_ID_CLAIM)}
+        ).only('token_generation').first()
+        if user is None or not is_current_generation(token, user):
+            raise serializers.ValidationError(_('Token has been revoked'))
+        return {}
+
+
+class TokenBlacklistSerializer(jwt_serializers.TokenBlacklistSerializer):
+    token_class = RevocableRefreshToken
+
+
+class JWTAuthentication(authentication.JWTAuthentication):
+    """simplejwt's authentication, rejecting tokens issued before the user's last logout-everywhere."""
+    def get_user(self, validated_token):
+        # The user row is loaded for every request anyway, so the check costs nothing
+        user = super().get_user(validated_token)
+        if not is_current_generation(validated_token, user):
+            raise AuthenticationFailed(_('Token has been revoked'), code='token_revoked')
+        return user
@@ -0,0 +1,102 @@
+"""
+Batched backfills of large tables.
+
+A backfill updates a model's existing rows in primary key order, `BACKFILL['BATCH_SIZE']` rows per
+transaction with a `BACKFILL['PAUSE']` in between, so it never holds row locks for long nor saturates
+the database while production traffic is served. Each batch commits with its progress in
+`BackfillProgress`: an interrupted backfill resumes from the last committed batch, whether by running
+the migration again or with `manage.py resume_backfills`.
+
+Backfills are registered by name, at the top of the migration that runs them with
+`activities.operations.RunBackfill`; `resume_backfills` loads the migrations to find them:
+
+    register(Backfill('emaillog_to_email', 'activities.EmailLog', function=copy_recipient_email))
+
+The online way to add a required column with this toolkit:
+1. `AddField` it as nullable (no table rewrite);
+2. `RunBackfill` in a migration with `atomic = False`;
+3. `AlterField` it to `null=False` once every row has a value.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils.timezone import now
+
+logger = logging.getLogger(__name__)
+
+BACKFILLS = {}
+
+
+class Backfill:
+    """
+    A named update of every existing row of a model.
+    - `model`: The model label, e.g. `activities.Program`.
+    - `values`: `update()` keyword arguments (values or expressions) applied to each batch, or
+    - `function`: Called with each batch queryset; returns the number of rows it changed.
+    """
+    def __init__(self, name, model, values=None, function=None):
+        if (values is None) == (function is None):
+            raise ValueError('A backfill needs either values or a function')
+        self.name = name
+        self.model = model
+        self.values = values
+        self.function = function
+
+    def apply(self, queryset):
+        if self.function is not None:
+            return self.function(queryset)
+        return queryset.update(**self.values)
+
+
+def register(backfill):
+    """Registers a backfill under its name; returns it."""
+    BACKFILLS[backfill.name] = backfill
+    return backfill
+
+
+def get_backfill(name):
+    try:
+        return BACKFILLS[name]
+    except KeyError:
+        raise LookupError(f'No backfill named {name!r} is registered') from None
+
+
+def run_backfill(backfill, model, progress_model, batch_size=None, pause=None, report=None):
+    """
+    Runs (or resumes) `backfill` over `model` and returns its progress row.
+    Takes the model classes so migrations can pass their historical models.
+    - `report`: Called with the progress row after each batch.
+    """
+    batch_size = batch_size or settings.BACKFILL['BATCH_SIZE']
+    pause = settings.BACKFILL['PAUSE'] if pause is None else pause
+    progress, _ = progress_model.objects.get_or_create(name=backfill.name, defaults={'model': backfill.model})
+    if progress.completed_at is not None:
+        return progress
+    if progress.max_pk is None:
+        progress.max_pk = model.objects.aggregate(max_pk=Max('pk'))['max_pk'] or 0
+        progress.save(update_fields=['max_pk', 'updated_at'])
+
+    rows = model.objects.order_by('pk')
+    while progress.last_pk < progress.max_pk:
+        # The batch ends at the `batch_size`-th key after the last one, read from the primary key index
+        upper = rows.filter(pk__gt=progress.last_pk, pk__lte=progress.max_pk).values_list('pk', flat=True)[batch_size - 1:batch_size].first()
+        upper = upper if upper is not None else progress.max_pk
+        with transaction.atomic():
+            updated = backfill.apply(model.objects.filter(pk__gt=progress.last_pk, pk__lte=upper))
+            progress_model.objects.filter(pk=progress.pk).update(
+                last_pk=upper, rows_updated=F('rows_updated') + updated, updated_at=now(),
+            )
+        progress.last_pk = upper
+        progress.rows_updated += updated
+        logger.info('Backfill %s: %d/%d (%d rows updated)', backfill.name, upper, progress.max_pk, progress.rows_updated)
+        if report is not None:
+            report(progress)
+        if pause and progress.last_pk < progress.max_pk:
+            time.sleep(pause)
+
+    progress.completed_at = now()
+    progress.save(update_fields=['completed_at', 'updated_at'])
+    return progress
@@ -0,0 +1,171 @@
+"""
+Batched API calls: `POST /api/batch/` runs several calls to the routes of `activities.urls` in one
+round-trip.
+
+    {"requests": [
+        {"method": "GET", "path": "/api/users/me/"},
+        {"method": "GET", "path": "/api/programs/?ordering=start_date"},
+        {"method": "POST", "path": "/api/programs/3/favorite/"}
+    ]}
+
+The batch is authenticated once and every sub-request runs as that user (DRF's forced
+authentication), in the tenant of the batch. Consecutive `GET`s run concurrently, up to
+`BATCH['MAX_CONCURRENCY']` at a time; any other method waits for the calls before it and runs alone,
+so writes keep their order. The answer lists one `{status, headers, body}` per sub-request, in order;
+JSON bodies are embedded as they were rendered, without being parsed again.
+"""
+import asyncio
+import io
+import json
+import logging
+from urllib.parse import urlsplit
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import close_old_connections
+from django.http import Http404
+from django.urls import Resolver404, resolve
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .tenants import reset_current_tenant, set_current_tenant
+
+logger = logging.getLogger(__name__)
+
+API_PREFIX = '/api'
+
+METHODS = {'GET', 'POST', 'PUT', 'PATCH', 'DELETE'}
+
+# Headers of the batch request that sub-requests must not inherit
+REQUEST_ONLY_META = ('CONTENT_TYPE', 'CONTENT_LENGTH', 'HTTP_ACCEPT', 'HTTP_ACCEPT_ENCODING', 'HTTP_CONTENT_TYPE', 'HTTP_CONTENT_LENGTH')
+
+
+class BatchError(ValueError):
+    """A malformed batch; the message is returned to the client."""
+
+
+def parse_batch(body):
+    """Returns the validated sub-requests of a batch body as `(method, path, query, body bytes)`."""
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise BatchError('The body must be JSON.')
+    specs = data.get('requests') if isinstance(data, dict) else None
+    if not isinstance(specs, list) or not specs:
+        raise BatchError('`requests` must be a non-empty list.')
+    if len(specs) > settings.BATCH['MAX_REQUESTS']:
+        raise BatchError(f"At most {settings.BATCH['MAX_REQUESTS']} requests per batch.")
+    parsed = []
+    for spec in specs:
+        if not isinstance(spec, dict) or not isinstance(spec.get('path'), str):
+            raise BatchError('Every request needs a `path`.')
+        method = str(spec.get('method', 'GET')).upper()
+        if method not in METHODS:
+            raise BatchError(f'Unsupported method {method}.')
+        url = urlsplit(spec['path'])
+        if url.scheme or url.netloc or not url.path.startswith(API_PREFIX + '/'):
+            raise BatchError(f"Paths must start with {API_PREFIX}/.")
+        payload = json.dumps(spec['body']).encode() if spec.get('body') is not None else b''
+        parsed.append((method, url.path, url.query, payload))
+    return parsed
+
+
+def build_request(parent, method, path, query, payload):
+    """Returns a sub-request carrying the headers of `parent`, with its own method, path and body."""
+    environ = {key: value for key, value in parent.META.items() if key not in REQUEST_ONLY_META}
+    environ.update({
+        'REQUEST_METHOD': method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'HTTP_ACCEPT': 'application/json',
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(payload)),
+        'wsgi.input': io.BytesIO(payload),
+        'wsgi.url_scheme': parent.scheme,
+    })
+    return WSGIRequest(environ)
+
+
+def authenticate(request):
+    """
+    Authenticates the batch request with the API's authentication classes; returns `(user, auth)`.
+    Raises DRF's `AuthenticationFailed` or, for a session without CSRF token, `PermissionDenied`.
+    """
+    api_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    return api_request.user, api_request.auth
+
+
+def dispatch(parent, user, auth, method, path, query, payload, worker=False):
+    """
+    Runs one sub-request in this thread and returns `(rendered response or None, status)`.
+    `worker`: Runs outside the request thread, so database connections are cleaned up as around a request.
+    """
+    if worker:
+        close_old_connections()
+    token = set_current_tenant(parent.tenant)
+    try:
+        request = build_request(parent, method, path, query, payload)
+        request.tenant = parent.tenant
+        request._force_auth_user, request._force_auth_token = user, auth # read by DRF's Request
+        try:
+            match = resolve(path[len(API_PREFIX):], urlconf='activities.urls')
+        except Resolver404:
+            return None, 404
+        if iscoroutinefunction(match.func) or match.url_name == 'batch':
+            return None, 400 # streams and nested batches
+        try:
+            response = match.func(request, *match.args, **match.kwargs)
+        except Http404:
+            return None, 404
+        except Exception:
+            logger.exception('Batched %s %s failed', method, path)
+            return None, 500
+        if response.streaming:
+            return None, 400
+        if hasattr(response, 'render'):
+            response.render()
+        return response, response.status_code
+    finally:
+        reset_current_tenant(token)
+        if worker:
+            close_old_connections()
+
+
+async def run_batch(request, specs, user, auth):
+    """Runs the sub-requests of a batch (see the module docstring); returns their `(response, status)` in order."""
+    concurrency = settings.BATCH['MAX_CONCURRENCY']
+    semaphore = asyncio.Semaphore(concurrency)
+    results = [None] * len(specs)
+
+    async def read(position, spec):
+        async with semaphore:
+            results[position] = await sync_to_async(dispatch, thread_sensitive=False)(request, user, auth, *spec, worker=True)
+
+    reads = []
+    for position, spec in enumerate(specs):
+        if spec[0] == 'GET' and concurrency > 1:
+            reads.append(read(position, spec))
+            continue
+        # A write, or a read when concurrency is off, runs after everything before it
+        await asyncio.gather(*reads)
+        reads = []
+        results[position] = await sync_to_async(dispatch)(request, user, auth, *spec)
+    await asyncio.gather(*reads)
+    return results
+
+
+def encode_response(response, status):
+    """Returns the `{status, headers, body}` JSON of one sub-response, as bytes."""
+    if response is None:
+        return json.dumps({'status': status, 'headers': {}, 'body': None}).encode()
+    headers = {key: value for key, value in response.items() if key != 'Content-Length'}
+    content = response.content
+    if not content:
+        body = b'null'
+    elif response.get('Content-Type', '').startswith('application/json'):
+        body = content
+    else:
+        body = json.dumps(content.decode(response.charset or 'utf-8', errors='replace')).encode()
+    return b'{"status":%d,"headers":%s,"body":%s}' % (status, json.dumps(headers).encode(), body)
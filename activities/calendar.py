@@ -0,0 +1,150 @@
+"""
+iCalendar (RFC 5545) feeds of programs, for calendar apps to subscribe to.
+
+- `/api/calendar/programs.ics`: the tenant's catalog, optionally filtered on `category` / `audience`.
+- `/api/calendar/favorites/<token>.ics`: a user's favorites. Calendar apps cannot send a JWT, so the
+  feed is authenticated by the signed token in its URL (`feed_token`), given by
+  `GET /api/users/calendar/`; it stops working when the user logs out everywhere.
+
+Calendar apps poll their feeds every few minutes. The validators of each feed (an ETag from the number
+of rows and their latest `updated_at`, and that `updated_at` as Last-Modified) are cached per feed for
+the tenant's catalog version, and dropped when the user's favorites change, so most polls are answered
+with a 304 without a query. A changed feed is streamed from `.iterator()`: programs are read
+`CALENDAR['CHUNK_SIZE']` at a time and never all held in memory.
+"""
+import hashlib
+from datetime import timedelta, timezone
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import Count, Max
+
+from .favorites import catalog_version
+from .models import User
+from .tenants import cache_namespace
+
+CRLF = '\r\n'
+
+# Longest content line in octets, line break excluded; longer lines are folded
+LINE_LENGTH = 75
+
+TOKEN_SALT = 'activities.calendar'
+
+FEED_FIELDS = ('id', 'title', 'description', 'start_date', 'end_date', 'url', 'category', 'updated_at')
+
+
+def escape_text(value):
+    """Escapes a TEXT property value."""
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace(';', '\\;')
+        .replace(',', '\\,')
+        .replace('\r\n', '\\n')
+        .replace('\n', '\\n')
+        .replace('\r', '\\n')
+    )
+
+
+def fold(line):
+    """Returns a content line with its line break, folded every 75 octets without splitting a UTF-8 character."""
+    data = line.encode()
+    if len(data) <= LINE_LENGTH:
+        return line + CRLF
+    parts, start, limit = [], 0, LINE_LENGTH
+    while len(data) - start > limit:
+        end = start + limit
+        while data[end] & 0xC0 == 0x80: # a continuation byte: cut before its character
+            end -= 1
+        parts.append(data[start:end])
+        start, limit = end, LINE_LENGTH - 1 # continuation lines start with a space
+    parts.append(data[start:])
+    return (CRLF + ' ').join(part.decode() for part in parts) + CRLF
+
+
+def format_timestamp(value):
+    """Formats an aware datetime as a UTC DATE-TIME."""
+    return value.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def format_event(program, domain):
+    """Returns the VEVENT of a program, an all-day event from its start date to its end date."""
+    end_date = max(program.start_date, program.end_date) + timedelta(days=1) # DTEND is exclusive
+    updated_at = format_timestamp(program.updated_at)
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:program-{program.pk}@{domain}',
+        f'DTSTAMP:{updated_at}',
+        f'LAST-MODIFIED:{updated_at}',
+        f"DTSTART;VALUE=DATE:{program.start_date.strftime('%Y%m%d')}",
+        f"DTEND;VALUE=DATE:{end_date.strftime('%Y%m%d')}",
+        f'SUMMARY:{escape_text(program.title)}',
+        f'DESCRIPTION:{escape_text(program.description)}',
+        f'CATEGORIES:{escape_text(program.get_category_display())}',
+        f'URL:{program.url}',
+        'TRANSP:TRANSPARENT', # programs do not make the student busy
+        'END:VEVENT',
+    ]
+    return ''.join(fold(line) for line in lines)
+
+
+def stream_calendar(name, programs, domain):
+    """
+    Yields a VCALENDAR of `programs` in chunks of `CALENDAR['CHUNK_SIZE']` events, reading the
+    programs with `.iterator()` as the chunks are sent.
+    """
+    chunk_size = settings.CALENDAR['CHUNK_SIZE']
+    yield ''.join(fold(line) for line in [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//SAF//Programs//EN',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{escape_text(name)}',
+    ])
+    events = []
+    for program in programs.only(*FEED_FIELDS).order_by('pk').iterator(chunk_size=chunk_size):
+        events.append(format_event(program, domain))
+        if len(events) == chunk_size:
+            yield ''.join(events)
+            events = []
+    yield ''.join(events) + fold('END:VCALENDAR')
+
+
+def catalog_cache_key(tenant_id, category, audience):
+    """Returns the cache key of the validators of a (filtered) catalog feed."""
+    return f'{cache_namespace(tenant_id)}:calendar:programs:{category or "*"}:{audience or "*"}'
+
+
+def feed_validators(key, tenant_id, queryset, timestamps):
+    """
+    Returns the `(etag, last_modified)` of a feed, cached under `key` for the tenant's catalog version.
+    - `queryset`: The rows of the feed, counted so that removals change the ETag.
+    - `timestamps`: The `updated_at` fields of those rows whose latest value is the Last-Modified.
+    """
+    version = catalog_version(tenant_id)
+    cached = cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1], cached[2]
+    summary = queryset.order_by().aggregate(count=Count('pk'), **{f'latest_{n}': Max(field) for n, field in enumerate(timestamps)})
+    count = summary.pop('count')
+    last_modified = max((value for value in summary.values() if value is not None), default=None)
+    stamp = last_modified.isoformat() if last_modified is not None else ''
+    etag = '"%s"' % hashlib.md5(f'{key}:{count}:{stamp}'.encode()).hexdigest()
+    cache.set(key, (version, etag, last_modified), timeout=settings.CALENDAR['CACHE_TIMEOUT'])
+    return etag, last_modified
+
+
+def feed_token(user):
+    """Returns the token of a user's favorites calendar URL, valid until the user logs out everywhere."""
+    return signing.Signer(salt=TOKEN_SALT).sign(f'{user.pk}.{user.token_generation}')
+
+
+def user_from_token(token):
+    """Returns the active user of a favorites calendar token, or `None` for an invalid or revoked token."""
+    try:
+        user_id, generation = signing.Signer(salt=TOKEN_SALT).unsign(token).split('.')
+    except (signing.BadSignature, ValueError):
+        return None
+    return User.objects.filter(pk=user_id, token_generation=generation, is_active=True).only('id', 'tenant_id', 'username').first()
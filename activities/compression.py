@@ -0,0 +1,168 @@
+"""
+Negotiated response compression.
+
+`CompressionMiddleware` compresses responses with the best encoding both sides support, in the
+server's order of preference `COMPRESSION['ENCODINGS']`:
+- `br` needs the `brotli` package, `zstd` the `zstandard` package; they are skipped when not installed.
+- `gzip` is always available.
+Only bodies of `COMPRESSION['CONTENT_TYPES']` are compressed (images are compressed already and the
+event stream must not be buffered), and only from `COMPRESSION['MIN_SIZE']` bytes. Streaming
+responses are compressed chunk by chunk, each chunk flushed so the client receives it at once.
+
+Only complete `200` bodies are compressed: a `206` carries a byte range of the identity body
+(`Content-Range`), and errors are small. HTML is left out of `CONTENT_TYPES`: the admin and the
+browsable API pages embed CSRF tokens next to reflected input, which compression would expose to
+BREACH.
+"""
+import gzip
+import re
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# `gzip;q=0.8` -> ('gzip', '0.8')
+CODING_RE = re.compile(r'^\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?')
+
+
+class GzipCodec:
+    name = 'gzip'
+
+    def compress(self, data, level):
+        return gzip.compress(data, compresslevel=level, mtime=0)
+
+    def compressor(self, level):
+        """Returns `(compress_chunk, finish)`: each compressed chunk is flushed so it can be sent at once."""
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS) # gzip container
+        return lambda chunk: compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+class BrotliCodec:
+    name = 'br'
+
+    def compress(self, data, level):
+        return brotli.compress(data, quality=level)
+
+    def compressor(self, level):
+        compressor = brotli.Compressor(quality=level)
+        return lambda chunk: compressor.process(chunk) + compressor.flush(), compressor.finish
+
+
+class ZstdCodec:
+    name = 'zstd'
+
+    def compress(self, data, level):
+        return zstandard.ZstdCompressor(level=level).compress(data)
+
+    def compressor(self, level):
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        return lambda chunk: compressor.compress(chunk) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK), compressor.flush
+
+
+# Codecs whose library is installed, by content coding
+CODECS = {codec.name: codec for codec in (
+    GzipCodec(),
+    BrotliCodec() if brotli is not None else None,
+    ZstdCodec() if zstandard is not None else None,
+) if codec is not None}
+
+
+def parse_accept_encoding(header):
+    """Returns `{coding: q}` from an `Accept-Encoding` header; malformed entries are ignored."""
+    accepted = {}
+    for part in header.split(','):
+        match = CODING_RE.match(part)
+        if not match:
+            continue
+        coding, q = match.groups()
+        try:
+            accepted[coding.lower()] = float(q) if q is not None else 1.0
+        except ValueError:
+            continue
+    return accepted
+
+
+def negotiate(header, preferences=None):
+    """
+    Returns the codec to compress with for an `Accept-Encoding` header, or `None`.
+    The client's highest weight wins; ties go to the earliest encoding of `preferences`.
+    """
+    accepted = parse_accept_encoding(header)
+    best, best_q = None, 0.0
+    for name in preferences or settings.COMPRESSION['ENCODINGS']:
+        if name not in CODECS:
+            continue
+        q = accepted.get(name, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = CODECS[name], q
+    return best
+
+
+def is_compressible(response):
+    content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+    return any(content_type.startswith(prefix) for prefix in settings.COMPRESSION['CONTENT_TYPES'])
+
+
+def compress_sync(chunks, compress_chunk, finish):
+    for chunk in chunks:
+        yield compress_chunk(chunk)
+    yield finish()
+
+
+async def compress_async(chunks, compress_chunk, finish):
+    async for chunk in chunks:
+        yield compress_chunk(chunk)
+    yield finish()
+
+
+class CompressionMiddleware:
+    """Compresses the response body with the negotiated encoding (see `negotiate`)."""
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.status_code != 200 or response.has_header('Content-Range'):
+            return response
+        if response.has_header('Content-Encoding') or not is_compressible(response):
+            return response
+        if not response.streaming and len(response.content) < settings.COMPRESSION['MIN_SIZE']:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        codec = negotiate(request.headers.get('Accept-Encoding', ''))
+        if codec is None:
+            return response
+        level = settings.COMPRESSION['LEVELS'][codec.name]
+
+        if response.streaming:
+            compress_chunk, finish = codec.compressor(level)
+            if response.is_async:
+                response.streaming_content = compress_async(response.streaming_content, compress_chunk, finish)
+            else:
+                response.streaming_content = compress_sync(response.streaming_content, compress_chunk, finish)
+            # The compressed size is unknown until the stream ends
+            del response.headers['Content-Length']
+        else:
+            compressed = codec.compress(response.content, level)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        # A strong ETag names the identity body; the compressed one only matches weakly (RFC 9110 8.8.1)
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = codec.name
+        return response
@@ -0,0 +1,28 @@
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils.timezone import now
+
+from .models import MessageContact
+
+
+def message_hash(email, message):
+    """
+    Returns the dedupe hash of a contact message: the SHA-256 of the case-folded email and the
+    message with its whitespace collapsed, so re-submissions of the same form hash alike.
+    """
+    normalized = f"{email.strip().casefold()}\n{' '.join(message.split())}"
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def find_recent_duplicate(dedupe_hash, tenant_id):
+    """Returns the tenant's newest message with the same hash inside the dedupe window, if any."""
+    since = now() - timedelta(seconds=settings.CONTACT_MESSAGES['DEDUPE_WINDOW'])
+    return (
+        MessageContact.objects
+        .filter(tenant_id=tenant_id, dedupe_hash=dedupe_hash, created_at__gte=since)
+        .order_by('-created_at')
+        .first()
+    )
+
@@ -0,0 +1,103 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import now
+from djoser import email
+
+from .models import EmailLog, EmailStatus
+from .tasks import send_email, serialize_message
+
+
+def queue_message(message, recipient=None, campaign=None):
+    """
+    Records a pending `EmailLog` for a rendered message, with the message as its payload, and
+    queues the `send_email` task.
+    """
+    log = EmailLog.objects.create(
+        recipient=recipient,
+        campaign=campaign,
+        to_email=message.to[0] if message.to else '',
+        subject=message.subject[:255],
+        payload=serialize_message(message),
+    )
+    send_email.delay(log.pk)
+    return log
+
+
+def requeue_failed(queryset=None, batch_size=500):
+    """
+    Queues the `FAILED` deliveries of `queryset` (default: every `EmailLog`) for another attempt,
+    `batch_size` rows per update and bulk enqueue. Rows without a payload cannot be rebuilt and are skipped.
+    Returns the number of deliveries queued.
+    """
+    queryset = (queryset if queryset is not None else EmailLog.objects.all()).filter(
+        status=EmailStatus.FAILED, payload__isnull=False,
+    )
+    queued = 0
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            ids = list(queryset.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return queued
+            EmailLog.objects.filter(pk__in=ids).update(status=EmailStatus.PENDING, updated_at=now())
+            send_email.delay_many([(pk,) for pk in ids])
+        last_pk = ids[-1]
+        queued += len(ids)
+
+
+def purge_email_logs(before, statuses=None, batch_size=5000):
+    """
+    Deletes the deliveries logged before `before` (only those in `statuses` when given),
+    `batch_size` rows per delete so the table is never locked for long.
+    Returns the number of rows deleted.
+    """
+    queryset = EmailLog.objects.filter(timestamp__lt=before)
+    if statuses:
+        queryset = queryset.filter(status__in=statuses)
+    deleted = 0
+    while True:
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += EmailLog.objects.filter(pk__in=ids).delete()[0]
+
+
+class QueuedEmailMixin:
+    """
+    Renders a Djoser email in the request (templates need the request and user), but leaves the
+    SMTP round-trip to the `send_email` background task.
+    """
+    def send(self, to, fail_silently=False, **kwargs):
+        self.render()
+        self.to = to
+        self.cc = kwargs.pop('cc', [])
+        self.bcc = kwargs.pop('bcc', [])
+        self.reply_to = kwargs.pop('reply_to', [])
+        self.from_email = kwargs.pop('from_email', settings.DEFAULT_FROM_EMAIL)
+        self.request = None
+        user = self.context.get('user')
+        return queue_message(self, recipient=user if getattr(user, 'pk', None) else None)
+
+
+class ActivationEmail(QueuedEmailMixin, email.ActivationEmail):
+    pass
+
+
+class ConfirmationEmail(QueuedEmailMixin, email.ConfirmationEmail):
+    pass
+
+
+class PasswordResetEmail(QueuedEmailMixin, email.PasswordResetEmail):
+    pass
+
+
+class PasswordChangedConfirmationEmail(QueuedEmailMixin, email.PasswordChangedConfirmationEmail):
+    pass
+
+
+class UsernameChangedConfirmationEmail(QueuedEmailMixin, email.UsernameChangedConfirmationEmail):
+    pass
+
+
+class UsernameResetEmail(QueuedEmailMixin, email.UsernameResetEmail):
+    pass
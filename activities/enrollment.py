@@ -0,0 +1,215 @@
+import csv
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.password_validation import validate_password
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.utils.timezone import localdate
+from rest_framework import serializers
+
+from .models import User, UserType, Gender
+from .tasks import send_activation_emails
+from .tenants import current_tenant_id
+
+
+class EnrollmentRowSerializer(serializers.Serializer):
+    """
+    Validates one CSV row of a cohort enrollment.
+    Unlike `UserCreateWithProfileSerializer` it runs no per-row uniqueness queries; uniqueness is
+    checked for a whole batch at once by `enroll_users`.
+    """
+    username = serializers.CharField(max_length=150, validators=[UnicodeUsernameValidator()])
+    email = serializers.EmailField(max_length=254)
+    first_name = serializers.CharField(max_length=150, required=False, allow_blank=True, default='')
+    last_name = serializers.CharField(max_length=150, required=False, allow_blank=True, default='')
+    type = serializers.ChoiceField(choices=UserType.choices, required=False, default=UserType.STUDENT)
+    gender = serializers.ChoiceField(choices=Gender.choices, required=False, default=Gender.OTHER)
+    date_enrollment = serializers.DateField(required=False, default=localdate)
+    password = serializers.CharField(required=False, allow_blank=True, default='', write_only=True)
+
+
+@dataclass
+class EnrollmentResult:
+    """
+    Outcome of a bulk enrollment.
+    - `created`: Number of users created.
+    - `errors`: `(row number, errors)` for every rejected row.
+    - `elapsed`: Seconds spent.
+    """
+    created: int = 0
+    errors: list = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def users_per_second(self):
+        return self.created / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'created': self.created,
+            'errors': [{'row': row, 'errors': errors} for row, errors in self.errors],
+            'elapsed': round(self.elapsed, 3),
+            'users_per_second': round(self.users_per_second, 1),
+        }
+
+
+def read_csv(file):
+    """Yields the rows of a CSV upload (bytes or text) as dicts keyed by the header line."""
+    if isinstance(file.read(0), bytes):
+        file = io.TextIOWrapper(file, encoding='utf-8-sig')
+    yield from csv.DictReader(file)
+
+
+def _setup_worker():
+    django.setup() # a no-op under fork; needed where children are spawned
+
+
+class PasswordHasher:
+    """
+    Hashes passwords with `make_password`, on a pool of `processes` worker processes when more
+    than one is requested. The pool is only started once there is something to hash.
+    """
+    def __init__(self, processes=1):
+        self.processes = processes or os.cpu_count() or 1
+        self.executor = None
+
+    def hash(self, passwords):
+        if self.processes == 1 or len(passwords) < 2:
+            return [make_password(password) for password in passwords]
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.processes, initializer=_setup_worker)
+        chunksize = max(len(passwords) // (self.processes * 4), 1)
+        return list(self.executor.map(make_password, passwords, chunksize=chunksize))
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown()
+
+
+DUPLICATE_ERROR = {'non_field_errors': ['A user with this username or email already exists.']}
+
+
+def _insert(numbered_users, result):
+    """
+    Inserts `(row number, user)` pairs with one `bulk_create`. When a concurrent signup or enrollment
+    took a username since the batch was checked, the rows are inserted one by one instead and the
+    conflicting ones rejected, so the rest of the batch is kept. Returns the created users.
+    """
+    try:
+        with transaction.atomic():
+            return User.objects.bulk_create([user for _, user in numbered_users])
+    except IntegrityError:
+        pass
+    created = []
+    for number, user in numbered_users:
+        try:
+            with transaction.atomic():
+                user.save(force_insert=True)
+        except IntegrityError:
+            user.pk = None
+            result.errors.append((number, DUPLICATE_ERROR))
+        else:
+            created.append(user)
+    return created
+
+
+def _enroll_batch(batch, result, hasher, send_activation, tenant_id):
+    """Validates, de-duplicates and inserts one batch of `(row number, row)` pairs."""
+    valid, unhashed = [], set()
+    for number, row in batch:
+        serializer = EnrollmentRowSerializer(data=row)
+        if not serializer.is_valid():
+            result.errors.append((number, serializer.errors))
+            continue
+        data = serializer.validated_data
+        data['email'] = data['email'].strip().lower()
+        if hasher is None and data['password']:
+            data['password'] = '' # not hashed here: the user picks one through the activation link
+            unhashed.add(number)
+        if data['password']:
+            try:
+                validate_password(data['password'], User(username=data['username'], email=data['email']))
+            except ValidationError as error:
+                result.errors.append((number, {'password': error.messages}))
+                continue
+        valid.append((number, data))
+
+    # One IN query for the whole batch (emails compared case-insensitively), then duplicates inside the batch itself
+    usernames = {data['username'] for _, data in valid}
+    emails = {data['email'] for _, data in valid}
+    taken = list(
+        User.objects.annotate(email_lower=Lower('email'))
+        .filter(Q(username__in=usernames) | Q(email_lower__in=emails))
+        .values_list('username', 'email')
+    )
+    taken_usernames = {username for username, _ in taken}
+    taken_emails = {email.lower() for _, email in taken}
+    users = []
+    for number, data in valid:
+        if data['username'] in taken_usernames or data['email'] in taken_emails:
+            result.errors.append((number, DUPLICATE_ERROR))
+            continue
+        taken_usernames.add(data['username'])
+        taken_emails.add(data['email'])
+        password = data.pop('password')
+        user = User(**data, tenant_id=tenant_id)
+        user.password = password # hashed below
+        user.is_active = bool(password) or not (send_activation or number in unhashed)
+        users.append((number, user))
+
+    with_password = [user for _, user in users if user.password]
+    if with_password:
+        for user, hashed in zip(with_password, hasher.hash([user.password for user in with_password])):
+            user.password = hashed
+    for _, user in users:
+        if not user.password:
+            user.set_unusable_password() # the user picks a password through the activation link
+
+    created = _insert(users, result)
+    inactive = [user.pk for user in created if not user.is_active]
+    if inactive:
+        send_activation_emails.delay(inactive)
+    result.created += len(created)
+
+
+def enroll_users(rows, batch_size=1000, processes=None, send_activation=True, tenant=None, hash_passwords=True):
+    """
+    Creates users in bulk from an iterable of row dicts (see `EnrollmentRowSerializer`).
+    - Rows are validated and inserted `batch_size` at a time with `bulk_create`.
+    - Username/email uniqueness is checked with one `IN` query per batch; rows whose username was
+      taken concurrently are rejected without failing their batch.
+    - Supplied passwords are hashed on a pool of `processes` worker processes (hashing is CPU bound);
+      `None` uses one per CPU. Without `hash_passwords` they are ignored and those users are sent
+      the activation email (even without `send_activation`) to pick a password.
+    - Rows without a password get an unusable password; with `send_activation` they stay inactive
+      and receive the activation email from a background task.
+    - Users join `tenant` (default: the current tenant).
+    Returns an `EnrollmentResult`.
+    """
+    result = EnrollmentResult()
+    started = time.perf_counter()
+    hasher = PasswordHasher(processes) if hash_passwords else None
+    tenant_id = tenant.pk if tenant else current_tenant_id()
+    try:
+        batch = []
+        for number, row in enumerate(rows, start=1):
+            batch.append((number, row))
+            if len(batch) >= batch_size:
+                _enroll_batch(batch, result, hasher, send_activation, tenant_id)
+                batch = []
+        if batch:
+            _enroll_batch(batch, result, hasher, send_activation, tenant_id)
+    finally:
+        if hasher is not None:
+            hasher.close()
+    result.elapsed = time.perf_counter() - started
+    return result
@@ -0,0 +1,131 @@
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+class InMemoryEventBackend:
+    """
+    Keeps the most recent catalog events in a bounded in-process buffer.
+    Suitable for tests and single-process deployments only: a stream only sees the events published by
+    its own process, so events published by WSGI workers never reach a separate ASGI process.
+    """
+    def __init__(self, max_events=1000):
+        self.events = deque(maxlen=max_events)
+        self.last_id = 0
+        self.lock = threading.Lock()
+
+    def publish(self, event):
+        with self.lock:
+            self.last_id += 1
+            self.events.append(dict(event, id=self.last_id))
+            return self.last_id
+
+    def read_since(self, last_id, limit=100):
+        """
+        Returns `(events, complete)` for the events published after `last_id`.
+        `complete` is False when some of those events were already evicted, or when `last_id` is
+        ahead of the last published id (the process restarted).
+        """
+        with self.lock:
+            if last_id > self.last_id:
+                return [], False
+            events = [event for event in self.events if event['id'] > last_id]
+            complete = not self.events or self.events[0]['id'] <= last_id + 1
+        return events[:limit], complete
+
+    def current_id(self):
+        return self.last_id
+
+
+class CacheEventBackend:
+    """
+    Keeps catalog events in the Django cache, so every worker sharing the cache sees the same stream.
+    - `catalog-events:seq` holds the id of the last published event.
+    - Each event is stored under its own key and expires after `timeout` seconds.
+    """
+    SEQUENCE_KEY = 'catalog-events:seq'
+
+    def __init__(self, timeout=60 * 60, gap_timeout=5.0):
+        self.timeout = timeout
+        self.gap_timeout = gap_timeout
+        self.gaps = {} # missing event id -> when a read first found it missing
+        self.lock = threading.Lock()
+
+    def event_key(self, event_id):
+        return f'catalog-events:{event_id}'
+
+    def publish(self, event):
+        cache.add(self.SEQUENCE_KEY, 0, timeout=None)
+        event_id = cache.incr(self.SEQUENCE_KEY)
+        cache.set(self.event_key(event_id), dict(event, id=event_id), timeout=self.timeout)
+        return event_id
+
+    def read_since(self, last_id, limit=100):
+        """
+        Returns `(events, complete)` for the events published after `last_id`, as long as they are
+        contiguous. `complete` is False when the client must resynchronise: the event after `last_id`
+        expired, or `last_id` is ahead of the sequence (the cache was flushed).
+        """
+        current = self.current_id()
+        if last_id > current:
+            return [], False
+        ids = range(last_id + 1, min(current, last_id + limit) + 1)
+        found = cache.get_many([self.event_key(event_id) for event_id in ids])
+        events = []
+        for event_id in ids:
+            event = found.get(self.event_key(event_id))
+            if event is None:
+                break # a later event is still being written, and is picked up by the next read
+            events.append(event)
+        if events or current == last_id:
+            self.gaps.pop(last_id + 1, None)
+            return events, True
+        # The next event is missing: a concurrent publisher took its id and has not written it yet,
+        # or it expired. Only the second lasts; wait `gap_timeout` seconds before telling them apart.
+        with self.lock:
+            if len(self.gaps) > 1000:
+                self.gaps.clear()
+            first_missed = self.gaps.setdefault(last_id + 1, time.monotonic())
+        if time.monotonic() - first_missed < self.gap_timeout:
+            return [], True
+        return [], False
+
+    def current_id(self):
+        return cache.get(self.SEQUENCE_KEY, 0)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Returns the configured event backend (`CATALOG_EVENTS['BACKEND']`), created once per process."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend_class = import_string(settings.CATALOG_EVENTS['BACKEND'])
+                _backend = backend_class(**settings.CATALOG_EVENTS.get('OPTIONS', {}))
+    return _backend
+
+
+def set_backend(backend):
+    """Replaces the event backend, e.g. with a fresh `InMemoryEventBackend` in tests."""
+    global _backend
+    _backend = backend
+
+
+def publish(event_type, program_id, tenant_id, **extra):
+    """
+    Publishes a compact change event once the current transaction commits.
+    - `event_type`: e.g. `program.updated` or `program.image.deleted`.
+    - `program_id`: The program the change belongs to.
+    - `tenant_id`: The tenant of the program; streams only forward their own tenant's events.
+    """
+    event = {'type': event_type, 'program': program_id, 'tenant': tenant_id, **extra}
+    transaction.on_commit(lambda: get_backend().publish(event))
@@ -0,0 +1,110 @@
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Favorite
+from .tenants import cache_namespace
+
+
+def catalog_version_key(tenant_id):
+    """
+    Returns the key of a tenant's catalog version, bumped whenever one of its programs changes so every
+    cached feed embedding a summary goes stale at once, without touching other tenants' feeds.
+    """
+    return f'{cache_namespace(tenant_id)}:favorites:catalog-version'
+
+
+def catalog_version(tenant_id):
+    key = catalog_version_key(tenant_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, timeout=None)
+        version = cache.get(key, 1)
+    return version
+
+
+def feed_cache_key(user_id, tenant_id):
+    """Returns the cache key of a user's favorites feed, stored with the catalog version it was built for."""
+    return f'{cache_namespace(tenant_id)}:favorites:feed:{user_id}'
+
+
+def favorite_ids_cache_key(user_id):
+    """Returns the cache key of the sorted program ids a user favorited."""
+    return f'favorites:ids:{user_id}'
+
+
+def favorites_calendar_cache_key(user_id):
+    """Returns the cache key of the validators (ETag, Last-Modified) of a user's favorites calendar."""
+    return f'favorites:calendar:{user_id}'
+
+
+def favorites_queryset(user_id):
+    """
+    Returns the favorites of a user, newest first, with the program joined in the same query.
+    Served by the (`user`, `-created_at`) index on `Favorite`.
+    """
+    return (
+        Favorite.objects
+        .filter(user_id=user_id)
+        .select_related('program')
+        .order_by('-created_at')
+    )
+
+
+def get_favorites_feed(user_id, tenant_id, serialize):
+    """
+    Returns the serialized favorites feed of a user, from the cache when it was built for the current
+    catalog version of the tenant.
+    - `serialize`: Called with `favorites_queryset(user_id)` on a cache miss; returns the feed data.
+      The serializer stays with the view, so this module (loaded by the signals) needs no DRF import.
+    """
+    key = feed_cache_key(user_id, tenant_id)
+    version = catalog_version(tenant_id)
+    cached = cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    data = serialize(favorites_queryset(user_id))
+    cache.set(key, (version, data), timeout=settings.FAVORITES_FEED_CACHE_TIMEOUT)
+    return data
+
+
+def get_favorite_program_ids(user_id):
+    """
+    Returns the ids of the programs a user favorited as a sorted `array` of 64-bit integers.
+    The array is cached as raw bytes (8 per favorite), so even a large set is one small cache value,
+    and rebuilt with an index-only scan of the (`user`, `program`) constraint when missing.
+    """
+    key = favorite_ids_cache_key(user_id)
+    cached = cache.get(key)
+    if cached is not None:
+        ids = array('q')
+        ids.frombytes(cached)
+        return ids
+    ids = array('q', sorted(Favorite.objects.filter(user_id=user_id).values_list('program_id', flat=True)))
+    cache.set(key, ids.tobytes(), timeout=settings.FAVORITES_FEED_CACHE_TIMEOUT)
+    return ids
+
+
+def is_favorite(user_id, program_id):
+    """Returns whether a user favorited a program (a binary search of `get_favorite_program_ids`)."""
+    ids = get_favorite_program_ids(user_id)
+    position = bisect_left(ids, program_id)
+    return position < len(ids) and ids[position] == program_id
+
+
+def invalidate_favorites_feed(user_id, tenant_id):
+    """Drops the cached favorites feed, favorite program ids and calendar validators of a single user."""
+    cache.delete_many([
+        feed_cache_key(user_id, tenant_id), favorite_ids_cache_key(user_id), favorites_calendar_cache_key(user_id),
+    ])
+
+
+def invalidate_all_favorites_feeds(tenant_id):
+    """Drops every cached favorites feed of a tenant by moving it to a new catalog version."""
+    key = catalog_version_key(tenant_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
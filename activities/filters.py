@@ -0,0 +1,44 @@
+import django_filters
+from django.db.models import Count
+
+from .models import Program, ProgramRequirement
+
+
+class NumberInFilter(django_filters.BaseInFilter, django_filters.NumberFilter):
+    pass
+
+
+class ProgramFilter(django_filters.FilterSet):
+    """
+    Filters for `ProgramViewSet`.
+    - `requirements_all`: Comma-separated requirement ids; programs linked to every one of them.
+    - `requirements_any`: Comma-separated requirement ids; programs linked to at least one of them.
+    Both run as a single subquery over the `ProgramRequirement` through-table (see `requirement_program_idx`)
+    instead of one join per requirement.
+    """
+    requirements_all = NumberInFilter(method='filter_requirements_all')
+    requirements_any = NumberInFilter(method='filter_requirements_any')
+
+    class Meta:
+        model = Program
+        fields = ['type', 'category', 'audience', 'kind', 'target_academic']
+
+    def filter_requirements_all(self, queryset, name, value):
+        requirement_ids = set(value)
+        if not requirement_ids:
+            return queryset
+        # GROUP BY program HAVING COUNT(*) = n; (program, requirement) is unique so no DISTINCT is needed
+        matching = (
+            ProgramRequirement.objects
+            .filter(requirement_id__in=requirement_ids)
+            .values('program_id')
+            .annotate(matched=Count('requirement_id'))
+            .filter(matched=len(requirement_ids))
+            .values('program_id')
+        )
+        return queryset.filter(pk__in=matching)
+
+    def filter_requirements_any(self, queryset, name, value):
+        if not value:
+            return queryset
+        return queryset.filter(pk__in=ProgramRequirement.objects.filter(requirement_id__in=value).values('program_id'))
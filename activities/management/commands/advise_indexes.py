@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, NotSupportedError
+
+from activities.advisor import advise
+from activities.models import SlowQuery
+from activities.slowlog import get_recorder
+
+
+class Command(BaseCommand):
+    help = 'Explains the slowest recorded queries and suggests indexes for the activities models.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=10, help='Number of queries to explain, by total time.')
+        parser.add_argument('--min-calls', type=int, default=1, help='Skip queries sampled fewer times.')
+        parser.add_argument('--reset', action='store_true', help='Delete the recorded queries afterwards.')
+
+    def handle(self, *args, **options):
+        get_recorder().flush() # samples recorded by this process
+        queries = SlowQuery.objects.filter(calls__gte=options['min_calls']).order_by('-total_time')[:options['limit']]
+        suggested = {}
+        for rank, query in enumerate(queries, 1):
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'#{rank} {query.calls} calls, {query.total_time:.1f} ms total, {query.max_time:.1f} ms max'
+            ))
+            self.stdout.write(f'  {query.sql}')
+            if not query.sql.upper().startswith(('SELECT', 'WITH')):
+                self.stdout.write('  (not a read: not explained)')
+                continue
+            try:
+                plan, suggestions = advise(query)
+            except (DatabaseError, NotSupportedError) as exc:
+                self.stderr.write(f'  Cannot explain: {exc}')
+                continue
+            for line in plan:
+                self.stdout.write(f'  plan: {line}')
+            for suggestion in suggestions:
+                self.stdout.write(self.style.WARNING(f'  suggest: {suggestion}'))
+                suggested.setdefault(suggestion.name, suggestion)
+
+        if suggested:
+            self.stdout.write(self.style.SUCCESS(f'{len(suggested)} index(es) suggested:'))
+            for suggestion in suggested.values():
+                self.stdout.write(f'  {suggestion}')
+        else:
+            self.stdout.write(self.style.SUCCESS('No index to suggest'))
+        if options['reset']:
+            deleted, _ = SlowQuery.objects.all().delete()
+            self.stdout.write(f'Deleted {deleted} recorded queries')
@@ -0,0 +1,99 @@
+import random
+import statistics
+import time
+from datetime import date
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from activities.favorites import favorite_ids_cache_key, favorites_queryset, is_favorite
+from activities.models import Favorite, Program, User
+from activities.tenants import get_default_tenant
+
+INSERT_CHUNK = 10000
+
+
+class Command(BaseCommand):
+    help = (
+        'Times the favorites lookups as the table grows to each --sizes row count. '
+        'The rows are inserted in a transaction that is rolled back at the end.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+        parser.add_argument('--programs', type=int, default=1000, help='Programs to spread the favorites over.')
+        parser.add_argument('--samples', type=int, default=200, help='Lookups timed per query and size.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        sizes = sorted(options['sizes'])
+        if sizes[0] <= 0 or options['programs'] <= 0:
+            raise CommandError('--sizes and --programs must be positive')
+        self.random = random.Random(options['seed'])
+        self.stdout.write(f"{'rows':>10}  {'query':<22} {'p50 ms':>8} {'p95 ms':>8}")
+        with transaction.atomic():
+            self.seed_catalog(options['programs'], -(-sizes[-1] // options['programs']))
+            inserted = 0
+            for size in sizes:
+                self.insert_favorites(inserted, size)
+                inserted = size
+                if connection.vendor == 'postgresql':
+                    with connection.cursor() as cursor:
+                        cursor.execute(f'ANALYZE {Favorite._meta.db_table}')
+                self.report(size, options['samples'])
+            transaction.set_rollback(True)
+        cache.delete_many([favorite_ids_cache_key(user_id) for user_id in self.user_ids])
+
+    def seed_catalog(self, programs, users):
+        tenant = get_default_tenant()
+        today = date.today()
+        self.program_ids = [program.pk for program in Program.objects.bulk_create(
+            [
+                Program(tenant=tenant, title=f'bench program {n}', description='', cost=0,
+                        start_date=today, end_date=today, url='https://example.com/')
+                for n in range(programs)
+            ],
+            batch_size=1000,
+        )]
+        self.user_ids = [user.pk for user in User.objects.bulk_create(
+            [User(tenant=tenant, username=f'bench-user-{n}', email=f'bench-user-{n}@example.com') for n in range(users)],
+            batch_size=1000,
+        )]
+
+    def insert_favorites(self, start, stop):
+        # Row n pairs user n // programs with program n % programs, so every pair is distinct
+        programs = len(self.program_ids)
+        for chunk in range(start, stop, INSERT_CHUNK):
+            Favorite.objects.bulk_create([
+                Favorite(user_id=self.user_ids[n // programs], program_id=self.program_ids[n % programs])
+                for n in range(chunk, min(chunk + INSERT_CHUNK, stop))
+            ])
+        self.populated_users = self.user_ids[:-(-stop // programs)]
+
+    def report(self, size, samples):
+        users = [self.random.choice(self.populated_users) for _ in range(samples)]
+        programs = [self.random.choice(self.program_ids) for _ in range(samples)]
+        cache.delete_many([favorite_ids_cache_key(user_id) for user_id in set(users)])
+        queries = {
+            'my favorites (page)': lambda user_id, program_id: list(favorites_queryset(user_id)[:20]),
+            'who favorited (page)': lambda user_id, program_id: list(
+                Favorite.objects.filter(program_id=program_id).order_by('-created_at').values_list('user_id', flat=True)[:20]
+            ),
+            'membership (query)': lambda user_id, program_id: Favorite.objects.filter(
+                user_id=user_id, program_id=program_id
+            ).exists(),
+            'membership (cache)': lambda user_id, program_id: is_favorite(user_id, program_id),
+        }
+        for label, query in queries.items():
+            if label == 'membership (cache)':
+                for user_id in set(users): # time warm lookups only
+                    is_favorite(user_id, 0)
+            timings = []
+            for user_id, program_id in zip(users, programs):
+                started = time.perf_counter()
+                query(user_id, program_id)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            p95 = timings[min(int(len(timings) * 0.95), len(timings) - 1)]
+            self.stdout.write(f'{size:>10}  {label:<22} {statistics.median(timings):8.3f} {p95:8.3f}')
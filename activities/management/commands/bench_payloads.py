@@ -0,0 +1,65 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from activities import compression, renderers
+from activities.models import Program
+from activities.serializer import ProgramSerializer
+
+# Fastest and strongest level of each encoding, for --levels
+LEVEL_RANGE = {'gzip': (1, 9), 'br': (0, 11), 'zstd': (1, 19)}
+
+
+def best_time(function, repeat):
+    """Returns the fastest of `repeat` runs of `function`, in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+class Command(BaseCommand):
+    help = (
+        'Renders the program listing with each JSON renderer and compresses it with each installed '
+        'encoding, reporting CPU time against bytes saved.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=100, help='Programs in the payload.')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--levels', action='store_true',
+                            help='Also try the fastest and the strongest level of each encoding.')
+
+    def handle(self, *args, **options):
+        programs = Program.objects.prefetch_related('requirements', 'additional_images')[:options['limit']]
+        data = ProgramSerializer(programs, many=True).data
+        if not data:
+            raise CommandError('There are no programs to render')
+        repeat = options['repeat']
+
+        self.stdout.write(f"{'renderer':<20} {'ms':>8} {'bytes':>10}")
+        rendered = {}
+        classes = [JSONRenderer] + ([renderers.FastJSONRenderer] if renderers.orjson is not None else [])
+        for renderer_class in classes:
+            renderer = renderer_class()
+            rendered[renderer_class.__name__] = body = renderer.render(data)
+            self.stdout.write(f'{renderer_class.__name__:<20} {best_time(lambda: renderer.render(data), repeat):8.3f} {len(body):10}')
+        if len(set(rendered.values())) > 1:
+            raise CommandError('The renderers produced different bytes')
+
+        body = rendered['JSONRenderer']
+        self.stdout.write(f"\n{'encoding':<12} {'level':>5} {'ms':>8} {'bytes':>10} {'saved':>7} {'MB/s':>8}")
+        for name, codec in compression.CODECS.items():
+            default = settings.COMPRESSION['LEVELS'][name]
+            levels = sorted({default, *LEVEL_RANGE[name]}) if options['levels'] else [default]
+            for level in levels:
+                compressed = codec.compress(body, level)
+                elapsed = best_time(lambda: codec.compress(body, level), repeat)
+                self.stdout.write(
+                    f'{name:<12} {level:>5} {elapsed:8.3f} {len(compressed):10} '
+                    f'{1 - len(compressed) / len(body):7.1%} {len(body) / 1e6 / (elapsed / 1000):8.1f}'
+                )
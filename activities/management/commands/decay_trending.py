@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from activities.trending import redecay
+
+
+class Command(BaseCommand):
+    help = 'Decays every trending score to now, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        updated = redecay(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Decayed the trending scores of {updated} programs in {time.perf_counter() - started:.2f}s'
+        ))
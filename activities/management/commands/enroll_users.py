@@ -0,0 +1,47 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from activities.enrollment import enroll_users, read_csv
+from activities.models import Tenant
+
+
+class Command(BaseCommand):
+    help = (
+        'Creates users in bulk from a CSV file with the columns username, email and optionally '
+        'first_name, last_name, type, gender, date_enrollment, password.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--processes', type=int, default=None,
+                            help='Password hashing processes (default: one per CPU, 1 hashes in-process).')
+        parser.add_argument('--tenant', help='Slug of the tenant the users join (default: TENANTS["DEFAULT"]).')
+        parser.add_argument('--no-activation', action='store_true',
+                            help='Create users without a password as active and send no activation email.')
+
+    def handle(self, *args, **options):
+        tenant = None
+        if options['tenant']:
+            tenant = Tenant.objects.filter(slug=options['tenant']).first()
+            if tenant is None:
+                raise CommandError(f"Unknown tenant {options['tenant']!r}")
+        try:
+            file = open(options['csv_file'], newline='', encoding='utf-8-sig')
+        except OSError as error:
+            raise CommandError(error)
+        with file:
+            result = enroll_users(
+                read_csv(file),
+                batch_size=options['batch_size'],
+                processes=options['processes'],
+                send_activation=not options['no_activation'],
+                tenant=tenant,
+            )
+        for row, errors in result.errors:
+            self.stderr.write(f'Row {row}: {json.dumps(errors)}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {result.created} users in {result.elapsed:.2f}s '
+            f'({result.users_per_second:.0f} users/s), {len(result.errors)} rows rejected'
+        ))
@@ -0,0 +1,75 @@
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# `import time:      self [us] |    cumulative | imported package`
+IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\| (\s*)(\S+)\s*$')
+
+BOOT_SCRIPTS = {
+    'setup': 'import django; django.setup()',
+    'urls': (
+        'import django; django.setup(); '
+        'from django.urls import get_resolver; get_resolver().url_patterns'
+    ),
+    'wsgi': 'import SAF_backend.wsgi',
+    'asgi': 'import SAF_backend.asgi',
+}
+
+
+def parse_importtime(output):
+    """
+    Parses the `-X importtime` report into a list of `(module, self_us, cumulative_us, depth)`.
+    """
+    rows = []
+    for line in output.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return rows
+
+
+class Command(BaseCommand):
+    help = 'Reports the import time per module of a fresh interpreter booting the project (python -X importtime).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', choices=sorted(BOOT_SCRIPTS), default='urls',
+                            help='What to boot: django.setup() only, plus the URLconf, or the WSGI/ASGI application.')
+        parser.add_argument('--sort', choices=['self', 'cumulative'], default='self')
+        parser.add_argument('--limit', type=int, default=25)
+        parser.add_argument('--by-package', action='store_true',
+                            help='Aggregate self time per top-level package.')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'SAF_backend.settings'))
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', BOOT_SCRIPTS[options['target']]],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if result.returncode:
+            raise CommandError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'boot failed')
+        rows = parse_importtime(result.stderr)
+        total_us = sum(self_us for _, self_us, _, _ in rows)
+
+        if options['by_package']:
+            packages = defaultdict(int)
+            for module, self_us, _, _ in rows:
+                packages[module.split('.')[0]] += self_us
+            report = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+            self.stdout.write(f"{'self ms':>9}  package")
+            for package, self_us in report[:options['limit']]:
+                self.stdout.write(f'{self_us / 1000:9.1f}  {package}')
+        else:
+            index = 1 if options['sort'] == 'self' else 2
+            report = sorted(rows, key=lambda row: row[index], reverse=True)
+            self.stdout.write(f"{'self ms':>9} {'cumul ms':>9}  module")
+            for module, self_us, cumulative_us, _ in report[:options['limit']]:
+                self.stdout.write(f'{self_us / 1000:9.1f} {cumulative_us / 1000:9.1f}  {module}')
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(rows)} modules imported in {total_us / 1000:.1f} ms (target: {options['target']})"
+        ))
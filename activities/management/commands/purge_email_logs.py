@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from activities.email import purge_email_logs
+from activities.models import EmailStatus
+
+
+class Command(BaseCommand):
+    help = 'Deletes email deliveries past their retention period (EMAIL_LOG settings), in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.EMAIL_LOG['PURGE_BATCH_SIZE'])
+
+    def handle(self, *args, **options):
+        current = now()
+        retention = settings.EMAIL_LOG
+        deleted = purge_email_logs(
+            current - timedelta(days=retention['RETENTION_DAYS']),
+            statuses=[EmailStatus.SENT, EmailStatus.PENDING],
+            batch_size=options['batch_size'],
+        )
+        # Failures are kept longer, for the delivery reports and retries
+        deleted += purge_email_logs(
+            current - timedelta(days=retention['FAILED_RETENTION_DAYS']),
+            statuses=[EmailStatus.FAILED],
+            batch_size=options['batch_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} email deliveries'))
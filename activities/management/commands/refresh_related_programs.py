@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from activities.related import refresh_related
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the precomputed related programs (all programs, or the given ids).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('program_ids', nargs='*', type=int)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        refreshed = refresh_related(options['program_ids'] or None, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Refreshed related programs of {refreshed} programs in {time.perf_counter() - started:.2f}s'
+        ))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from activities.models import Requirement, ProgramRequirement
+from activities.requirements import relink_duplicates
+
+
+class Command(BaseCommand):
+    help = 'Merges requirements with the same normalized description and re-links their programs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing.')
+
+    def handle(self, *args, **options):
+        merged, relinked, deleted = relink_duplicates(Requirement, ProgramRequirement, dry_run=options['dry_run'])
+        prefix = 'Would merge' if options['dry_run'] else 'Merged'
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix} {merged} duplicate requirements: {relinked} links re-linked, {deleted} redundant links deleted'
+        ))
@@ -0,0 +1,46 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+
+from activities.backfill import BACKFILLS, get_backfill, run_backfill
+from activities.models import BackfillProgress
+
+
+class Command(BaseCommand):
+    help = 'Resumes interrupted batched backfills (every unfinished one, or those named), or lists them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*')
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument('--pause', type=float, help='Seconds between batches.')
+        parser.add_argument('--list', action='store_true', help='Only list the recorded backfills.')
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for progress in BackfillProgress.objects.order_by('created_at'):
+                state = f'done {progress.completed_at:%Y-%m-%d %H:%M}' if progress.completed_at else 'pending'
+                self.stdout.write(f'{progress.name:<40} {progress.last_pk:>12}/{progress.max_pk or 0:<12} {progress.rows_updated:>10} rows  {state}')
+            return
+
+        MigrationLoader(connection) # imports the migrations, which register their backfills
+        names = options['names'] or list(
+            BackfillProgress.objects.filter(completed_at__isnull=True).order_by('created_at').values_list('name', flat=True)
+        )
+        if not names:
+            self.stdout.write('No backfill to resume.')
+            return
+        for name in names:
+            try:
+                backfill = get_backfill(name)
+            except LookupError as exc:
+                raise CommandError(f'{exc} (registered: {", ".join(sorted(BACKFILLS)) or "none"})')
+            progress = run_backfill(
+                backfill,
+                apps.get_model(backfill.model),
+                BackfillProgress,
+                batch_size=options['batch_size'],
+                pause=options['pause'],
+                report=lambda progress: self.stdout.write(f'{progress.name}: {progress.last_pk}/{progress.max_pk}'),
+            )
+            self.stdout.write(self.style.SUCCESS(f'{name}: done, {progress.rows_updated} rows updated'))
@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from activities.email import requeue_failed
+from activities.models import EmailLog, EmailStatus
+
+
+class Command(BaseCommand):
+    help = 'Queues the FAILED email deliveries for another attempt, in bulk.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, help='Only deliveries logged in the last N hours.')
+        parser.add_argument('--campaign', type=int, help='Only deliveries of this WeeklyEmail id.')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help='Count the deliveries without queueing them.')
+
+    def handle(self, *args, **options):
+        queryset = EmailLog.objects.all()
+        if options['hours']:
+            queryset = queryset.filter(timestamp__gte=now() - timedelta(hours=options['hours']))
+        if options['campaign']:
+            queryset = queryset.filter(campaign_id=options['campaign'])
+        if options['dry_run']:
+            count = queryset.filter(status=EmailStatus.FAILED, payload__isnull=False).count()
+            self.stdout.write(f'{count} failed deliveries would be queued')
+            return
+        queued = requeue_failed(queryset, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Queued {queued} failed deliveries'))
@@ -0,0 +1,28 @@
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.timezone import localdate, now
+
+from activities.analytics import get_buffer, purge_events, rollup
+
+
+class Command(BaseCommand):
+    help = 'Aggregates raw analytics events into daily program and search counters, then purges old events.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat, help='Last day to roll up (default: yesterday).')
+        parser.add_argument('--days', type=int, default=1, help='Number of days to roll up, ending at --date.')
+        parser.add_argument('--no-purge', action='store_true', help='Keep raw events past ANALYTICS["RETENTION_DAYS"] (only rolled up days are purged).')
+
+    def handle(self, *args, **options):
+        get_buffer().flush() # events recorded by this process
+        last_day = options['date'] or localdate() - timedelta(days=1)
+        for offset in range(options['days'] - 1, -1, -1):
+            day = last_day - timedelta(days=offset)
+            programs, searches = rollup(day)
+            self.stdout.write(f'{day}: {programs} program rows, {searches} search rows')
+        if not options['no_purge']:
+            deleted = purge_events(now() - timedelta(days=settings.ANALYTICS['RETENTION_DAYS']))
+            self.stdout.write(f'Purged {deleted} raw events')
+        self.stdout.write(self.style.SUCCESS('Analytics rolled up'))
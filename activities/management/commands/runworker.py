@@ -0,0 +1,59 @@
+import multiprocessing
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils.module_loading import autodiscover_modules
+
+from activities.taskqueue import run_worker
+
+
+def run_until_signalled(**worker_options):
+    """Runs a worker that finishes its current tasks and returns on SIGINT or SIGTERM."""
+    stop_event = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop_event.set())
+    run_worker(stop_event=stop_event, **worker_options)
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background tasks (TASKS backend "database") on a pool of threads or processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help='Threads per worker process.')
+        parser.add_argument('--processes', type=int, default=1, help='Worker processes to fork.')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between polls when idle.')
+        parser.add_argument('--once', action='store_true', help='Exit once no task is due.')
+
+    def handle(self, *args, **options):
+        autodiscover_modules('tasks') # registers every app's @task functions
+        worker_options = {
+            'concurrency': options['concurrency'],
+            'poll_interval': options['poll_interval'],
+            'once': options['once'],
+        }
+
+        if options['processes'] <= 1:
+            self.stdout.write(f"Worker started with {options['concurrency']} threads")
+            run_until_signalled(**worker_options)
+            return
+
+        connections.close_all() # children must not share the parent's database connections
+        processes = [
+            multiprocessing.Process(target=run_until_signalled, kwargs=worker_options, daemon=True)
+            for _ in range(options['processes'])
+        ]
+        for process in processes:
+            process.start()
+
+        def stop(*_):
+            # Each child finishes its current tasks; the parent waits for them below
+            for process in processes:
+                if process.is_alive():
+                    process.terminate() # SIGTERM
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, stop)
+        self.stdout.write(f"Started {len(processes)} worker processes with {options['concurrency']} threads each")
+        for process in processes:
+            process.join()
@@ -0,0 +1,25 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from activities.reminders import send_due_reminders
+
+
+class Command(BaseCommand):
+    help = 'Emails users whose favorite programs start soon; safe to rerun (run it daily).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat, help='Day to run for (default: today).')
+        parser.add_argument('--days', type=int, help='Days ahead to remind of (default: REMINDERS["DAYS_BEFORE"]).')
+        parser.add_argument('--batch-size', type=int, help='Users per transaction (default: REMINDERS["BATCH_SIZE"]).')
+
+    def handle(self, *args, **options):
+        result = send_due_reminders(today=options['date'], days_before=options['days'], batch_size=options['batch_size'])
+        self.stdout.write(
+            f"{result['reminders']} reminders for {result['users']} users: "
+            f"{result['sent']} emails sent, {result['failed']} failed"
+        )
+        if result['failed']:
+            self.stdout.write(self.style.WARNING('Failed emails can be retried from the EmailLog admin'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Reminders sent'))
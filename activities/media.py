@@ -0,0 +1,149 @@
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.exceptions import AuthenticationFailed, PermissionDenied
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .storage import HASHED_NAME_RE
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def _is_authenticated(request):
+    """Authenticates the request with the API authentication classes (session, JWT, ...)."""
+    authenticators = [auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    try:
+        return Request(request, authenticators=authenticators).user.is_authenticated
+    except (AuthenticationFailed, PermissionDenied): # invalid credentials, or a failed CSRF check
+        return False
+
+
+def _normalize_path(path):
+    """
+    Returns `path` with its `.` and `..` segments resolved, as the storage resolves them, or `None`
+    when it leaves `MEDIA_ROOT`. The private prefixes are matched against this path.
+    """
+    name = posixpath.normpath(path)
+    if name == '.' or name == '..' or name.startswith(('../', '/')):
+        return None
+    return name
+
+
+def _parse_range(header, size):
+    """
+    Returns `(start, end)` (inclusive) for a single `bytes=` range, `None` when the header should be
+    ignored (absent, malformed or multi-range), or raises ValueError when the range is unsatisfiable.
+    """
+    match = RANGE_RE.match(header or '')
+    if not match or not any(match.groups()):
+        return None
+    start, end = match.groups()
+    if not start: # suffix range: the last `end` bytes
+        length = int(end)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_media(request, path):
+    """
+    Serves an uploaded file from `MEDIA_ROOT`.
+    - Files under `MEDIA_SERVING['PRIVATE_PREFIXES']` require an authenticated user.
+    - With `MEDIA_SERVING['SENDFILE_HEADER']` set, the bytes are handed to the front server through
+      `X-Accel-Redirect` (nginx) or `X-Sendfile` (Apache, lighttpd) instead of a Python worker.
+    - Otherwise the file is streamed with `Range` support.
+    Content-addressed names never change, so they are cached forever (`immutable`).
+    """
+    options = settings.MEDIA_SERVING
+    path = _normalize_path(path)
+    if path is None:
+        raise Http404
+    private = any(path.startswith(prefix) for prefix in options['PRIVATE_PREFIXES'])
+    if private and not _is_authenticated(request):
+        raise Http404
+    try:
+        full_path = default_storage.path(path)
+    except SuspiciousFileOperation:
+        raise Http404
+    try:
+        stat = os.stat(full_path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    hashed = HASHED_NAME_RE.match(path)
+    if hashed:
+        etag = '"%s"' % os.path.splitext(os.path.basename(path))[0]
+        max_age = options['IMMUTABLE_MAX_AGE']
+    else:
+        etag = '"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+        max_age = options['MAX_AGE']
+    cache_control = '%s, max-age=%d%s' % ('private' if private else 'public', max_age, ', immutable' if hashed else '')
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        content_type, encoding = mimetypes.guess_type(full_path)
+        content_type = content_type or 'application/octet-stream'
+        header = options['SENDFILE_HEADER']
+        if header == 'X-Accel-Redirect':
+            response = HttpResponse(content_type=content_type)
+            response[header] = options['ACCEL_REDIRECT_PREFIX'] + quote(path)
+        elif header:
+            response = HttpResponse(content_type=content_type)
+            response[header] = full_path
+        else:
+            response = _file_response(request, full_path, stat.st_size, content_type)
+        if encoding:
+            response['Content-Encoding'] = encoding
+        response['Last-Modified'] = http_date(stat.st_mtime)
+    if response.status_code in (200, 206, 304): # not on errors (412, 416), which must not be cached
+        response['ETag'] = etag
+        response['Cache-Control'] = cache_control
+    return response
+
+
+def _file_response(request, full_path, size, content_type):
+    """Streams the whole file, or the requested byte range with a 206 response."""
+    try:
+        byte_range = _parse_range(request.headers.get('Range'), size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    if byte_range is None:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(_read_range(full_path, start, end - start + 1), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    return response
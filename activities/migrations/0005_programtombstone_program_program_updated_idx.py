@@ -0,0 +1,25 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0004_alter_favorite_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProgramTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('program_id', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='program',
+            index=models.Index(fields=['updated_at', 'id'], name='program_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,106 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:55
+
+import hashlib
+import logging
+import os
+import posixpath
+import re
+
+from django.db import migrations, transaction
+
+logger = logging.getLogger(__name__)
+
+# (model, field) pairs holding uploads written under the old `<prefix>/None/<filename>` layout
+FILE_FIELDS = [
+    ('User', 'profile_image'),
+    ('Program', 'image'),
+    ('ProgramImage', 'image'),
+]
+
+BATCH_SIZE = 500
+
+# The layout of `activities.storage.ContentAddressedStorage` when this migration was written, copied
+# so that later changes to the storage do not change what this migration does
+EXTENSION_RE = re.compile(r'^\.[a-z0-9]{1,10}$')
+HASHED_NAME_RE = re.compile(r'^[^/]+/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.[a-z0-9]{1,10})?$')
+
+
+def hashed_name(name, content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    hexdigest = digest.hexdigest()
+    prefix = name.replace('\\', '/').split('/')[0] if '/' in name else 'files'
+    ext = os.path.splitext(name)[1].lower()
+    ext = ext if EXTENSION_RE.match(ext) else ''
+    return posixpath.join(prefix, hexdigest[:2], hexdigest[2:4], f'{hexdigest}{ext}')
+
+
+def delete_files(storage, names, references):
+    """Deletes the files in `names` that no `(model, field)` of `references` still points to."""
+    names = set(names)
+    for model, field_name in references:
+        names -= set(model.objects.filter(**{f'{field_name}__in': names}).values_list(field_name, flat=True))
+    for name in names:
+        storage.delete(name)
+
+
+def relocate_files(model, field_name, batch_size=BATCH_SIZE, references=None):
+    """
+    Moves the files of `model.<field_name>` into the content-addressed layout, one batch of rows
+    per transaction. Rows already in the layout are skipped, so the relocation can be resumed.
+    Old files are removed once the batch referencing their new name has committed, unless a row of
+    `references` (`(model, field)` pairs, default this one) still points to them.
+    """
+    storage = model._meta.get_field(field_name).storage
+    references = references or [(model, field_name)]
+    queryset = model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True}).order_by('pk')
+    last_pk = None
+    while True:
+        batch = queryset.filter(pk__gt=last_pk) if last_pk is not None else queryset
+        rows = list(batch.only('pk', field_name)[:batch_size])
+        if not rows:
+            break
+        last_pk = rows[-1].pk
+        changed, old_names = [], []
+        for row in rows:
+            old_name = getattr(row, field_name).name
+            if HASHED_NAME_RE.match(old_name):
+                continue
+            if not storage.exists(old_name):
+                logger.warning('Missing file %s for %s %s', old_name, model.__name__, row.pk)
+                continue
+            with storage.open(old_name) as content:
+                new_name = hashed_name(old_name, content)
+                if not storage.exists(new_name): # the same bytes may already be stored
+                    saved = storage.save(new_name, content)
+                    if saved != new_name: # stored meanwhile: keep that copy, drop the renamed one
+                        storage.delete(saved)
+            setattr(row, field_name, new_name)
+            changed.append(row)
+            old_names.append(old_name)
+        with transaction.atomic():
+            model.objects.bulk_update(changed, [field_name])
+            transaction.on_commit(lambda names=old_names: delete_files(storage, names, references))
+
+
+def relocate_media(apps, schema_editor):
+    # A file may be shared by rows of several models: it is only deleted once none points to it
+    references = [(apps.get_model('activities', model_name), field_name) for model_name, field_name in FILE_FIELDS]
+    for model, field_name in references:
+        relocate_files(model, field_name, references=references)
+
+
+class Migration(migrations.Migration):
+    # Each batch commits on its own, so an interrupted run resumes where it stopped
+    atomic = False
+
+    dependencies = [
+        ('activities', '0005_programtombstone_program_program_updated_idx'),
+    ]
+
+    operations = [
+        # Irreversible: the old names are gone once their files are deleted
+        migrations.RunPython(relocate_media, reverse_code=None),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0006_relocate_media'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='messagecontact',
+            name='dedupe_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='messagecontact',
+            name='idempotency_key',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='messagecontact',
+            index=models.Index(fields=['dedupe_hash', 'created_at'], name='message_dedupe_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.7 on 2026-10-19 11:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0008_backgroundtask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedProgram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('score', models.FloatField()),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('program', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_entries', to='activities.program')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='activities.program')),
+            ],
+            options={
+                'ordering': ['program', 'rank'],
+                'indexes': [models.Index(fields=['program', 'rank'], name='related_program_rank_idx')],
+                'constraints': [models.UniqueConstraint(fields=('program', 'related'), name='unique_related_program')],
+            },
+        ),
+    ]
@@ -0,0 +1,110 @@
+# Generated by Django 5.1.7 on 2026-10-19 14:20
+
+from collections import defaultdict
+
+from django.db import migrations, models, transaction
+from django.db.models import Count
+
+
+# Frozen copy of `activities.requirements` when this migration was written, so that later changes
+# to the app code do not change what this migration does
+def normalize_requirement(description):
+    """Returns the taxonomy key of a requirement: its description case-folded, whitespace collapsed."""
+    return ' '.join(description.split()).casefold()
+
+
+def relink_duplicates(requirement_model, through_model, dry_run=False):
+    """
+    Merges requirements whose descriptions normalize to the same key.
+    - The oldest requirement of each group is kept and gets the key.
+    - Program links to the others are moved onto it; a link the program already has is deleted
+      instead, so (`program`, `requirement`) stays unique.
+    - The other requirements are deleted.
+    Links repeated for the same program and requirement are deleted too, in every group, including
+    groups of a single requirement.
+    Takes the model classes so migrations can pass their historical models.
+    Returns `(merged requirements, relinked links, deleted links)`.
+    """
+    groups = defaultdict(list)
+    for pk, description in requirement_model.objects.order_by('pk').values_list('pk', 'description').iterator():
+        groups[normalize_requirement(description)].append(pk)
+
+    # Requirements linked more than once to the same program, found with one query
+    repeated = set(
+        through_model.objects.values('program_id', 'requirement_id').annotate(links=Count('pk'))
+        .filter(links__gt=1).values_list('requirement_id', flat=True)
+    )
+
+    merged = relinked = deleted = 0
+    for key, ids in groups.items():
+        keep, duplicates = ids[0], ids[1:]
+        if not duplicates and keep not in repeated:
+            continue
+        # Canonical links first, so the link a program keeps is the one already pointing at `keep`
+        links = through_model.objects.filter(requirement_id__in=ids).values_list('pk', 'program_id', 'requirement_id')
+        linked_programs = set()
+        to_relink, to_delete = [], []
+        for pk, program_id, requirement_id in sorted(links, key=lambda link: (link[2] != keep, link[0])):
+            if program_id in linked_programs:
+                to_delete.append(pk)
+                continue
+            linked_programs.add(program_id)
+            if requirement_id != keep:
+                to_relink.append(pk)
+        merged += len(duplicates)
+        relinked += len(to_relink)
+        deleted += len(to_delete)
+        if dry_run or not (duplicates or to_delete):
+            continue
+        with transaction.atomic():
+            through_model.objects.filter(pk__in=to_delete).delete()
+            through_model.objects.filter(pk__in=to_relink).update(requirement_id=keep)
+            requirement_model.objects.filter(pk__in=duplicates).delete()
+
+    if not dry_run:
+        # Keys of the requirements that survived, written only where they changed
+        stale = []
+        for requirement in requirement_model.objects.only('pk', 'description', 'key').iterator():
+            key = normalize_requirement(requirement.description)
+            if requirement.key != key:
+                requirement.key = key
+                stale.append(requirement)
+        requirement_model.objects.bulk_update(stale, ['key'], batch_size=500)
+    return merged, relinked, deleted
+
+
+
+def merge_requirements(apps, schema_editor):
+    relink_duplicates(apps.get_model('activities', 'Requirement'), apps.get_model('activities', 'ProgramRequirement'))
+
+
+class Migration(migrations.Migration):
+    # Duplicates are merged group by group; the constraints are added once the data allows them
+    atomic = False
+
+    dependencies = [
+        ('activities', '0009_relatedprogram'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='requirement',
+            name='key',
+            field=models.CharField(default='', editable=False, max_length=255),
+            preserve_default=False,
+        ),
+        migrations.RunPython(merge_requirements, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='requirement',
+            name='key',
+            field=models.CharField(editable=False, max_length=255, unique=True),
+        ),
+        migrations.AddConstraint(
+            model_name='programrequirement',
+            constraint=models.UniqueConstraint(fields=('program', 'requirement'), name='unique_program_requirement'),
+        ),
+        migrations.AddIndex(
+            model_name='programrequirement',
+            index=models.Index(fields=['requirement', 'program'], name='requirement_program_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.1.7 on 2026-10-19 11:12
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0010_requirement_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalyticsEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('VIEW', 'View'), ('SEARCH', 'Search'), ('FAVORITE', 'Favorite')], max_length=10)),
+                ('program_id', models.BigIntegerField(blank=True, null=True)),
+                ('user_id', models.BigIntegerField(blank=True, null=True)),
+                ('query', models.CharField(blank=True, default='', max_length=255)),
+                ('results', models.PositiveIntegerField(blank=True, null=True)),
+                ('occurred_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query', models.CharField(max_length=255)),
+                ('date', models.DateField()),
+                ('searches', models.PositiveIntegerField(default=0)),
+                ('empty_searches', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('date', 'query'), name='unique_search_daily_stat')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProgramDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('favorites', models.PositiveIntegerField(default=0)),
+                ('program', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='activities.program')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('program', 'date'), name='unique_program_daily_stat')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.7 on 2026-10-19 11:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0011_analytics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='program',
+            name='trending_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='program',
+            name='trending_score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='program',
+            index=models.Index(fields=['-trending_score', 'id'], name='program_trending_idx'),
+        ),
+    ]
@@ -0,0 +1,127 @@
+# Generated by Django 5.1.7 on 2026-10-19 11:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Models owning rows of a tenant; the rows that predate tenants go to the default one
+TENANT_MODELS = ['User', 'Program', 'MessageContact']
+
+
+def create_default_tenant(apps, schema_editor):
+    Tenant = apps.get_model('activities', 'Tenant')
+    tenant, _ = Tenant.objects.get_or_create(slug=settings.TENANTS['DEFAULT'], defaults={'name': 'Default'})
+    for model_name in TENANT_MODELS:
+        apps.get_model('activities', model_name).objects.filter(tenant__isnull=True).update(tenant=tenant)
+
+
+class Migration(migrations.Migration):
+    # The existing rows are backfilled before the tenant columns become NOT NULL
+    atomic = False
+
+    dependencies = [
+        ('activities', '0012_program_trending'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tenant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('name', models.CharField(max_length=255)),
+                ('slug', models.SlugField(unique=True)),
+                ('domain', models.CharField(blank=True, max_length=255, null=True, unique=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='messagecontact',
+            name='message_dedupe_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='program',
+            name='program_updated_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='program',
+            name='program_trending_idx',
+        ),
+        migrations.AddField(
+            model_name='programtombstone',
+            name='tenant_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='messagecontact',
+            name='idempotency_key',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name='programtombstone',
+            name='deleted_at',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AddIndex(
+            model_name='programtombstone',
+            index=models.Index(fields=['tenant_id', 'deleted_at'], name='tombstone_tenant_deleted_idx'),
+        ),
+        migrations.AddField(
+            model_name='messagecontact',
+            name='tenant',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='messages', to='activities.tenant'),
+        ),
+        migrations.AddField(
+            model_name='program',
+            name='tenant',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='programs', to='activities.tenant'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='tenant',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='users', to='activities.tenant'),
+        ),
+        migrations.RunPython(create_default_tenant, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='messagecontact',
+            name='tenant',
+            field=models.ForeignKey(blank=True, db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='messages', to='activities.tenant'),
+        ),
+        migrations.AlterField(
+            model_name='program',
+            name='tenant',
+            field=models.ForeignKey(blank=True, db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='programs', to='activities.tenant'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='tenant',
+            field=models.ForeignKey(blank=True, on_delete=django.db.models.deletion.PROTECT, related_name='users', to='activities.tenant'),
+        ),
+        migrations.AddIndex(
+            model_name='messagecontact',
+            index=models.Index(fields=['tenant', 'dedupe_hash', 'created_at'], name='message_dedupe_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='messagecontact',
+            index=models.Index(fields=['tenant', '-created_at'], name='message_tenant_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='program',
+            index=models.Index(fields=['tenant', 'updated_at', 'id'], name='program_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='program',
+            index=models.Index(fields=['tenant', '-trending_score', 'id'], name='program_trending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='program',
+            index=models.Index(fields=['tenant', '-start_date'], name='program_tenant_start_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='messagecontact',
+            constraint=models.UniqueConstraint(fields=('tenant', 'idempotency_key'), name='unique_message_idempotency_key'),
+        ),
+    ]
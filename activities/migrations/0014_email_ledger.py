@@ -0,0 +1,86 @@
+# Generated by Django 5.1.7 on 2026-10-19 11:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# The ledger is append-only in timestamp order, so on PostgreSQL a BRIN index keeps time-range scans
+# (retention, reports) cheap at a fraction of a B-tree's size. Declarative partitioning is not used:
+# it needs `timestamp` in the primary key, which Django 5.1 cannot model.
+BRIN_INDEX = 'emaillog_timestamp_brin'
+
+
+def create_brin_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {BRIN_INDEX} ON activities_emaillog USING brin (timestamp) '
+            'WITH (pages_per_range = 32)'
+        )
+
+
+def drop_brin_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {BRIN_INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0013_tenants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emaillog',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='emaillog',
+            name='campaign',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='deliveries', to='activities.weeklyemail'),
+        ),
+        migrations.AddField(
+            model_name='emaillog',
+            name='last_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='emaillog',
+            name='payload',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='emaillog',
+            name='recipient',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='email_logs', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='emaillog',
+            name='sent_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='emaillog',
+            name='subject',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='emaillog',
+            name='to_email',
+            field=models.EmailField(blank=True, default='', max_length=254),
+        ),
+        migrations.AddIndex(
+            model_name='emaillog',
+            index=models.Index(fields=['status', 'timestamp'], name='emaillog_status_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='emaillog',
+            index=models.Index(fields=['recipient', '-timestamp'], name='emaillog_recipient_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='emaillog',
+            index=models.Index(fields=['campaign', 'status'], name='emaillog_campaign_idx'),
+        ),
+        migrations.RunPython(create_brin_index, drop_brin_index),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.1.7 on 2026-10-19 11:24
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def delete_duplicate_favorites(apps, schema_editor):
+    # The oldest favorite of each (user, program) pair is kept
+    Favorite = apps.get_model('activities', 'Favorite')
+    duplicated = (
+        Favorite.objects.values('user_id', 'program_id')
+        .annotate(keep=Min('pk'), rows=models.Count('pk'))
+        .filter(rows__gt=1)
+    )
+    for pair in duplicated.iterator():
+        Favorite.objects.filter(user_id=pair['user_id'], program_id=pair['program_id']).exclude(pk=pair['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0014_email_ledger'),
+    ]
+
+    # The composite indexes are built before the single-column FK indexes they replace are dropped
+    operations = [
+        migrations.RemoveIndex(
+            model_name='favorite',
+            name='favorite_user_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='favorite',
+            index=models.Index(fields=['user', '-created_at', 'program'], name='favorite_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='favorite',
+            index=models.Index(fields=['program', '-created_at', 'user'], name='favorite_program_created_idx'),
+        ),
+        migrations.RunPython(delete_duplicate_favorites, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='favorite',
+            constraint=models.UniqueConstraint(fields=('user', 'program'), name='unique_user_favorite'),
+        ),
+        migrations.AlterField(
+            model_name='favorite',
+            name='program',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='favorites', to='activities.program'),
+        ),
+        migrations.AlterField(
+            model_name='favorite',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='favorites', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-19 11:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0016_user_token_generation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackfillProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('model', models.CharField(max_length=100)),
+                ('last_pk', models.BigIntegerField(default=0)),
+                ('max_pk', models.BigIntegerField(blank=True, null=True)),
+                ('rows_updated', models.BigIntegerField(default=0)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'backfill progress',
+            },
+        ),
+    ]
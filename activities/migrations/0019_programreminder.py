@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-19 11:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0018_slowquery'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProgramReminder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('start_date', models.DateField()),
+                ('email_log', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reminders', to='activities.emaillog')),
+                ('program', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reminders', to='activities.program')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='program_reminders', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'program', 'start_date'), name='unique_program_reminder')],
+            },
+        ),
+    ]
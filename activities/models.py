@@ -1,8 +1,12 @@
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.utils.timezone import now
 from phonenumber_field.modelfields import PhoneNumberField
 
+from .requirements import normalize_requirement
+from .tenants import current_tenant_id
+
 # Abstract Base Models
 class BaseModel(models.Model):
     """
@@ -118,23 +122,64 @@ class MessageStatus(models.TextChoices):
     READ = 'READ', 'Read'
     RESPONDED = 'RESPONDED', 'Responded'
 
+class TaskStatus(models.TextChoices):
+    """
+    Enum for background task statuses.
+    - PENDING: Represents tasks waiting to run (including retries waiting for their backoff).
+    - RUNNING: Represents tasks claimed by a worker.
+    - SUCCEEDED: Represents tasks that completed.
+    - FAILED: Represents tasks that failed on their last allowed attempt.
+    """
+    PENDING = 'PENDING', 'Pending'
+    RUNNING = 'RUNNING', 'Running'
+    SUCCEEDED = 'SUCCEEDED', 'Succeeded'
+    FAILED = 'FAILED', 'Failed'
+
 # Function to define upload paths
+# The default storage (activities.storage.ContentAddressedStorage) only keeps the first directory
+# of these paths and files each upload under the hash of its content.
 def user_profile_image_path(instance, filename):
     """
     Function to define the upload path for user profile images.
-    Format: 'user_profiles/user_id/filename'
+    Format: 'user_profiles/filename', stored as 'user_profiles/<aa>/<bb>/<sha256>.<ext>'
     """
-    return f'user_profiles/{instance.id}/{filename}'
+    return f'user_profiles/{filename}'
 
 def program_image_path(instance, filename):
     """
     Function to define the upload path for program images.
-    Format: 'program_images/program_id/filename'
+    Format: 'program_images/filename', stored as 'program_images/<aa>/<bb>/<sha256>.<ext>'
     """
-    return f'program_images/{instance.id}/{filename}'
+    return f'program_images/{filename}'
+
+class TenantOwnedMixin:
+    """Saves rows created without a tenant under the current tenant (see `activities.tenants`)."""
+    def save(self, *args, **kwargs):
+        if self.tenant_id is None:
+            self.tenant_id = current_tenant_id()
+        super().save(*args, **kwargs)
 
 # Models
-class User(AbstractUser, BaseModel):
+class Tenant(BaseModel):
+    """
+    Model representing a tenant: one student activity federation hosted on this deployment.
+    - `name`: The display name of the federation.
+    - `slug`: The identifier sent in the tenant header.
+    - `domain`: The host the federation is served on, if it has its own.
+    """
+    name = models.CharField(max_length=255)
+    slug = models.SlugField(unique=True)
+    domain = models.CharField(max_length=255, unique=True, blank=True, null=True)
+
+    def __repr__(self):
+        """Returns a detailed string representation of the Tenant object."""
+        return f"Tenant(id={self.id}, slug={self.slug})"
+
+    def __str__(self):
+        """Returns a simple string representation of the Tenant object."""
+        return self.name
+
+class User(TenantOwnedMixin, AbstractUser, BaseModel):
     """
     Custom user model that extends Django's AbstractUser and BaseModel.
     - `type`: The type of user (Student, Teacher, Admin).
@@ -144,7 +189,10 @@ class User(AbstractUser, BaseModel):
     - `phone`: The user's phone number.
     - `date_of_birth`: The user's date of birth.
     - `profile_image`: The user's profile image.
+    - `tenant`: The federation the user belongs to.
+    - `token_generation`: Stamped into the user's JWTs; incremented to invalidate them all (see `activities.authentication`).
     """
+    tenant = models.ForeignKey(Tenant, on_delete=models.PROTECT, blank=True, related_name='users')
     type = models.CharField(max_length=1, choices=UserType.choices, default=UserType.STUDENT, db_index=True) # db_index for faster filtering
     gender = models.CharField(max_length=10, choices=Gender.choices, default=Gender.OTHER, db_index=True)
     bio = models.TextField(blank=True, null=True)
@@ -152,6 +200,7 @@ class User(AbstractUser, BaseModel):
     phone = PhoneNumberField(blank=True, null=True) # better phone number validation
     date_of_birth = models.DateField(blank=True, null=True)
     profile_image = models.ImageField(upload_to=user_profile_image_path, blank=True, null=True)
+    token_generation = models.PositiveIntegerField(default=0, editable=False)
 
     def __repr__(self):
         """Returns a detailed string representation of the User object."""
@@ -167,8 +216,24 @@ class Requirement(BaseModel):
     """
     Model representing a requirement for a program.
     - `description`: A description of the requirement.
+    - `key`: The normalized (case-folded, whitespace collapsed) description; unique, so one requirement
+      is shared by every program that needs it.
     """
     description = models.CharField(max_length=255)
+    key = models.CharField(max_length=255, unique=True, editable=False)
+
+    def clean(self):
+        # `key` is not editable, so forms skip its uniqueness check: report a collision on the description
+        super().clean()
+        key = normalize_requirement(self.description)
+        if Requirement.objects.filter(key=key).exclude(pk=self.pk).exists():
+            raise ValidationError({'description': 'A requirement with this description already exists.'})
+
+    def save(self, *args, **kwargs):
+        self.key = normalize_requirement(self.description)
+        if kwargs.get('update_fields') is not None and 'description' in kwargs['update_fields']:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'key'}
+        super().save(*args, **kwargs)
 
     def __repr__(self):
         """Returns a detailed string representation of the Requirement object."""
@@ -181,10 +246,19 @@ class Requirement(BaseModel):
 class ProgramRequirement(BaseModel):
     program = models.ForeignKey('Program', on_delete=models.CASCADE)
     requirement = models.ForeignKey(Requirement, on_delete=models.CASCADE)
-    
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['program', 'requirement'], name='unique_program_requirement'),
+        ]
+        indexes = [
+            # Requirement-leading, so requirement set filters group program ids from the index alone
+            models.Index(fields=['requirement', 'program'], name='requirement_program_idx'),
+        ]
+
     def __str__(self):
         return f"{self.program.title} - {self.requirement.description}"
-class Program(BaseModel):
+class Program(TenantOwnedMixin, BaseModel):
     """
     Model representing a program.
     - `title`: The title of the program.
@@ -200,7 +274,12 @@ class Program(BaseModel):
     - `kind`: The kind of program (Job, Internship, Scholarship).
     - `target_academic`: The target academic level (Student, Graduate, Both).
     - `image`: The program's featured image.
+    - `trending_score`: The time-decayed favorites/views score, as of `trending_at` (see `activities.trending`).
+    - `trending_at`: The date and time `trending_score` was last decayed or bumped.
+    - `tenant`: The federation the program belongs to.
     """
+    # Indexed as the leading column of the composite indexes below
+    tenant = models.ForeignKey(Tenant, on_delete=models.PROTECT, blank=True, related_name='programs', db_index=False)
     title = models.CharField(max_length=255, db_index=True)
     description = models.TextField()
     cost = models.DecimalField(max_digits=10, decimal_places=2)
@@ -215,11 +294,31 @@ class Program(BaseModel):
     target_academic = models.CharField(max_length=50, choices=TargetAcademic.choices, default=TargetAcademic.BOTH)
     requirements = models.ManyToManyField(Requirement, through='ProgramRequirement', related_name='programs')
     image = models.ImageField(upload_to=program_image_path, blank=True, null=True)
+    trending_score = models.FloatField(default=0, editable=False)
+    trending_at = models.DateTimeField(blank=True, null=True, editable=False)
 
     class Meta:
         constraints = [
             models.CheckConstraint(check=models.Q(start_date__lte=models.F('end_date')), name='start_date_lte_end_date') # check comstraint for start_date <= end_date
         ]
+        indexes = [
+            models.Index(fields=['tenant', 'updated_at', 'id'], name='program_updated_idx'), # serves the delta sync cursor
+            models.Index(fields=['tenant', '-trending_score', 'id'], name='program_trending_idx'), # serves ?ordering=-trending
+            models.Index(fields=['tenant', '-start_date'], name='program_tenant_start_idx'), # the default catalog listing
+        ]
+
+    # Written only by `activities.trending`, with its own updates
+    TRENDING_FIELDS = {'trending_score', 'trending_at'}
+
+    def save(self, *args, **kwargs):
+        # An update leaves the trending fields alone, so a stale instance never writes back an older score
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in deferred and field.name not in self.TRENDING_FIELDS
+            ]
+        super().save(*args, **kwargs)
 
     def __repr__(self):
         """Returns a detailed string representation of the Program object."""
@@ -229,6 +328,89 @@ class Program(BaseModel):
         """Returns a simple string representation of the Program object."""
         return self.title
 
+class RelatedProgram(BaseModel):
+    """
+    Model storing the precomputed related programs of a program (see `activities.related`).
+    - `program`: The program the list belongs to.
+    - `related`: A related program.
+    - `score`: The relatedness score (shared requirements, same category and audience).
+    - `rank`: The position of `related` in the list, starting at 1.
+    """
+    program = models.ForeignKey('Program', on_delete=models.CASCADE, related_name='related_entries')
+    related = models.ForeignKey('Program', on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        ordering = ['program', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['program', 'related'], name='unique_related_program'),
+        ]
+        indexes = [
+            models.Index(fields=['program', 'rank'], name='related_program_rank_idx'),
+        ]
+
+    def __repr__(self):
+        """Returns a detailed string representation of the RelatedProgram object."""
+        return f"RelatedProgram(program_id={self.program_id}, related_id={self.related_id}, rank={self.rank})"
+
+    def __str__(self):
+        """Returns a simple string representation of the RelatedProgram object."""
+        return f"{self.program_id} -> {self.related_id} ({self.score:.2f})"
+
+class ProgramTombstone(models.Model):
+    """
+    Model recording a deleted program, so offline clients can drop it on their next sync.
+    - `program_id`: The id of the deleted program.
+    - `tenant_id`: The id of the tenant the program belonged to.
+    - `deleted_at`: The date and time the program was deleted.
+    """
+    program_id = models.BigIntegerField()
+    tenant_id = models.BigIntegerField(blank=True, null=True)
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['tenant_id', 'deleted_at'], name='tombstone_tenant_deleted_idx'),
+        ]
+
+    def __repr__(self):
+        """Returns a detailed string representation of the ProgramTombstone object."""
+        return f"ProgramTombstone(id={self.id}, program_id={self.program_id}, deleted_at={self.deleted_at})"
+
+    def __str__(self):
+        """Returns a simple string representation of the ProgramTombstone object."""
+        return f"Deleted program {self.program_id}"
+
+class BackfillProgress(BaseModel):
+    """
+    Model recording how far a batched backfill got, so an interrupted one resumes where it stopped
+    (see `activities.backfill`).
+    - `name`: The registered name of the backfill.
+    - `model`: The label of the model it updates.
+    - `last_pk`: The highest primary key already processed.
+    - `max_pk`: The highest primary key when the backfill started; later rows are written by the new code.
+    - `rows_updated`: The rows changed so far.
+    - `completed_at`: The date and time the backfill finished, if it has.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    model = models.CharField(max_length=100)
+    last_pk = models.BigIntegerField(default=0)
+    max_pk = models.BigIntegerField(blank=True, null=True)
+    rows_updated = models.BigIntegerField(default=0)
+    completed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name_plural = 'backfill progress'
+
+    def __repr__(self):
+        """Returns a detailed string representation of the BackfillProgress object."""
+        return f"BackfillProgress(name={self.name}, last_pk={self.last_pk}, max_pk={self.max_pk})"
+
+    def __str__(self):
+        """Returns a simple string representation of the BackfillProgress object."""
+        return f"{self.name}: {self.last_pk}/{self.max_pk}"
+
 class ProgramImage(BaseModel):
     """
     Model representing additional images for a program.
@@ -256,8 +438,20 @@ class Favorite(BaseModel):
     - `user`: The user who favorited the program.
     - `program`: The program that was favorited.
     """
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='favorites') #  related_name allows reverse queries like user.favourites.all()
-    program = models.ForeignKey(Program, on_delete=models.CASCADE, related_name='favorites')
+    # Both FKs are served by the composite indexes below, which lead with them
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='favorites', db_index=False) #  related_name allows reverse queries like user.favourites.all()
+    program = models.ForeignKey(Program, on_delete=models.CASCADE, related_name='favorites', db_index=False)
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'program'], name='unique_user_favorite'), # also serves membership checks
+        ]
+        indexes = [
+            # "My favorites" and "who favorited this program", newest first, answered from the index alone
+            models.Index(fields=['user', '-created_at', 'program'], name='favorite_user_created_idx'),
+            models.Index(fields=['program', '-created_at', 'user'], name='favorite_program_created_idx'),
+        ]
 
     def __repr__(self):
         """Returns a detailed string representation of the Favorite object."""
@@ -269,12 +463,37 @@ class Favorite(BaseModel):
 
 class EmailLog(BaseModel):
     """
-    Model representing an email log.
+    Model representing an email log: one row per email delivery.
     - `status`: The status of the email (Sent, Failed, Pending).
     - `timestamp`: The timestamp when the email was logged.
+    - `recipient`: The user the email was sent to, if it went to a user.
+    - `campaign`: The weekly email the delivery belongs to, if any.
+    - `to_email`: The address the email was sent to.
+    - `subject`: The subject of the email.
+    - `payload`: The serialized message (see `activities.tasks.serialize_message`), kept so failed
+      deliveries can be queued again.
+    - `attempts`: How many times sending was tried.
+    - `last_error`: The error of the last failed attempt.
+    - `sent_at`: The date and time the email was handed to the mail server.
     """
     status = models.CharField(max_length=50, choices=EmailStatus.choices, default=EmailStatus.PENDING)
     timestamp = models.DateTimeField(auto_now_add=True)
+    # Indexed as the leading column of the composite indexes below
+    recipient = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True, related_name='email_logs', db_index=False)
+    campaign = models.ForeignKey('WeeklyEmail', on_delete=models.SET_NULL, blank=True, null=True, related_name='deliveries', db_index=False)
+    to_email = models.EmailField(blank=True, default='')
+    subject = models.CharField(max_length=255, blank=True, default='')
+    payload = models.JSONField(blank=True, null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'timestamp'], name='emaillog_status_time_idx'), # e.g. failed deliveries this week
+            models.Index(fields=['recipient', '-timestamp'], name='emaillog_recipient_idx'),
+            models.Index(fields=['campaign', 'status'], name='emaillog_campaign_idx'),
+        ]
 
     def __repr__(self):
         """Returns a detailed string representation of the EmailLog object."""
@@ -284,6 +503,31 @@ class EmailLog(BaseModel):
         """Returns a simple string representation of the EmailLog object."""
         return f"EmailLog {self.id} - {self.status}"
 
+class ProgramReminder(BaseModel):
+    """
+    Model representing a start-date reminder for a favorited program, written before the email is sent
+    so a program is never announced twice to the same user (see `activities.reminders`).
+    - `user`: The user reminded.
+    - `program`: The program the user favorited.
+    - `start_date`: The start date announced; a program moved to another date is announced again.
+    - `email_log`: The delivery of the email the reminder was part of.
+    """
+    # Indexed as the leading column of the unique constraint below
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='program_reminders', db_index=False)
+    program = models.ForeignKey(Program, on_delete=models.CASCADE, related_name='reminders')
+    start_date = models.DateField()
+    email_log = models.ForeignKey(EmailLog, on_delete=models.SET_NULL, blank=True, null=True, related_name='reminders')
+
+    class Meta:
+        constraints = [
+            # Makes reruns idempotent, and serves the "already reminded" anti-join
+            models.UniqueConstraint(fields=['user', 'program', 'start_date'], name='unique_program_reminder'),
+        ]
+
+    def __str__(self):
+        """Returns a simple string representation of the ProgramReminder object."""
+        return f"{self.user_id} - {self.program_id} - {self.start_date}"
+
 class WeeklyEmail(BaseModel):
     """
     Model representing a weekly email.
@@ -304,7 +548,7 @@ class WeeklyEmail(BaseModel):
         """Returns a simple string representation of the WeeklyEmail object."""
         return self.subject
 
-class MessageContact(BaseModel):
+class MessageContact(TenantOwnedMixin, BaseModel):
 
     """
     Model representing a contact message.
@@ -313,7 +557,11 @@ class MessageContact(BaseModel):
     - `phone`: The phone number of the person sending the message.
     - `message`: The content of the message.
     - `status`: The status of the message (New, Read, Responded).
+    - `dedupe_hash`: Hash of the normalized email and message, used to drop double submissions.
+    - `idempotency_key`: The `Idempotency-Key` the message was submitted with, if any.
+    - `tenant`: The federation the message was sent to.
     """
+    tenant = models.ForeignKey(Tenant, on_delete=models.PROTECT, blank=True, related_name='messages', db_index=False)
     name = models.CharField(max_length=255)
     email = models.EmailField(db_index=True)
     phone = models.CharField(max_length=15)
@@ -321,6 +569,17 @@ class MessageContact(BaseModel):
     status = models.CharField(max_length=50, choices=MessageStatus.choices, default=MessageStatus.NEW, db_index=True)
     read_at = models.DateTimeField(blank=True, null=True)
     responded_at = models.DateTimeField(blank=True, null=True)
+    dedupe_hash = models.CharField(max_length=64, blank=True, default='', editable=False) # sha256 of the normalized (email, message)
+    idempotency_key = models.CharField(max_length=255, blank=True, null=True, editable=False) # client supplied `Idempotency-Key` header
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tenant', 'idempotency_key'], name='unique_message_idempotency_key'),
+        ]
+        indexes = [
+            models.Index(fields=['tenant', 'dedupe_hash', 'created_at'], name='message_dedupe_idx'), # duplicate lookups within the dedupe window
+            models.Index(fields=['tenant', '-created_at'], name='message_tenant_created_idx'), # the admin inbox
+        ]
 
     def __repr__(self):
         """Returns a detailed string representation of the MessageContact object."""
@@ -331,4 +590,178 @@ class MessageContact(BaseModel):
         return f"{self.name} - {self.status}"
     
 
-# Add this model
+class BackgroundTask(BaseModel):
+    """
+    Model representing a queued call of a `@task` function (database task backend).
+    - `name`: The registered name of the task.
+    - `args` / `kwargs`: The JSON-serializable arguments of the call.
+    - `status`: The status of the task (Pending, Running, Succeeded, Failed).
+    - `attempts`: How many times the task was started.
+    - `max_retries`: How many times a failing task is retried.
+    - `run_at`: The earliest date and time the task may run (pushed back between retries).
+    - `last_error`: The traceback of the last failure.
+    - `finished_at`: The date and time the task succeeded or finally failed.
+    """
+    name = models.CharField(max_length=255)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=TaskStatus.choices, default=TaskStatus.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_retries = models.PositiveIntegerField(default=3)
+    run_at = models.DateTimeField(default=now)
+    last_error = models.TextField(blank=True, default='')
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='task_status_run_at_idx'), # workers poll for due pending tasks
+        ]
+
+    def __repr__(self):
+        """Returns a detailed string representation of the BackgroundTask object."""
+        return f"BackgroundTask(id={self.id}, name={self.name}, status={self.status})"
+
+    def __str__(self):
+        """Returns a simple string representation of the BackgroundTask object."""
+        return f"{self.name} - {self.status}"
+
+class AnalyticsEventKind(models.TextChoices):
+    """
+    Enum for analytics event kinds.
+    - VIEW: Represents a program detail view.
+    - SEARCH: Represents a program search.
+    - FAVORITE: Represents a program added to favorites.
+    """
+    VIEW = 'VIEW', 'View'
+    SEARCH = 'SEARCH', 'Search'
+    FAVORITE = 'FAVORITE', 'Favorite'
+
+class AnalyticsEvent(models.Model):
+    """
+    Model representing a raw analytics event, written in batches by `activities.analytics`.
+    Plain ids rather than foreign keys keep the inserts cheap and the events of deleted rows.
+    - `kind`: The kind of event (View, Search, Favorite).
+    - `program_id`: The program viewed or favorited.
+    - `user_id`: The authenticated user, if any.
+    - `query`: The normalized search terms.
+    - `results`: The number of programs a search returned.
+    - `occurred_at`: The date and time the event happened.
+    """
+    kind = models.CharField(max_length=10, choices=AnalyticsEventKind.choices)
+    program_id = models.BigIntegerField(blank=True, null=True)
+    user_id = models.BigIntegerField(blank=True, null=True)
+    query = models.CharField(max_length=255, blank=True, default='')
+    results = models.PositiveIntegerField(blank=True, null=True)
+    occurred_at = models.DateTimeField(default=now, db_index=True) # the rollup scans one day at a time
+
+    def __str__(self):
+        """Returns a simple string representation of the AnalyticsEvent object."""
+        return f"{self.kind} - {self.occurred_at}"
+
+class ProgramDailyStat(models.Model):
+    """
+    Model representing the daily counters of a program, aggregated from `AnalyticsEvent`.
+    - `program`: The program counted.
+    - `date`: The day counted.
+    - `views`: Detail views that day.
+    - `favorites`: Times added to favorites that day.
+    """
+    program = models.ForeignKey(Program, on_delete=models.CASCADE, related_name='daily_stats')
+    date = models.DateField()
+    views = models.PositiveIntegerField(default=0)
+    favorites = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['program', 'date'], name='unique_program_daily_stat'),
+        ]
+
+    def __str__(self):
+        """Returns a simple string representation of the ProgramDailyStat object."""
+        return f"{self.program_id} - {self.date}"
+
+class SearchDailyStat(models.Model):
+    """
+    Model representing the daily counters of a search query, aggregated from `AnalyticsEvent`.
+    - `query`: The normalized search terms.
+    - `date`: The day counted.
+    - `searches`: Searches for the query that day.
+    - `empty_searches`: Those of them that returned no program.
+    """
+    query = models.CharField(max_length=255)
+    date = models.DateField()
+    searches = models.PositiveIntegerField(default=0)
+    empty_searches = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'query'], name='unique_search_daily_stat'),
+        ]
+
+    def __str__(self):
+        """Returns a simple string representation of the SearchDailyStat object."""
+        return f"{self.query} - {self.date}"
+
+class AnalyticsRollup(models.Model):
+    """
+    Model representing a day whose raw events were rolled up by `activities.analytics.rollup`; only
+    those days have their raw events purged.
+    - `date`: The day rolled up.
+    - `rolled_up_at`: When it was last rolled up.
+    """
+    date = models.DateField(unique=True)
+    rolled_up_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        """Returns a simple string representation of the AnalyticsRollup object."""
+        return str(self.date)
+
+
+class SlowQuery(models.Model):
+    """
+    Model representing the aggregated samples of one slow query shape, written by `activities.slowlog`.
+    - `fingerprint`: Hash of the normalized SQL, identifying queries that differ only by their values.
+    - `sql`: The normalized SQL, values replaced by `?`.
+    - `example_sql`: The SQL of one sampled execution, with its placeholders.
+    - `example_params`: The parameters of that execution, to `EXPLAIN` it with realistic values;
+      redacted for writes and for reads of sensitive tables (see `activities.slowlog`).
+    - `database`: The alias of the database the query ran on.
+    - `calls`: The number of sampled executions.
+    - `total_time`: Their summed duration, in milliseconds.
+    - `max_time`: The slowest of them, in milliseconds.
+    - `first_seen`: The date and time of the first sample.
+    - `last_seen`: The date and time of the latest sample.
+    """
+    fingerprint = models.CharField(max_length=40, unique=True)
+    sql = models.TextField()
+    example_sql = models.TextField()
+    example_params = models.JSONField(default=list)
+    database = models.CharField(max_length=100, default='default')
+    calls = models.PositiveBigIntegerField(default=0)
+    total_time = models.FloatField(default=0)
+    max_time = models.FloatField(default=0)
+    first_seen = models.DateTimeField(default=now)
+    last_seen = models.DateTimeField(default=now, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-total_time'], name='slowquery_total_time_idx'), # the advisor's top offenders
+        ]
+
+    def __str__(self):
+        """Returns a simple string representation of the SlowQuery object."""
+        return f"{self.fingerprint[:12]} - {self.calls} calls"
+
+
+class RevokedToken(models.Model):
+    """
+    Model representing a revoked JWT, the source of truth of `activities.revocation`.
+    - `jti`: The id of the token.
+    - `expires_at`: When the token expires; the row can be purged from then on.
+    """
+    jti = models.CharField(max_length=255, unique=True)
+    expires_at = models.DateTimeField(db_index=True) # purge of expired revocations
+
+    def __str__(self):
+        """Returns a simple string representation of the RevokedToken object."""
+        return self.jti
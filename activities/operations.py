@@ -0,0 +1,106 @@
+"""
+Migration operations for changing large tables without locking them.
+
+- `AddIndexConcurrently` / `RemoveIndexConcurrently`: `CREATE/DROP INDEX CONCURRENTLY` on PostgreSQL,
+  which does not block writes; a plain `AddIndex`/`RemoveIndex` on other databases. A concurrent
+  build that failed leaves an invalid index behind; it is dropped before the next attempt.
+- `RunBackfill`: runs a registered batched backfill (see `activities.backfill`).
+All three need the migration to set `atomic = False`.
+"""
+from django.contrib.postgres import operations as postgres_operations
+from django.db import NotSupportedError
+from django.db.migrations.operations.base import Operation
+
+from .backfill import get_backfill, run_backfill
+
+
+def _is_postgresql(schema_editor):
+    return schema_editor.connection.vendor == 'postgresql'
+
+
+def _drop_invalid_index(schema_editor, name):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid '
+            'WHERE pg_class.relname = %s AND NOT pg_index.indisvalid',
+            [name],
+        )
+        invalid = cursor.fetchone() is not None
+    if invalid:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {schema_editor.quote_name(name)}')
+
+
+class AddIndexConcurrently(postgres_operations.AddIndexConcurrently):
+    """`AddIndex` without blocking writes on PostgreSQL."""
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if not _is_postgresql(schema_editor):
+            return super(postgres_operations.AddIndexConcurrently, self).database_forwards(app_label, schema_editor, from_state, to_state)
+        self._ensure_not_in_transaction(schema_editor)
+        _drop_invalid_index(schema_editor, self.index.name)
+        super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if not _is_postgresql(schema_editor):
+            return super(postgres_operations.AddIndexConcurrently, self).database_backwards(app_label, schema_editor, from_state, to_state)
+        super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class RemoveIndexConcurrently(postgres_operations.RemoveIndexConcurrently):
+    """`RemoveIndex` without blocking writes on PostgreSQL."""
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if not _is_postgresql(schema_editor):
+            return super(postgres_operations.RemoveIndexConcurrently, self).database_forwards(app_label, schema_editor, from_state, to_state)
+        super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if not _is_postgresql(schema_editor):
+            return super(postgres_operations.RemoveIndexConcurrently, self).database_backwards(app_label, schema_editor, from_state, to_state)
+        self._ensure_not_in_transaction(schema_editor)
+        super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class RunBackfill(Operation):
+    """
+    Runs the registered backfill `name` in committed batches, resuming from its recorded progress.
+    Reversing it does nothing: the migration that added the column decides what to undo.
+    """
+    reversible = True
+    reduces_to_sql = False
+    atomic = False
+
+    def __init__(self, name, batch_size=None, pause=None):
+        self.name = name
+        self.batch_size = batch_size
+        self.pause = pause
+
+    def deconstruct(self):
+        kwargs = {'name': self.name}
+        if self.batch_size is not None:
+            kwargs['batch_size'] = self.batch_size
+        if self.pause is not None:
+            kwargs['pause'] = self.pause
+        return self.__class__.__qualname__, [], kwargs
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.in_atomic_block:
+            raise NotSupportedError(
+                'RunBackfill commits batch by batch and cannot run inside a transaction '
+                '(set atomic = False on the migration).'
+            )
+        backfill = get_backfill(self.name)
+        run_backfill(
+            backfill,
+            from_state.apps.get_model(backfill.model),
+            from_state.apps.get_model('activities', 'BackfillProgress'),
+            batch_size=self.batch_size,
+            pause=self.pause,
+        )
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        pass
+
+    def describe(self):
+        return f'Backfill {self.name} in batches'
@@ -0,0 +1,110 @@
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Program, ProgramRequirement, RelatedProgram
+
+
+def _score(program, candidate, shared_requirements):
+    weights = settings.RELATED_PROGRAMS['WEIGHTS']
+    return (
+        shared_requirements * weights['requirement']
+        + (weights['category'] if candidate.category == program.category else 0)
+        + (weights['audience'] if candidate.audience == program.audience else 0)
+    )
+
+
+def compute_related(programs, top_n):
+    """
+    Returns `{program id: [(related program, score), ...]}` with the `top_n` best candidates of
+    each program among the programs of its tenant, ranked by shared requirements (through
+    `ProgramRequirement`), then same category and same audience.
+    Runs a fixed number of queries for the whole list of programs.
+    """
+    program_ids = [program.pk for program in programs]
+
+    # Requirements of the batch, then every program sharing one of them
+    requirements_of = defaultdict(set)
+    for program_id, requirement_id in ProgramRequirement.objects.filter(program_id__in=program_ids).values_list('program_id', 'requirement_id'):
+        requirements_of[program_id].add(requirement_id)
+    all_requirements = set().union(*requirements_of.values()) if requirements_of else set()
+    programs_with = defaultdict(set)
+    for program_id, requirement_id in ProgramRequirement.objects.filter(requirement_id__in=all_requirements).values_list('program_id', 'requirement_id'):
+        programs_with[requirement_id].add(program_id)
+
+    # A handful of same category/audience programs fill lists with few shared requirements
+    groups = {(program.tenant_id, program.category, program.audience) for program in programs}
+    group_candidates = {
+        group: list(
+            Program.objects.filter(tenant_id=group[0], category=group[1], audience=group[2])
+            .only('id', 'tenant_id', 'category', 'audience').order_by('-start_date')[:top_n + 1]
+        )
+        for group in groups
+    }
+
+    shared = {program.pk: Counter() for program in programs}
+    candidate_ids = set()
+    for program in programs:
+        for requirement_id in requirements_of[program.pk]:
+            for other_id in programs_with[requirement_id]:
+                if other_id != program.pk:
+                    shared[program.pk][other_id] += 1
+        candidate_ids.update(shared[program.pk])
+    candidates = {
+        candidate.pk: candidate
+        for candidate in Program.objects.filter(pk__in=candidate_ids).only('id', 'tenant_id', 'category', 'audience')
+    }
+    for group in group_candidates.values():
+        for candidate in group:
+            candidates.setdefault(candidate.pk, candidate)
+
+    related = {}
+    for program in programs:
+        scored = {}
+        for other_id, count in shared[program.pk].items():
+            if candidates[other_id].tenant_id == program.tenant_id: # requirements are shared across tenants
+                scored[other_id] = _score(program, candidates[other_id], count)
+        for candidate in group_candidates[(program.tenant_id, program.category, program.audience)]:
+            if candidate.pk != program.pk and candidate.pk not in scored:
+                scored[candidate.pk] = _score(program, candidate, 0)
+        best = sorted(scored.items(), key=lambda item: (-item[1], item[0]))[:top_n]
+        related[program.pk] = [(candidates[other_id], score) for other_id, score in best if score > 0]
+    return related
+
+
+def refresh_related(program_ids=None, batch_size=500):
+    """
+    Recomputes and stores the related programs of `program_ids` (every program when `None`),
+    `batch_size` programs per transaction. Returns the number of programs refreshed.
+    """
+    top_n = settings.RELATED_PROGRAMS['TOP_N']
+    queryset = Program.objects.only('id', 'tenant_id', 'category', 'audience').order_by('pk')
+    if program_ids is not None:
+        queryset = queryset.filter(pk__in=program_ids)
+    refreshed = 0
+    last_pk = 0
+    while True:
+        programs = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+        if not programs:
+            return refreshed
+        last_pk = programs[-1].pk
+        related = compute_related(programs, top_n)
+        with transaction.atomic():
+            RelatedProgram.objects.filter(program__in=programs).delete()
+            RelatedProgram.objects.bulk_create([
+                RelatedProgram(program_id=program_id, related=other, score=score, rank=rank)
+                for program_id, entries in related.items()
+                for rank, (other, score) in enumerate(entries, start=1)
+            ])
+        refreshed += len(programs)
+
+
+def programs_affected_by(program_id, requirement_id):
+    """
+    Returns the ids of the programs whose related list may change when `requirement_id` is linked
+    to or unlinked from `program_id`: the program itself and every program with that requirement.
+    """
+    affected = set(ProgramRequirement.objects.filter(requirement_id=requirement_id).values_list('program_id', flat=True))
+    affected.add(program_id)
+    return sorted(affected)
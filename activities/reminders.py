@@ -0,0 +1,155 @@
+"""
+Start-date reminders for favorited programs.
+
+`send_due_reminders()`, run daily by `manage.py send_reminders`, emails every active user whose
+favorite programs start within `REMINDERS['DAYS_BEFORE']` days:
+- The due (user, program) pairs are read with one query, a join of the programs starting in the
+  window with their favorites (`favorite_program_created_idx`) that leaves out the pairs already
+  reminded (`unique_program_reminder`). It is streamed with `.iterator()`, `CHUNK_SIZE` rows per
+  round-trip, ordered by user.
+- All the due programs of a user are coalesced into one email.
+- Users are handled `BATCH_SIZE` at a time. For each batch, the `EmailLog` rows and the
+  `ProgramReminder` rows are created in bulk in one transaction before anything is sent. A rerun, or
+  a concurrent run, therefore never sends a reminder twice. When a concurrent run claimed some of
+  the reminders first, the batch is claimed again user by user, without those reminders.
+- The emails of the whole run go through one mail server connection. Their outcome is written back
+  to their `EmailLog` rows in bulk. Failed deliveries keep their payload and are retried like the
+  others, with `requeue_failed`.
+"""
+import logging
+from datetime import timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
+from django.utils.timezone import localdate
+
+from .models import EmailLog, Favorite, ProgramReminder
+from .tasks import send_logged, serialize_message
+
+logger = logging.getLogger(__name__)
+
+DUE_FIELDS = (
+    'user_id', 'user__email', 'user__first_name', 'user__username',
+    'program_id', 'program__title', 'program__start_date', 'program__url',
+)
+
+
+def due_reminders(today, days_before):
+    """
+    Returns the favorites whose program starts between `today` and `days_before` days later and
+    whose user was not reminded of that start date yet, as `DUE_FIELDS` tuples ordered by user.
+    """
+    reminded = ProgramReminder.objects.filter(
+        user_id=OuterRef('user_id'), program_id=OuterRef('program_id'), start_date=OuterRef('program__start_date'),
+    )
+    return (
+        Favorite.objects
+        .filter(program__start_date__range=(today, today + timedelta(days=days_before)), user__is_active=True)
+        .exclude(user__email='')
+        .filter(~Exists(reminded))
+        .order_by('user_id', 'program__start_date', 'program_id')
+        .values_list(*DUE_FIELDS)
+    )
+
+
+def build_message(rows):
+    """Returns the reminder email of one user, listing every due program of `rows` (`DUE_FIELDS` tuples)."""
+    _, email, first_name, username = rows[0][:4]
+    if len(rows) == 1:
+        subject = f'Reminder: {rows[0][5]} starts on {rows[0][6]:%d %B %Y}'
+    else:
+        subject = f'Reminder: {len(rows)} of your favorite programs start soon'
+    programs = '\n'.join(f'- {title}, starting {start_date:%A %d %B %Y}\n  {url}' for *_, title, start_date, url in rows)
+    body = f'Hi {first_name or username},\n\nThese programs you saved are about to start:\n\n{programs}\n'
+    return EmailMessage(subject=subject[:255], body=body, from_email=settings.DEFAULT_FROM_EMAIL, to=[email])
+
+
+def user_batches(rows, batch_size):
+    """Groups `DUE_FIELDS` rows ordered by user into lists of at most `batch_size` users' rows."""
+    batch = []
+    for _, user_rows in groupby(rows, key=lambda row: row[0]):
+        batch.append(list(user_rows))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def record(batch, messages):
+    """Creates the pending `EmailLog` rows of a batch and its `ProgramReminder` rows in one transaction; returns the logs."""
+    with transaction.atomic():
+        logs = EmailLog.objects.bulk_create([
+            EmailLog(recipient_id=rows[0][0], to_email=message.to[0], subject=message.subject, payload=serialize_message(message))
+            for rows, message in zip(batch, messages)
+        ])
+        ProgramReminder.objects.bulk_create([
+            ProgramReminder(user_id=user_id, program_id=program_id, start_date=start_date, email_log=log)
+            for rows, log in zip(batch, logs)
+            for user_id, _, _, _, program_id, _, start_date, _ in rows
+        ])
+    return logs
+
+
+def unclaimed(rows):
+    """Returns the `DUE_FIELDS` rows of one user whose reminder was not recorded since they were read."""
+    reminded = set(
+        ProgramReminder.objects
+        .filter(user_id=rows[0][0], program_id__in=[row[4] for row in rows])
+        .values_list('program_id', 'start_date')
+    )
+    return [row for row in rows if (row[4], row[6]) not in reminded]
+
+
+def claim(batch):
+    """
+    Builds and records the reminder emails of a batch of users; returns `(rows, message, log)` for
+    every user to email.
+    When a concurrent run claimed some of the reminders first, each user's email is rebuilt from the
+    reminders still unclaimed and recorded on its own.
+    """
+    messages = [build_message(rows) for rows in batch]
+    try:
+        return list(zip(batch, messages, record(batch, messages)))
+    except IntegrityError:
+        logger.info('A concurrent run claimed reminders of this batch; claiming user by user')
+    claimed = []
+    for rows in batch:
+        rows = unclaimed(rows)
+        if not rows:
+            continue
+        message = build_message(rows)
+        try:
+            [log] = record([rows], [message])
+        except IntegrityError: # claimed concurrently again: left to the next run
+            logger.warning('Skipped the reminders of user %s claimed by a concurrent run', rows[0][0])
+            continue
+        claimed.append((rows, message, log))
+    return claimed
+
+
+def send_batch(batch, connection):
+    """Claims, sends and records the reminder emails of a batch of users; returns `(users, reminders, sent, failed)`."""
+    claimed = claim(batch)
+    sent = send_logged([message for _, message, _ in claimed], [log for _, _, log in claimed], connection)
+    return len(claimed), sum(len(rows) for rows, _, _ in claimed), sent, len(claimed) - sent
+
+
+def send_due_reminders(today=None, days_before=None, batch_size=None, chunk_size=None):
+    """
+    Sends the due reminders (see the module docstring); returns a dict of the users emailed,
+    reminders included, and emails sent and failed.
+    """
+    config = settings.REMINDERS
+    today = today or localdate()
+    days_before = config['DAYS_BEFORE'] if days_before is None else days_before
+    rows = due_reminders(today, days_before).iterator(chunk_size=chunk_size or config['CHUNK_SIZE'])
+    result = {'users': 0, 'reminders': 0, 'sent': 0, 'failed': 0}
+    with get_connection() as mail: # opened once for the whole run
+        for batch in user_batches(rows, batch_size or config['BATCH_SIZE']):
+            for key, count in zip(('users', 'reminders', 'sent', 'failed'), send_batch(batch, mail)):
+                result[key] += count
+    return result
@@ -0,0 +1,60 @@
+"""
+JSON rendering and parsing with `orjson` when it is installed.
+
+`FastJSONRenderer` produces the same bytes as DRF's `JSONRenderer` (compact separators, UTF-8,
+`\\u2028`/`\\u2029` escaped), several times faster. Values `orjson` does not encode the way DRF does
+(datetimes, decimals, lazy strings, ...) go through DRF's `JSONEncoder`. Pretty-printed output (the
+browsable API, `; indent=`), non-default `UNICODE_JSON`/`COMPACT_JSON`/`STRICT_JSON` settings and any
+value `orjson` rejects fall back to `JSONRenderer` itself. Only floats can differ: those written in
+exponent notation (`1e16` instead of `1e+16`; the same number once parsed), and NaN or infinity,
+written as `null` instead of raising. No serializer of this API returns floats.
+Without `orjson` both classes behave exactly like DRF's.
+"""
+import io
+
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """A drop-in `JSONRenderer` using `orjson` for compact output (see the module docstring)."""
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None or data is None or self.ensure_ascii or not self.compact or not self.strict
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+            )
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class FastJSONParser(JSONParser):
+    """
+    A drop-in `JSONParser` using `orjson` for UTF-8 bodies. A body `orjson` rejects is parsed again
+    by `JSONParser`, so invalid JSON gets the same error and integers beyond 64 bits still parse.
+    """
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', 'utf-8')
+        if orjson is None or not self.strict or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+        body = stream.read()
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            return super().parse(io.BytesIO(body), media_type, parser_context)
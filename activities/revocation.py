@@ -0,0 +1,165 @@
+"""
+Revoked JWT ids, kept in the database with an in-process Bloom filter in front.
+
+    get_store().revoke(jti, expires_at)
+    get_store().is_revoked(jti)
+
+Each revoked `jti` is a `RevokedToken` row: the database is shared by every process and never evicts,
+so a revoked token stays revoked until it expires (a per-process or evicting cache would let it
+back in). `manage.py purge_revoked_tokens` deletes the rows of expired tokens.
+Every process also adds the revoked ids to a Bloom filter: an id missing from it was never revoked,
+which answers the common case without a query; only the possible hits (the revoked ids and
+`JWT_REVOCATION['ERROR_RATE']` of the others) are confirmed in the database.
+Revocations made by other processes reach the filter by reading the rows added since the last
+sync, at most once per `JWT_REVOCATION['SYNC_INTERVAL']` seconds: a token revoked elsewhere may be
+accepted by this process for that long. The filter is replaced every refresh token lifetime (the
+previous one is kept for one more), so it only ever holds ids of tokens that can still be presented.
+"""
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils.timezone import now
+
+from .models import RevokedToken
+
+# Rows read per query while syncing
+SYNC_BATCH_SIZE = 1000
+
+
+class BloomFilter:
+    """
+    A fixed-size Bloom filter of strings.
+    - `capacity`: The number of items it is sized for.
+    - `error_rate`: The false positive rate once `capacity` items were added.
+    """
+    def __init__(self, capacity, error_rate):
+        self.size = max(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, item):
+        # Double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+
+class RevocationStore:
+    """
+    Revoked token ids (see the module docstring).
+    - `capacity`, `error_rate`: Sizing of each Bloom filter; `capacity` should exceed the revocations
+      of one refresh token lifetime (every rotation revokes a token).
+    - `sync_interval`: Seconds between reads of the new revocations; 0 reads them on every check.
+    - `lifetime`: Seconds after which a filter is replaced (the refresh token lifetime).
+    """
+    def __init__(self, capacity=100000, error_rate=0.001, sync_interval=1.0, lifetime=7 * 24 * 60 * 60):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.lifetime = lifetime
+        self.lock = threading.Lock()
+        self.current = BloomFilter(capacity, error_rate)
+        self.previous = None
+        self.rotated_at = time.monotonic()
+        self.last_id = 0
+        self.synced_at = None
+
+    def revoke(self, jti, expires_at):
+        """
+        Revokes the token `jti` until `expires_at` (a datetime or epoch seconds).
+        Returns `False` when it was revoked already, so a concurrent second use of a token loses.
+        """
+        if not isinstance(expires_at, datetime):
+            expires_at = datetime.fromtimestamp(expires_at, tz=timezone.utc)
+        if expires_at <= now():
+            return False # expired tokens are rejected anyway
+        try:
+            with transaction.atomic():
+                RevokedToken.objects.create(jti=jti, expires_at=expires_at)
+            added = True
+        except IntegrityError: # revoked already, maybe by a concurrent request
+            added = False
+        with self.lock:
+            self.current.add(jti)
+        return added
+
+    def is_revoked(self, jti):
+        self.sync()
+        with self.lock:
+            maybe = jti in self.current or (self.previous is not None and jti in self.previous)
+        return maybe and RevokedToken.objects.filter(jti=jti).exists()
+
+    def sync(self):
+        """Adds the revocations made by every process since the last sync, once per `sync_interval`."""
+        current = time.monotonic()
+        if self.synced_at is not None and current - self.synced_at < self.sync_interval:
+            return
+        with self.lock:
+            if self.synced_at is not None and current - self.synced_at < self.sync_interval:
+                return
+            if current - self.rotated_at >= self.lifetime:
+                self.previous, self.current = self.current, BloomFilter(self.capacity, self.error_rate)
+                self.rotated_at = current
+            # A new process reads every unexpired revocation; then only the rows added since
+            revocations = RevokedToken.objects.filter(expires_at__gt=now()).order_by('pk')
+            while True:
+                rows = list(revocations.filter(pk__gt=self.last_id).values_list('pk', 'jti')[:SYNC_BATCH_SIZE])
+                for _, jti in rows:
+                    self.current.add(jti)
+                if len(rows) < SYNC_BATCH_SIZE:
+                    break
+                self.last_id = rows[-1][0]
+            if rows:
+                self.last_id = rows[-1][0]
+            self.synced_at = current
+
+
+def purge_expired(batch_size=5000):
+    """Deletes the revocations of expired tokens, `batch_size` rows per delete. Returns the number deleted."""
+    queryset = RevokedToken.objects.filter(expires_at__lte=now())
+    deleted = 0
+    while True:
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += RevokedToken.objects.filter(pk__in=ids).delete()[0]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Returns the process-wide revocation store, configured from `JWT_REVOCATION`."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                config = settings.JWT_REVOCATION
+                _store = RevocationStore(
+                    capacity=config['CAPACITY'],
+                    error_rate=config['ERROR_RATE'],
+                    sync_interval=config['SYNC_INTERVAL'],
+                    lifetime=settings.SIMPLE_JWT['REFRESH_TOKEN_LIFETIME'].total_seconds(),
+                )
+    return _store
+
+
+def set_store(store):
+    """Replaces the revocation store, e.g. with a fresh one in tests."""
+    global _store
+    _store = store
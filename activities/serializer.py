@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import *
+from .favorites import is_favorite
 from djoser.serializers import UserCreateSerializer
 
 class UserCreateWithProfileSerializer(UserCreateSerializer):
@@ -71,17 +72,53 @@ class ProgramSerializer(serializers.ModelSerializer):
             'image', 'additional_images'
         ]
         
+class ProgramSummarySerializer(serializers.ModelSerializer):
+    """
+    Serializer for a compact summary of the `Program` model.
+    It only includes the program's own columns, so it can be filled from a single joined query.
+    """
+    class Meta:
+        model = Program
+        fields = [
+            'id', 'title', 'cost', 'start_date', 'end_date', 'type',
+            'category', 'audience', 'kind', 'target_academic', 'image'
+        ]
+
+class ProgramOverviewSerializer(ProgramSerializer):
+    """
+    Serializer for the program page: the full `Program` with its favorite count, whether the
+    requesting user favorited it and the precomputed related programs.
+    Expects `favorite_count` to be annotated and `related_entries` to be prefetched with their `related` program.
+    """
+    favorite_count = serializers.IntegerField(read_only=True)
+    is_favorite = serializers.SerializerMethodField()
+    related = serializers.SerializerMethodField()
+
+    class Meta(ProgramSerializer.Meta):
+        fields = ProgramSerializer.Meta.fields + ['favorite_count', 'is_favorite', 'related']
+
+    def get_is_favorite(self, program):
+        # Answered from the user's cached favorite ids; `None` for anonymous requests
+        request = self.context.get('request')
+        if request is None or not request.user.is_authenticated:
+            return None
+        return is_favorite(request.user.pk, program.pk)
+
+    def get_related(self, program):
+        related = [entry.related for entry in program.related_entries.all()]
+        return ProgramSummarySerializer(related, many=True, context=self.context).data
+
 class FavoriteSerializer(serializers.ModelSerializer):
     """
     Serializer for the `Favorite` model.
     This serializer includes all fields of the `Favorite` model.
     It is used to convert `Favorite` model instances into JSON format and vice versa.
     """
-    program = serializers.CharField(source='program.title', read_only=True) # Display the title of the program
+    program = ProgramSummarySerializer(read_only=True) # Nested program summary, fetched with select_related
 
     class Meta:
         model = Favorite  # Specifies the model to be serialized
-        fields = ['id', 'program']
+        fields = ['id', 'program', 'created_at']
 
 class WeeklyEmailSerializer(serializers.ModelSerializer):
     """
@@ -0,0 +1,213 @@
+import weakref
+
+from django.conf import settings
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils.timezone import now
+
+from .models import Tenant, User, Program, ProgramImage, Requirement, ProgramRequirement, ProgramTombstone, Favorite, AnalyticsEventKind
+from .tenants import clear_tenant_cache
+from .favorites import invalidate_favorites_feed, invalidate_all_favorites_feeds
+
+# The analytics, events, slowlog, suggest, trending and tasks modules are imported by the receivers
+# that use them, so that loading the app (every manage.py command) does not import them
+
+
+def deleting_program(instance, origin):
+    """Returns whether `instance` (an image or requirement link) is deleted along with its program."""
+    if isinstance(origin, Program):
+        return origin.pk == instance.program_id
+    # A program queryset deletion only reaches the images and links of the deleted programs
+    return isinstance(origin, QuerySet) and origin.model is Program
+
+
+# Tenants of the programs of a queryset deletion, looked up once for all its images and links
+_deleted_program_tenants = weakref.WeakKeyDictionary()
+
+
+def program_tenant_id(instance, origin=None):
+    """
+    Returns the tenant of `instance.program`, without a query when the program is loaded or is the
+    deletion's origin, and with one query per deletion when a program queryset is deleted.
+    """
+    if isinstance(origin, Program) and origin.pk == instance.program_id:
+        return origin.tenant_id
+    if isinstance(origin, QuerySet) and origin.model is Program:
+        if origin not in _deleted_program_tenants: # the programs go last, after their images and links
+            _deleted_program_tenants[origin] = dict(origin.values_list('pk', 'tenant_id'))
+        return _deleted_program_tenants[origin].get(instance.program_id)
+    if type(instance).program.is_cached(instance):
+        return instance.program.tenant_id
+    return Program.objects.filter(pk=instance.program_id).values_list('tenant_id', flat=True).first()
+
+
+@receiver([post_save, post_delete], sender=Favorite)
+def favorite_changed(sender, instance, **kwargs):
+    """Invalidates the favorites feed of the user whose favorites changed."""
+    if Favorite.user.is_cached(instance):
+        tenant_id = instance.user.tenant_id
+    else: # the user's feed is cached under their tenant
+        tenant_id = User.objects.filter(pk=instance.user_id).values_list('tenant_id', flat=True).first()
+    invalidate_favorites_feed(instance.user_id, tenant_id)
+
+
+@receiver(post_save, sender=Favorite)
+def record_favorite(sender, instance, created, **kwargs):
+    """Records a `FAVORITE` analytics event and bumps the trending score once the new favorite is committed."""
+    from . import analytics, trending
+
+    if created:
+        transaction.on_commit(lambda: analytics.record(
+            AnalyticsEventKind.FAVORITE, program_id=instance.program_id, user_id=instance.user_id
+        ))
+        transaction.on_commit(lambda: trending.favorite_added(instance.program_id))
+
+
+@receiver(post_delete, sender=Favorite)
+def unrecord_favorite(sender, instance, **kwargs):
+    """Takes what a removed favorite still contributed out of the trending score."""
+    from . import trending
+
+    transaction.on_commit(lambda: trending.favorite_removed(instance.program_id, instance.created_at))
+
+
+@receiver([post_save, post_delete], sender=Tenant)
+def tenant_changed(sender, instance, **kwargs):
+    """Forgets the tenants this process resolved, so a new domain or slug applies at once."""
+    transaction.on_commit(clear_tenant_cache)
+
+
+@receiver([post_save, post_delete], sender=Program)
+def program_changed(sender, instance, **kwargs):
+    """Invalidates every favorites feed of the program's tenant, since they embed program summaries."""
+    invalidate_all_favorites_feeds(instance.tenant_id)
+
+
+@receiver(post_save, sender=Program)
+def update_program_suggestions(sender, instance, **kwargs):
+    """Updates the tenant's search suggestions for the program once the change is committed."""
+    from . import suggest
+
+    transaction.on_commit(lambda: suggest.program_changed(instance.tenant_id, instance.pk, instance.title))
+
+
+@receiver(post_delete, sender=Program)
+def remove_program_suggestions(sender, instance, **kwargs):
+    """Takes the program out of the tenant's search suggestions once the deletion is committed."""
+    from . import suggest
+
+    program_id = instance.pk # cleared by the deletion
+    transaction.on_commit(lambda: suggest.program_changed(instance.tenant_id, program_id, None))
+
+
+@receiver(post_save, sender=Requirement)
+def update_requirement_suggestions(sender, instance, created, **kwargs):
+    """
+    Requirements are shared by every tenant: updates the suggestions of the tenants whose programs
+    require it once the change is committed. A new requirement has no program yet.
+    """
+    from . import suggest
+
+    if created:
+        return
+    tenant_ids = list(Program.objects.filter(requirements=instance).values_list('tenant_id', flat=True).distinct())
+    if tenant_ids:
+        transaction.on_commit(lambda: suggest.requirement_changed(instance.pk, tenant_ids))
+
+
+@receiver([post_save, post_delete], sender=ProgramRequirement)
+def update_linked_requirement_suggestions(sender, instance, origin=None, **kwargs):
+    """Updates the suggestions of the program's tenant for a requirement added to or removed from it."""
+    from . import suggest
+
+    tenant_id = program_tenant_id(instance, origin)
+    if tenant_id is not None:
+        transaction.on_commit(lambda: suggest.requirement_changed(instance.requirement_id, [tenant_id]))
+
+
+@receiver(post_save, sender=Program)
+def publish_program_saved(sender, instance, created, **kwargs):
+    """Publishes a `program.created` / `program.updated` catalog event."""
+    from . import events
+
+    event_type = 'program.created' if created else 'program.updated'
+    events.publish(event_type, instance.pk, instance.tenant_id, updated_at=instance.updated_at.isoformat())
+
+
+@receiver(post_delete, sender=Program)
+def publish_program_deleted(sender, instance, **kwargs):
+    """Publishes a `program.deleted` catalog event."""
+    from . import events
+
+    events.publish('program.deleted', instance.pk, instance.tenant_id)
+
+
+@receiver(post_save, sender=ProgramImage)
+def publish_image_saved(sender, instance, created, **kwargs):
+    """Publishes a `program.image.created` / `program.image.updated` catalog event."""
+    from . import events
+
+    event_type = 'program.image.created' if created else 'program.image.updated'
+    events.publish(event_type, instance.program_id, program_tenant_id(instance), image=instance.pk)
+
+
+@receiver(post_delete, sender=ProgramImage)
+def publish_image_deleted(sender, instance, origin=None, **kwargs):
+    """Publishes a `program.image.deleted` catalog event."""
+    from . import events
+
+    events.publish('program.image.deleted', instance.program_id, program_tenant_id(instance, origin), image=instance.pk)
+
+
+@receiver(post_delete, sender=Program)
+def record_program_tombstone(sender, instance, **kwargs):
+    """Records the deletion so the delta sync endpoint can report it."""
+    ProgramTombstone.objects.create(program_id=instance.pk, tenant_id=instance.tenant_id)
+
+
+@receiver([post_save, post_delete], sender=ProgramImage)
+@receiver([post_save, post_delete], sender=ProgramRequirement)
+def touch_program(sender, instance, origin=None, **kwargs):
+    """Bumps the program's `updated_at`, so the delta sync resends it with its new images/requirements."""
+    if deleting_program(instance, origin):
+        return
+    Program.objects.filter(pk=instance.program_id).update(updated_at=now())
+
+
+@receiver([post_save, post_delete], sender=ProgramRequirement)
+def queue_related_refresh(sender, instance, origin=None, **kwargs):
+    """
+    Queues a refresh of the precomputed related programs sharing the changed requirement. The links
+    of a deleted program are covered by `queue_deleted_program_related_refresh` instead.
+    """
+    from .tasks import refresh_related_for_requirement
+
+    if deleting_program(instance, origin):
+        return
+    refresh_related_for_requirement.delay(instance.program_id, instance.requirement_id)
+
+
+@receiver(pre_delete, sender=Program)
+def queue_deleted_program_related_refresh(sender, instance, **kwargs):
+    """Queues one refresh of the programs sharing a requirement with a program about to be deleted."""
+    from .tasks import refresh_related_programs
+
+    shared = ProgramRequirement.objects.filter(program_id=instance.pk).values('requirement_id')
+    program_ids = sorted(set(
+        ProgramRequirement.objects.filter(requirement_id__in=shared).exclude(program_id=instance.pk)
+        .values_list('program_id', flat=True)
+    ))
+    if program_ids:
+        refresh_related_programs.delay(program_ids)
+
+
+@receiver(connection_created)
+def capture_slow_queries(sender, connection, **kwargs):
+    """Samples the slow queries of every new database connection (see `activities.slowlog`)."""
+    if settings.SLOW_QUERIES['ENABLED']:
+        from . import slowlog
+
+        slowlog.install(connection)
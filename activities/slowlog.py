@@ -0,0 +1,262 @@
+"""
+Slow query capture.
+
+Every database connection runs its queries through a `SlowQueryRecorder` (a `connection.execute_wrapper`
+installed when the connection opens). Queries slower than `SLOW_QUERIES['THRESHOLD_MS']` are sampled
+(`SAMPLE_RATE` of them), normalized into a fingerprint, and aggregated in memory: calls, total and
+maximum time, and the SQL and parameters of the slowest execution as an example. A daemon thread per
+worker process writes the aggregates to `SlowQuery` every `FLUSH_INTERVAL` seconds, one upsert per
+fingerprint, so sampling never adds a write to the request.
+
+`manage.py advise_indexes` then `EXPLAIN`s the top offenders (see `activities.advisor`).
+Example parameters are shown in the admin, so they are redacted as they are recorded: writes keep
+none of their values (only reads are explained), and reads of `SLOW_QUERIES['SENSITIVE_TABLES']`
+(users, sessions, tokens, emails, contact messages) keep their non-text values only, enough for
+the planner.
+"""
+import atexit
+import hashlib
+import logging
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils.timezone import now
+
+from .models import SlowQuery
+
+logger = logging.getLogger(__name__)
+
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'(?<![\w"])-?\d+(?:\.\d+)?\b')
+PLACEHOLDER_RE = re.compile(r'%\(\w+\)s|%s|\?')
+IN_LIST_RE = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+VALUES_RE = re.compile(r'(\(\s*\?(?:\s*,\s*\?)*\s*\))(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))+')
+SPACE_RE = re.compile(r'\s+')
+READ_RE = re.compile(r'^\s*(?:SELECT|WITH)\b', re.IGNORECASE)
+TABLE_RE = re.compile(r'\b(?:FROM|JOIN|INTO|UPDATE)\s+"(\w+)"', re.IGNORECASE)
+
+# Replaces the text values of reads of sensitive tables
+REDACTED = '[redacted]'
+
+
+def normalize_sql(sql):
+    """Returns `sql` with its values replaced by `?` and IN lists and multi-row VALUES collapsed."""
+    sql = STRING_RE.sub('?', sql)
+    sql = PLACEHOLDER_RE.sub('?', sql)
+    sql = NUMBER_RE.sub('?', sql)
+    sql = IN_LIST_RE.sub('IN (...)', sql)
+    sql = VALUES_RE.sub(r'\1', sql)
+    return SPACE_RE.sub(' ', sql).strip()
+
+
+def fingerprint(normalized_sql):
+    return hashlib.sha1(normalized_sql.encode()).hexdigest()
+
+
+def _json_param(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (bytes, memoryview)):
+        return None # binary values are not worth keeping
+    return str(value) # Decimal, UUID, ...
+
+
+def _redact_text(value):
+    return REDACTED if isinstance(value, str) else value
+
+
+def example_params(sql, params, many, sensitive_tables=()):
+    """
+    Returns the parameters of one execution as JSON values (the first row of an `executemany`),
+    redacted (see the module docstring): `None` for every value of a write, `REDACTED` for the text
+    values of a read of `sensitive_tables`.
+    """
+    if many:
+        params = next(iter(params), None)
+    if params is None:
+        return []
+    if not READ_RE.match(sql):
+        redact = lambda value: None # a write: no value is kept
+    elif any(table in sensitive_tables for table in TABLE_RE.findall(sql)):
+        redact = _redact_text
+    else:
+        redact = lambda value: value
+    if isinstance(params, dict):
+        return {key: redact(_json_param(value)) for key, value in params.items()}
+    return [redact(_json_param(value)) for value in params]
+
+
+class SlowQueryRecorder:
+    """
+    An `execute_wrapper` aggregating slow queries in memory (see the module docstring).
+    - `threshold`: Milliseconds from which a query is slow.
+    - `sample_rate`: The fraction of slow queries recorded.
+    - `max_fingerprints`: The most query shapes held between flushes; others are counted as dropped.
+    - `flush_interval`: Seconds between flushes. `None` starts no thread; call `flush()` yourself.
+    - `sensitive_tables`: Tables whose reads are recorded without their text parameters.
+    """
+    def __init__(self, threshold=100, sample_rate=1.0, max_fingerprints=1000, flush_interval=10.0, sensitive_tables=()):
+        self.threshold = threshold
+        self.sensitive_tables = frozenset(sensitive_tables)
+        self.sample_rate = sample_rate
+        self.max_fingerprints = max_fingerprints
+        self.flush_interval = flush_interval
+        self.stats = {}
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.thread = None
+        self.pid = None
+
+    def __call__(self, execute, sql, params, many, context):
+        if getattr(self.local, 'paused', False):
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            if elapsed >= self.threshold and (self.sample_rate >= 1 or random.random() < self.sample_rate):
+                self.add(sql, params, many, context['connection'].alias, elapsed)
+
+    @contextmanager
+    def paused(self):
+        """Stops recording the queries of this thread, e.g. the recorder's own writes."""
+        previous = getattr(self.local, 'paused', False)
+        self.local.paused = True
+        try:
+            yield
+        finally:
+            self.local.paused = previous
+
+    def add(self, sql, params, many, database, elapsed):
+        normalized = normalize_sql(sql)
+        key = fingerprint(normalized)
+        seen = now()
+        with self.lock:
+            entry = self.stats.get(key)
+            if entry is None:
+                if len(self.stats) >= self.max_fingerprints:
+                    self.dropped += 1
+                    return
+                entry = self.stats[key] = {
+                    'sql': normalized, 'database': database, 'calls': 0, 'total_time': 0.0, 'max_time': 0.0,
+                    'first_seen': seen,
+                }
+            entry['calls'] += 1
+            entry['total_time'] += elapsed
+            entry['last_seen'] = seen
+            if elapsed >= entry['max_time']:
+                entry['max_time'] = elapsed
+                entry['example_sql'] = sql
+                entry['example_params'] = example_params(sql, params, many, self.sensitive_tables)
+        self.ensure_started()
+
+    def ensure_started(self):
+        # A forked worker inherits the recorder but not the thread: start one per process
+        if self.flush_interval is None or (self.thread is not None and self.pid == os.getpid()):
+            return
+        with self.lock:
+            if self.thread is not None and self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self.run, name='slow-query-flusher', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Slow query flush failed')
+            finally:
+                close_old_connections()
+
+    def drain(self):
+        with self.lock:
+            stats, self.stats = self.stats, {}
+        return stats
+
+    def flush(self):
+        """Adds the aggregated samples to `SlowQuery`. Returns the number of fingerprints written."""
+        stats = self.drain()
+        with self.paused():
+            for key, entry in stats.items():
+                try:
+                    self.save(key, entry)
+                except Exception:
+                    logger.exception('Dropped the samples of slow query %s', key)
+        return len(stats)
+
+    @staticmethod
+    def save(key, entry):
+        increments = {
+            'calls': F('calls') + entry['calls'],
+            'total_time': F('total_time') + entry['total_time'],
+            'max_time': Greatest(F('max_time'), entry['max_time']),
+            'last_seen': entry['last_seen'],
+        }
+        if SlowQuery.objects.filter(fingerprint=key).update(**increments):
+            return
+        try:
+            with transaction.atomic():
+                SlowQuery.objects.create(fingerprint=key, **entry)
+        except IntegrityError: # another process created it first
+            SlowQuery.objects.filter(fingerprint=key).update(**increments)
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder():
+    """Returns the process-wide recorder, configured from `SLOW_QUERIES`."""
+    global _recorder
+    if _recorder is None:
+        with _recorder_lock:
+            if _recorder is None:
+                config = settings.SLOW_QUERIES
+                _recorder = SlowQueryRecorder(
+                    threshold=config['THRESHOLD_MS'],
+                    sample_rate=config['SAMPLE_RATE'],
+                    max_fingerprints=config['MAX_FINGERPRINTS'],
+                    flush_interval=config['FLUSH_INTERVAL'],
+                    sensitive_tables=config['SENSITIVE_TABLES'],
+                )
+    return _recorder
+
+
+def set_recorder(recorder):
+    """Replaces the recorder, e.g. with one that has no flush thread in tests."""
+    global _recorder
+    _recorder = recorder
+
+
+class RecorderProxy:
+    """The wrapper installed on connections: forwards to the current recorder, so `set_recorder` reaches open connections."""
+    def __call__(self, execute, sql, params, many, context):
+        return get_recorder()(execute, sql, params, many, context)
+
+
+def install(connection):
+    """Runs the queries of `connection` through the recorder; installing twice is harmless."""
+    if not any(isinstance(wrapper, RecorderProxy) for wrapper in connection.execute_wrappers):
+        connection.execute_wrappers.append(RecorderProxy())
+
+
+@atexit.register
+def _flush_on_exit():
+    if _recorder is not None and _recorder.stats:
+        _recorder.flush()
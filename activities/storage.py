@@ -0,0 +1,57 @@
+import hashlib
+import os
+import posixpath
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+# Extensions kept in hashed names; others (too long, or with other characters) are dropped
+EXTENSION_RE = re.compile(r'^\.[a-z0-9]{1,10}$')
+
+# `<prefix>/<aa>/<bb>/<sha256><ext>`, the layout written by ContentAddressedStorage
+HASHED_NAME_RE = re.compile(r'^[^/]+/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.[a-z0-9]{1,10})?$')
+
+
+def hashed_extension(name):
+    """Returns the lowercased extension of `name` when `HASHED_NAME_RE` accepts it, else `''`."""
+    ext = os.path.splitext(name)[1].lower()
+    return ext if EXTENSION_RE.match(ext) else ''
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File storage that names every file after the SHA-256 of its content.
+    - Layout: `<prefix>/<h[0:2]>/<h[2:4]>/<h><ext>`, where `prefix` is the first directory of the
+      name given by `upload_to` (e.g. `program_images`). The two shard levels keep directories small.
+    - Identical uploads resolve to the same name and are stored once.
+    - A name never changes content, so its URL can be cached forever.
+
+    As files may be shared by several rows, they should not be deleted along with a single row.
+    """
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('allow_overwrite', True) # rewriting a hashed name writes the same bytes
+        super().__init__(*args, **kwargs)
+
+    def hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        hexdigest = digest.hexdigest()
+        prefix = name.replace('\\', '/').split('/')[0] if '/' in name else 'files'
+        return posixpath.join(prefix, hexdigest[:2], hexdigest[2:4], f'{hexdigest}{hashed_extension(name)}')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            return name # deduplicated: the same bytes are already stored
+        return self._save(name, content)
+
@@ -0,0 +1,218 @@
+"""
+Search-as-you-type suggestions from an in-process prefix index.
+
+Every word of a program title or requirement description starts a key (`data science`, `science`),
+and the keys are kept in one sorted list: a prefix lookup is a `bisect` plus a short scan, with no
+query and no serializer.
+Each tenant has its own index, built on its first lookup. A committed program or requirement change
+is applied to the indexes of the tenants it concerns in this process (`program_changed`,
+`requirement_changed`): a copy of the index with the label's entries replaced is swapped in, so
+lookups never wait. The change also bumps the tenant's cache version; other processes notice within
+`SUGGEST['VERSION_CHECK_INTERVAL']` seconds and rebuild their index in a background thread, serving
+the previous one meanwhile. Each tenant has its own lock, so no tenant waits on another's build.
+"""
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from .models import Program, Requirement
+from .tenants import cache_namespace
+
+GLOBAL_VERSION_KEY = 'suggest:version'
+
+WORD_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Returns `text` case-folded, without accents, reduced to its words separated by single spaces."""
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ' '.join(WORD_RE.findall(''.join(char for char in decomposed if not unicodedata.combining(char))))
+
+
+def label_entries(kind, pk, label):
+    """Returns the index entries of one label: one per word it contains, keyed from that word on."""
+    words = normalize(label).split(' ')
+    return [(' '.join(words[start:]), kind, pk, label) for start in range(len(words))]
+
+
+class SuggestIndex:
+    """
+    A sorted array of `(key, kind, id, label)` entries, one per word of each label.
+    - `kind`: `program` or `requirement`.
+    - `label`: The program title or requirement description returned to the client.
+    An index is never modified: `updated` returns a new one.
+    """
+    def __init__(self, entries):
+        self.entries = sorted(entries)
+        self.keys = [entry[0] for entry in self.entries]
+        self.labels = {(kind, pk): label for _, kind, pk, label in self.entries}
+
+    @classmethod
+    def build(cls, tenant_id):
+        entries = []
+        for kind, rows in (
+            ('program', Program.objects.filter(tenant_id=tenant_id).values_list('id', 'title')),
+            ('requirement', Requirement.objects.filter(programs__tenant_id=tenant_id).distinct().values_list('id', 'description')),
+        ):
+            for pk, label in rows.iterator():
+                entries.extend(label_entries(kind, pk, label))
+        return cls(entries)
+
+    def updated(self, kind, pk, label):
+        """Returns a copy of this index where `(kind, pk)` has `label`, or is left out when `label` is `None`."""
+        old = self.labels.get((kind, pk))
+        if old == label:
+            return self
+        entries = self.entries
+        if old is not None:
+            stale = set(label_entries(kind, pk, old))
+            entries = [entry for entry in entries if entry not in stale]
+        if label is not None:
+            entries = entries + label_entries(kind, pk, label)
+        return SuggestIndex(entries)
+
+    def lookup(self, prefix, limit):
+        """Returns up to `limit` distinct suggestions whose label has a word starting with `prefix`."""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        suggestions, seen = [], set()
+        for position in range(bisect_left(self.keys, prefix), len(self.keys)):
+            if not self.keys[position].startswith(prefix):
+                break
+            _, kind, pk, label = self.entries[position]
+            if (kind, pk) in seen:
+                continue
+            seen.add((kind, pk))
+            suggestions.append({'type': kind, 'id': pk, 'title': label})
+            if len(suggestions) >= limit:
+                break
+        return suggestions
+
+
+# tenant id -> (index, version it was built for, monotonic time the version was last checked)
+_indexes = {}
+# tenant id -> lock held while its index is built or updated
+_locks = defaultdict(threading.Lock)
+_locks_lock = threading.Lock()
+
+
+def _tenant_lock(tenant_id):
+    with _locks_lock:
+        return _locks[tenant_id]
+
+
+def version_key(tenant_id):
+    return f'{cache_namespace(tenant_id)}:suggest:version'
+
+
+def _shared_version(tenant_id):
+    keys = [GLOBAL_VERSION_KEY, version_key(tenant_id)]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, 1, timeout=None)
+            found[key] = cache.get(key, 1)
+    return tuple(found[key] for key in keys)
+
+
+def _rebuild(tenant_id, version, lock):
+    """Builds a tenant's index and swaps it in; runs in a background thread holding `lock`."""
+    try:
+        _indexes[tenant_id] = (SuggestIndex.build(tenant_id), version, time.monotonic())
+    finally:
+        lock.release()
+        connections.close_all() # this thread's connections
+
+
+def get_index(tenant_id):
+    """
+    Returns this process's index of a tenant; the cache is consulted at most once per interval.
+    Only a tenant's first lookup waits for its index: a stale one is served while it is rebuilt.
+    """
+    current = time.monotonic()
+    entry = _indexes.get(tenant_id)
+    if entry is not None and current - entry[2] < settings.SUGGEST['VERSION_CHECK_INTERVAL']:
+        return entry[0]
+    version = _shared_version(tenant_id)
+    lock = _tenant_lock(tenant_id)
+    if entry is None:
+        with lock:
+            entry = _indexes.get(tenant_id)
+            if entry is None:
+                entry = _indexes[tenant_id] = (SuggestIndex.build(tenant_id), version, current)
+        return entry[0]
+    if entry[1] == version:
+        _indexes[tenant_id] = (entry[0], version, current)
+    elif lock.acquire(blocking=False): # released by the rebuild
+        _indexes[tenant_id] = (entry[0], entry[1], current)
+        threading.Thread(target=_rebuild, args=(tenant_id, version, lock), daemon=True).start()
+    return entry[0]
+
+
+def _apply(tenant_id, kind, pk, label):
+    """
+    Applies a committed change to this process's index of a tenant, then bumps the tenant's version so
+    the other processes rebuild theirs. This index keeps up with the new version unless another
+    process changed the tenant meanwhile, in which case it is rebuilt too.
+    """
+    key = version_key(tenant_id)
+    with _tenant_lock(tenant_id):
+        try:
+            version = cache.incr(key)
+        except ValueError:
+            cache.add(key, 1, timeout=None)
+            version = None
+        entry = _indexes.get(tenant_id)
+        if entry is not None:
+            current = entry[1]
+            if version is not None and current[1] == version - 1:
+                current = (current[0], version)
+            _indexes[tenant_id] = (entry[0].updated(kind, pk, label), current, entry[2])
+
+
+def program_changed(tenant_id, program_id, title):
+    """Updates a tenant's suggestions for a saved program (`title`) or a deleted one (`title=None`)."""
+    _apply(tenant_id, 'program', program_id, title)
+
+
+def requirement_changed(requirement_id, tenant_ids):
+    """
+    Updates the suggestions of `tenant_ids` for a requirement: its description where a program of the
+    tenant still requires it, else it is left out.
+    """
+    descriptions = dict(
+        Requirement.objects.filter(pk=requirement_id, programs__tenant_id__in=tenant_ids)
+        .values_list('programs__tenant_id', 'description').distinct()
+    )
+    for tenant_id in tenant_ids:
+        _apply(tenant_id, 'requirement', requirement_id, descriptions.get(tenant_id))
+
+
+def invalidate(tenant_id=None):
+    """
+    Drops this process's index of a tenant (of every tenant when `None`) and tells the other
+    processes theirs is stale. Catalog changes are applied without it (see `program_changed`).
+    """
+    key = GLOBAL_VERSION_KEY if tenant_id is None else version_key(tenant_id)
+    if tenant_id is None:
+        _indexes.clear()
+    else:
+        _indexes.pop(tenant_id, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, timeout=None)
+
+
+def get_suggestions(prefix, tenant_id, limit=None):
+    """Returns a tenant's suggestions for `prefix` (see `SuggestIndex.lookup`)."""
+    limit = max(min(limit or settings.SUGGEST['LIMIT'], settings.SUGGEST['MAX_LIMIT']), 1)
+    return get_index(tenant_id).lookup(prefix, limit)
@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta, timezone
+from operator import itemgetter
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.timezone import now
+
+from .models import Program, ProgramTombstone
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class InvalidCursor(ValueError):
+    """Raised when a sync cursor cannot be parsed."""
+
+
+def format_cursor(timestamp, last_id=0, deleted=False):
+    """
+    Encodes a sync position as `<microseconds since epoch>.<id>`.
+    - `.0` means every change strictly before the timestamp was delivered.
+    - A program id means the changes at the timestamp were delivered up to that program.
+    - `.d<id>` means the changes at the timestamp were delivered up to that tombstone; at the same
+      timestamp, updates come before deletions.
+    """
+    micros = (timestamp - EPOCH) // timedelta(microseconds=1)
+    return f"{micros}.{'d' if deleted else ''}{last_id}"
+
+
+def parse_cursor(cursor):
+    """Decodes a cursor produced by `format_cursor` into `(timestamp, last_id, deleted)`."""
+    if not cursor:
+        return EPOCH, 0, False
+    try:
+        micros, last_id = cursor.split('.')
+        deleted = last_id.startswith('d')
+        return EPOCH + timedelta(microseconds=int(micros)), int(last_id[1:] if deleted else last_id), deleted
+    except (ValueError, OverflowError):
+        raise InvalidCursor(cursor)
+
+
+def changes_since(cursor, limit, tenant_id):
+    """
+    Returns the changes to a tenant's catalog after `cursor` as a dict:
+    - `programs`: Programs created or updated since the cursor, oldest change first, with
+      requirements and images prefetched.
+    - `deleted`: Ids of programs deleted since the cursor.
+    - `cursor`: The cursor to send on the next sync.
+    - `has_more`: Whether another page is waiting.
+
+    Updates and deletions form one stream ordered by `(time, updates first, id)`, paged `limit`
+    changes at a time with the same cursor. A full sync (no cursor) skips deletions: the client has
+    no rows to delete, and every deleted program is already absent from the programs.
+    Rows changed in the last `SAFETY_LAG` seconds are left for the next sync, so transactions
+    still in flight when the cursor is issued cannot commit behind it.
+    """
+    since, last_id, after_deletion = parse_cursor(cursor)
+    until = now() - timedelta(seconds=settings.PROGRAM_SYNC['SAFETY_LAG'])
+
+    # At `since`, updates are done when the cursor points at a deletion
+    updated = Q(updated_at__gt=since) if after_deletion else Q(updated_at__gt=since) | Q(updated_at=since, id__gt=last_id)
+    programs = list(
+        Program.objects
+        .filter(updated, tenant_id=tenant_id, updated_at__lt=until)
+        .order_by('updated_at', 'id')
+        .prefetch_related('requirements', 'additional_images')[:limit + 1]
+    )
+    changes = [((program.updated_at, 0, program.id), program) for program in programs]
+    if cursor:
+        deleted_after = Q(deleted_at__gt=since) | Q(deleted_at=since, id__gt=last_id if after_deletion else 0)
+        tombstones = (
+            ProgramTombstone.objects
+            .filter(deleted_after, tenant_id=tenant_id, deleted_at__lt=until)
+            .order_by('deleted_at', 'id')[:limit + 1]
+        )
+        changes += [((tombstone.deleted_at, 1, tombstone.id), tombstone) for tombstone in tombstones]
+    changes.sort(key=itemgetter(0))
+
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    if has_more:
+        timestamp, kind, change_id = changes[-1][0]
+        next_cursor = format_cursor(timestamp, change_id, deleted=bool(kind))
+    else:
+        # Everything before `until` was delivered, so the next sync starts there
+        next_cursor = format_cursor(max(until, since))
+    return {
+        'programs': [change for (_, kind, _), change in changes if not kind],
+        'deleted': [change.program_id for (_, kind, _), change in changes if kind],
+        'cursor': next_cursor,
+        'has_more': has_more,
+    }
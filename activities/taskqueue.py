@@ -0,0 +1,292 @@
+"""
+A small background task subsystem.
+
+    @task(max_retries=5)
+    def send_digest(user_id):
+        ...
+
+    send_digest.delay(user.id)
+
+`TASKS['BACKEND']` selects where `.delay()` sends the call:
+- `database`: a `BackgroundTask` row, run by `manage.py runworker`. The row is written in the
+  caller's transaction, so a task is only queued if the transaction commits.
+- `memory`: an in-process thread pool, started once the caller's transaction commits.
+- `immediate`: runs the task synchronously (tests, debugging).
+Failed tasks are retried up to `max_retries` times with an exponential backoff. A task can tell
+whether a failure will be retried with `is_last_attempt()`.
+
+A running task holds a lease of `TASKS['LEASE']` seconds, renewed by its worker every
+`TASKS['HEARTBEAT']` seconds; a task whose lease expires (its worker died) is claimed again.
+"""
+import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils.timezone import now
+
+from .models import BackgroundTask, TaskStatus
+
+logger = logging.getLogger(__name__)
+
+registry = {}
+
+_attempt = threading.local()
+
+
+def is_last_attempt():
+    """
+    Returns whether the running task will not be retried if it fails now. `True` outside a task
+    and with the `immediate` backend, which does not retry.
+    """
+    return getattr(_attempt, 'last', True)
+
+
+@contextmanager
+def task_attempt(last):
+    """Runs a task attempt, `last` telling whether a failure is final (see `is_last_attempt`)."""
+    previous = is_last_attempt()
+    _attempt.last = last
+    try:
+        yield
+    finally:
+        _attempt.last = previous
+
+
+class Task:
+    """A function registered with `@task`; call `.delay()` to run it in the background."""
+    def __init__(self, func, name, max_retries, backoff):
+        self.func = func
+        self.name = name
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def __repr__(self):
+        return f"Task(name={self.name})"
+
+    def retry_delay(self, attempts):
+        """Seconds to wait before the next attempt, after `attempts` failed ones."""
+        return self.backoff ** attempts
+
+    def delay(self, *args, **kwargs):
+        """Queues a call of the task with the configured backend."""
+        return get_backend().enqueue(self, args, kwargs)
+
+    def delay_many(self, arg_lists):
+        """Queues one call of the task per argument list, in bulk where the backend supports it."""
+        return get_backend().enqueue_many(self, [list(args) for args in arg_lists])
+
+
+def task(func=None, *, name=None, max_retries=3, backoff=2.0):
+    """
+    Registers a function as a background task.
+    - `name`: The registry name, defaults to `<module>.<function>`.
+    - `max_retries`: How many times a failing call is retried.
+    - `backoff`: Base of the exponential retry delay, in seconds (`backoff ** attempts`).
+    """
+    def decorator(func):
+        registered = Task(func, name or f'{func.__module__}.{func.__name__}', max_retries, backoff)
+        registry[registered.name] = registered
+        return registered
+    return decorator(func) if func is not None else decorator
+
+
+class ImmediateBackend:
+    """Runs tasks synchronously in the caller, without retries."""
+    def enqueue(self, task, args, kwargs):
+        return task(*args, **kwargs)
+
+    def enqueue_many(self, task, arg_lists):
+        return [self.enqueue(task, args, {}) for args in arg_lists]
+
+
+class MemoryBackend:
+    """Runs tasks on an in-process thread pool; retries are rescheduled with a timer."""
+    def __init__(self, workers=4):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='task')
+
+    def enqueue(self, task, args, kwargs):
+        transaction.on_commit(lambda: self.executor.submit(self.run, task, args, kwargs, 1))
+
+    def enqueue_many(self, task, arg_lists):
+        for args in arg_lists:
+            self.enqueue(task, args, {})
+
+    def run(self, task, args, kwargs, attempt):
+        try:
+            with task_attempt(attempt > task.max_retries):
+                task(*args, **kwargs)
+        except Exception:
+            if attempt > task.max_retries:
+                logger.exception('Task %s failed after %d attempts', task.name, attempt)
+                return
+            logger.warning('Task %s failed (attempt %d), retrying', task.name, attempt, exc_info=True)
+            timer = threading.Timer(
+                task.retry_delay(attempt), self.executor.submit, args=(self.run, task, args, kwargs, attempt + 1)
+            )
+            timer.daemon = True
+            timer.start()
+        finally:
+            close_old_connections()
+
+
+class DatabaseBackend:
+    """Stores tasks as `BackgroundTask` rows, executed by `manage.py runworker`."""
+    def enqueue(self, task, args, kwargs):
+        return BackgroundTask.objects.create(
+            name=task.name, args=list(args), kwargs=kwargs, max_retries=task.max_retries
+        )
+
+    def enqueue_many(self, task, arg_lists):
+        return BackgroundTask.objects.bulk_create(
+            [BackgroundTask(name=task.name, args=args, kwargs={}, max_retries=task.max_retries) for args in arg_lists],
+            batch_size=500,
+        )
+
+
+BACKENDS = {
+    'immediate': ImmediateBackend,
+    'memory': MemoryBackend,
+    'database': DatabaseBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Returns the backend selected by `TASKS['BACKEND']`, created once per process."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = settings.TASKS['BACKEND']
+                _backend = BACKENDS[name](**settings.TASKS.get('OPTIONS', {}).get(name, {}))
+    return _backend
+
+
+def set_backend(backend):
+    """Replaces the task backend, e.g. with an `ImmediateBackend` in tests; `None` resets it."""
+    global _backend
+    _backend = backend
+
+
+def claim_tasks(limit):
+    """
+    Marks up to `limit` due tasks as running and returns them.
+    Pending tasks are due once `run_at` has passed; running tasks whose worker has not renewed their
+    lease (see `Heartbeat`) for `TASKS['LEASE']` seconds are reclaimed. Rows are locked with SKIP LOCKED, so several
+    workers never claim the same task.
+    """
+    current = now()
+    lease_expired = current - timedelta(seconds=settings.TASKS['LEASE'])
+    with transaction.atomic():
+        tasks = list(
+            BackgroundTask.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                Q(status=TaskStatus.PENDING, run_at__lte=current)
+                | Q(status=TaskStatus.RUNNING, updated_at__lt=lease_expired)
+            )
+            .order_by('run_at')[:limit]
+        )
+        for background_task in tasks:
+            background_task.status = TaskStatus.RUNNING
+            background_task.attempts += 1
+            background_task.updated_at = current
+        BackgroundTask.objects.bulk_update(tasks, ['status', 'attempts', 'updated_at'])
+    return tasks
+
+
+class Heartbeat:
+    """
+    Renews the lease of claimed tasks while they run: a thread bumps their `updated_at` every
+    `interval` seconds until the context exits, so a task running longer than `TASKS['LEASE']` is not
+    claimed again by another worker.
+    """
+    def __init__(self, tasks, interval):
+        self.task_ids = [background_task.pk for background_task in tasks]
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.run, name='task-heartbeat', daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop_event.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.beat()
+            except Exception:
+                logger.exception('Could not renew the lease of tasks %s', self.task_ids)
+            finally:
+                close_old_connections()
+
+    def beat(self):
+        """Renews the lease of the tasks still running; returns how many were renewed."""
+        return BackgroundTask.objects.filter(pk__in=self.task_ids, status=TaskStatus.RUNNING).update(updated_at=now())
+
+
+def execute(background_task):
+    """Runs a claimed task and records its outcome, scheduling a retry when it fails."""
+    registered = registry.get(background_task.name)
+    try:
+        if registered is None:
+            raise LookupError(f'Unknown task {background_task.name}')
+        with task_attempt(background_task.attempts > background_task.max_retries):
+            registered(*background_task.args, **background_task.kwargs)
+    except Exception:
+        background_task.last_error = traceback.format_exc()
+        if registered is not None and background_task.attempts <= background_task.max_retries:
+            background_task.status = TaskStatus.PENDING
+            background_task.run_at = now() + timedelta(seconds=registered.retry_delay(background_task.attempts))
+        else:
+            background_task.status = TaskStatus.FAILED
+            background_task.finished_at = now()
+            logger.error('Task %s (%s) failed', background_task.name, background_task.pk)
+    else:
+        background_task.status = TaskStatus.SUCCEEDED
+        background_task.finished_at = now()
+    finally:
+        background_task.save(update_fields=['status', 'run_at', 'last_error', 'finished_at', 'updated_at'])
+        close_old_connections()
+
+
+def run_worker(concurrency=4, poll_interval=1.0, once=False, stop_event=None):
+    """
+    Polls the `BackgroundTask` table and runs due tasks on a pool of `concurrency` threads
+    (in the calling thread when `concurrency` is 1).
+    With `once`, returns when no task is due instead of polling forever.
+    """
+    stop_event = stop_event or threading.Event()
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='worker') if concurrency > 1 else None
+    run_all = executor.map if executor else map
+    try:
+        while not stop_event.is_set():
+            tasks = claim_tasks(concurrency)
+            if tasks:
+                # wait for the batch, so no more than `concurrency` tasks are claimed at a time
+                with Heartbeat(tasks, settings.TASKS['HEARTBEAT']):
+                    list(run_all(execute, tasks))
+            elif once:
+                break
+            else:
+                stop_event.wait(poll_interval)
+                close_old_connections()
+    finally:
+        if executor:
+            executor.shutdown()
@@ -0,0 +1,156 @@
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection, send_mail
+from django.db.models import F
+from django.utils.timezone import now
+from djoser.email import ActivationEmail
+
+from .models import EmailLog, EmailStatus, MessageContact, User
+from .related import refresh_related, programs_affected_by
+from .taskqueue import is_last_attempt, task
+
+
+def serialize_message(message):
+    """Returns the JSON-serializable fields needed to rebuild and send an email message."""
+    return {
+        'subject': message.subject,
+        'body': message.body,
+        'from_email': message.from_email,
+        'to': list(message.to),
+        'cc': list(message.cc),
+        'bcc': list(message.bcc),
+        'reply_to': list(message.reply_to),
+        'content_subtype': message.content_subtype,
+        'alternatives': [list(alternative) for alternative in getattr(message, 'alternatives', [])],
+    }
+
+
+@task(max_retries=5)
+def send_email(log_id, message=None):
+    """
+    Sends an email rendered in the request and records the outcome on its `EmailLog`.
+    - `log_id`: The id of the `EmailLog` row created when the email was queued.
+    - `message`: The email as a dict (see `serialize_message`); read from the
+      log's `payload` when omitted.
+    A failure re-raises, so the task is retried. The log stays pending while retries remain, and is
+    only marked failed after the last attempt: `requeue_failed` (and the admin retry action) never
+    queue a delivery that is still being retried.
+    """
+    if message is None:
+        message = EmailLog.objects.filter(pk=log_id).values_list('payload', flat=True).first()
+        if message is None:
+            return # purged, or logged without a payload
+    email = EmailMultiAlternatives(
+        subject=message['subject'],
+        body=message['body'],
+        from_email=message['from_email'],
+        to=message['to'],
+        cc=message['cc'],
+        bcc=message['bcc'],
+        reply_to=message['reply_to'],
+    )
+    email.content_subtype = message['content_subtype']
+    for content, mimetype in message['alternatives']:
+        email.attach_alternative(content, mimetype)
+    try:
+        email.send()
+    except Exception as error:
+        EmailLog.objects.filter(pk=log_id).update(
+            status=EmailStatus.FAILED if is_last_attempt() else EmailStatus.PENDING,
+            attempts=F('attempts') + 1, last_error=repr(error), updated_at=now(),
+        )
+        raise
+    EmailLog.objects.filter(pk=log_id).update(
+        status=EmailStatus.SENT, attempts=F('attempts') + 1, last_error='', sent_at=now(), updated_at=now()
+    )
+
+
+@task(max_retries=5)
+def notify_staff(message_id):
+    """
+    Emails the staff about a new contact message.
+    Recipients are `CONTACT_MESSAGES['NOTIFY_EMAILS']`, or every active staff user when it is empty.
+    """
+    message = MessageContact.objects.filter(pk=message_id).first()
+    if message is None:
+        return
+    recipients = settings.CONTACT_MESSAGES['NOTIFY_EMAILS'] or list(
+        User.objects.filter(is_staff=True, is_active=True).exclude(email='').values_list('email', flat=True)
+    )
+    if not recipients:
+        return
+    send_mail(
+        subject=f'New contact message from {message.name}',
+        message=f'{message.name} <{message.email}> ({message.phone}) wrote:\n\n{message.message}',
+        from_email=None,
+        recipient_list=recipients,
+    )
+
+
+def send_logged(messages, logs, connection):
+    """
+    Sends `messages` on an open `connection`, one message per call so that every outcome is known,
+    and records each outcome on its `EmailLog` (from `logs`, in the same order). Failed deliveries
+    keep their payload and are retried with `requeue_failed`. Returns the number of emails sent.
+    """
+    sent = 0
+    for message, log in zip(messages, logs):
+        try:
+            connection.send_messages([message])
+        except Exception as error:
+            log.status, log.last_error = EmailStatus.FAILED, repr(error)
+        else:
+            log.status, log.sent_at = EmailStatus.SENT, now()
+            sent += 1
+        log.attempts = 1
+        log.updated_at = now()
+    EmailLog.objects.bulk_update(logs, ['status', 'attempts', 'last_error', 'sent_at', 'updated_at'])
+    return sent
+
+
+@task(max_retries=5)
+def send_activation_emails(user_ids):
+    """
+    Sends the Djoser activation email to a batch of inactive users (bulk enrollment) over a
+    single SMTP connection.
+    The pending `EmailLog` rows are written before anything is sent, then each outcome is recorded
+    on its row. The task does not raise for failed deliveries, so a retry never resends the emails
+    that went out; they are retried one by one with `requeue_failed`.
+    """
+    users = list(User.objects.filter(pk__in=user_ids, is_active=False).exclude(email=''))
+    messages = []
+    for user in users:
+        message = ActivationEmail(context={'user': user})
+        message.render()
+        message.to = [user.email]
+        message.from_email = settings.DEFAULT_FROM_EMAIL
+        messages.append(message)
+    logs = EmailLog.objects.bulk_create([
+        EmailLog(recipient=user, to_email=user.email, subject=message.subject[:255], payload=serialize_message(message))
+        for user, message in zip(users, messages)
+    ])
+    if not logs:
+        return
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as error: # nothing can be sent: every delivery fails, to be requeued
+        EmailLog.objects.filter(pk__in=[log.pk for log in logs]).update(
+            status=EmailStatus.FAILED, attempts=1, last_error=repr(error), updated_at=now()
+        )
+        return
+    try:
+        send_logged(messages, logs, connection)
+    finally:
+        connection.close()
+
+
+@task
+def refresh_related_for_requirement(program_id, requirement_id):
+    """Refreshes the related programs affected by linking/unlinking a requirement to a program."""
+    refresh_related(programs_affected_by(program_id, requirement_id))
+
+
+@task
+def refresh_related_programs(program_ids):
+    """Refreshes the related programs of `program_ids` (those that shared a requirement with a deleted program)."""
+    refresh_related(program_ids)
@@ -0,0 +1,107 @@
+"""
+Tenant (federation) resolution.
+
+`TenantMiddleware` resolves the tenant of each request from the `TENANTS['HEADER']` header (a tenant
+slug) or the request host (`Tenant.domain`), falling back to the `TENANTS['DEFAULT']` tenant, and
+sets it as `request.tenant` and as the current tenant of the context. Rows created without an
+explicit tenant (`Program`, `User`, `MessageContact`) default to the current tenant.
+"""
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.http import JsonResponse
+
+_current_tenant = ContextVar('current_tenant', default=None)
+
+# Resolved tenants per header value or host, least recently used first: kept `TENANTS['CACHE_TIMEOUT']`
+# seconds in each process, at most `TENANTS['CACHE_SIZE']` of them. Unknown values are not kept, so
+# requests with made-up headers or hosts cannot fill it.
+_resolved = OrderedDict()
+_resolved_lock = threading.Lock()
+
+
+def get_current_tenant():
+    """Returns the tenant of the current request, or `None` outside of one."""
+    return _current_tenant.get()
+
+
+def set_current_tenant(tenant):
+    """Makes `tenant` the current tenant; returns the token to pass to `reset_current_tenant`."""
+    return _current_tenant.set(tenant)
+
+
+def reset_current_tenant(token):
+    _current_tenant.reset(token)
+
+
+def get_default_tenant():
+    """Returns the `TENANTS['DEFAULT']` tenant (created by migration 0013)."""
+    return _lookup(('slug', settings.TENANTS['DEFAULT']))
+
+
+def current_tenant_id():
+    """Default of the tenant foreign keys: the current tenant, else the default tenant."""
+    tenant = get_current_tenant() or get_default_tenant()
+    return tenant.pk if tenant else None
+
+
+def _lookup(key, fallback=None):
+    """Returns the tenant whose `field` is `value` (`key`), else `fallback()`; only found tenants are kept."""
+    from .models import Tenant  # deferred: the models module uses `current_tenant_id` as a default
+    field, value = key
+    with _resolved_lock:
+        cached = _resolved.get(key)
+        if cached and cached[1] > time.monotonic():
+            _resolved.move_to_end(key)
+            return cached[0]
+    tenant = Tenant.objects.filter(**{field: value}).first() or (fallback and fallback())
+    if tenant is None:
+        return None
+    with _resolved_lock:
+        _resolved[key] = (tenant, time.monotonic() + settings.TENANTS['CACHE_TIMEOUT'])
+        _resolved.move_to_end(key)
+        while len(_resolved) > settings.TENANTS['CACHE_SIZE']:
+            _resolved.popitem(last=False)
+    return tenant
+
+
+def clear_tenant_cache():
+    """Forgets the resolved tenants of this process (called when a tenant changes)."""
+    with _resolved_lock:
+        _resolved.clear()
+
+
+def resolve_tenant(request):
+    """
+    Returns the tenant of a request: by the tenant header when sent, else by host, else the default.
+    Returns `None` when the header names an unknown tenant.
+    """
+    slug = request.headers.get(settings.TENANTS['HEADER'])
+    if slug:
+        return _lookup(('slug', slug))
+    # Hosts are limited to ALLOWED_HOSTS, so the ones falling back to the default tenant are kept too
+    return _lookup(('domain', request.get_host().split(':')[0].lower()), fallback=get_default_tenant)
+
+
+def cache_namespace(tenant_id):
+    """Returns the prefix of a tenant's cache keys, so one tenant's writes never invalidate another's entries."""
+    return f't{tenant_id}'
+
+
+class TenantMiddleware:
+    """Resolves the request tenant (see `resolve_tenant`) and answers 404 for an unknown tenant header."""
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.tenant = resolve_tenant(request)
+        if request.tenant is None:
+            return JsonResponse({'detail': 'Unknown tenant.'}, status=404)
+        token = set_current_tenant(request.tenant)
+        try:
+            return self.get_response(request)
+        finally:
+            reset_current_tenant(token)
@@ -1,3 +1,1782 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import importlib
+import io
+import os
+import posixpath
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import uuid
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.apps import apps
+from django.db import IntegrityError, connection, models
+from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.state import ProjectState
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.translation import gettext_lazy
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from .models import (
+    Tenant,
+    User,
+    Program,
+    Requirement,
+    ProgramRequirement,
+    ProgramImage,
+    Favorite,
+    EmailLog,
+    WeeklyEmail,
+    MessageContact,
+    BackgroundTask,
+    TaskStatus,
+    EmailStatus,
+    AnalyticsEvent,
+    AnalyticsEventKind,
+    ProgramDailyStat,
+    SearchDailyStat,
+    BackfillProgress,
+    SlowQuery,
+    ProgramReminder,
+    RevokedToken,
+    ProgramTombstone,
+    RelatedProgram,
+    ProgramCategory,
+    ProgramAudience,
+)
+from .sync import changes_since, format_cursor
+from .serializer import FavoriteSerializer
+from .events import CacheEventBackend, InMemoryEventBackend, set_backend
+from .taskqueue import ImmediateBackend, MemoryBackend, DatabaseBackend, Heartbeat, claim_tasks, set_backend as set_task_backend, run_worker, task
+from .tasks import notify_staff
+from .analytics import EventBuffer, set_buffer as set_analytics_buffer, purge_events, rollup
+from .trending import redecay
+from . import suggest
+from .suggest import SuggestIndex, invalidate as invalidate_suggestions
+from . import tenants
+from .tenants import get_default_tenant, set_current_tenant, reset_current_tenant, clear_tenant_cache
+from .favorites import feed_cache_key, get_favorites_feed, get_favorite_program_ids, is_favorite
+from .email import queue_message, requeue_failed, purge_email_logs
+from .compression import CODECS, CompressionMiddleware, negotiate
+from .renderers import FastJSONParser, FastJSONRenderer, orjson
+from .backfill import Backfill, register as register_backfill, run_backfill, BACKFILLS
+from .operations import AddIndexConcurrently
+from .calendar import fold
+from .storage import HASHED_NAME_RE, ContentAddressedStorage
+from .management.commands.profile_startup import parse_importtime
+from .enrollment import enroll_users
+from .related import compute_related, refresh_related
+from .slowlog import REDACTED, SlowQueryRecorder, normalize_sql, set_recorder as set_slow_query_recorder
+from .advisor import advise
+from .reminders import claim, due_reminders, send_due_reminders, user_batches
+from .authentication import revoke_all_tokens
+from .revocation import BloomFilter, RevocationStore, get_store as get_revocation_store, set_store as set_revocation_store
+
+# Analytics events are discarded during tests (no flush thread writing outside the test transaction);
+# AnalyticsTests installs a buffer of its own
+set_analytics_buffer(EventBuffer(size=0, flush_interval=None))
+
+
+def make_program(title='Program', **kwargs):
+    """Creates a `Program` with sensible defaults for the required fields."""
+    defaults = {
+        'description': 'Description',
+        'cost': 0,
+        'start_date': date(2030, 1, 1),
+        'end_date': date(2030, 2, 1),
+        'url': 'https://example.com',
+    }
+    defaults.update(kwargs)
+    return Program.objects.create(title=title, **defaults)
+
+
+class AdminChangelistQueryCountTests(TestCase):
+    """
+    Every changelist must run a constant number of queries, whatever the number of rows.
+    """
+    models = [
+        User, Program, Requirement, ProgramRequirement, ProgramImage,
+        Favorite, EmailLog, WeeklyEmail, MessageContact,
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        self.client.get(reverse('admin:index')) # the request tenant is resolved once, then cached
+
+    def add_rows(self, count):
+        for _ in range(count):
+            index = User.objects.count()
+            user = User.objects.create_user(f'user{index}', f'user{index}@example.com', 'password')
+            program = make_program(f'Program {index}')
+            requirement = Requirement.objects.create(description=f'Requirement {index}')
+            ProgramRequirement.objects.create(program=program, requirement=requirement)
+            ProgramImage.objects.create(program=program, image=f'program_images/{index}.png')
+            Favorite.objects.create(user=user, program=program)
+            EmailLog.objects.create()
+            WeeklyEmail.objects.create(subject=f'Week {index}')
+            MessageContact.objects.create(
+                name='Name', email=f'user{index}@example.com', phone='0100', message='Hello'
+            )
+
+    def changelist_query_count(self, model):
+        url = reverse(f'admin:activities_{model._meta.model_name}_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_query_count_is_constant(self):
+        self.add_rows(2)
+        baseline = {model: self.changelist_query_count(model) for model in self.models}
+        self.add_rows(8)
+        for model in self.models:
+            with self.subTest(model=model.__name__):
+                self.assertEqual(self.changelist_query_count(model), baseline[model])
+
+
+class CatalogEventTests(TestCase):
+    """
+    Program and image changes are published to the event backend and streamed with resumable ids.
+    """
+    def setUp(self):
+        self.backend = InMemoryEventBackend(max_events=10)
+        set_backend(self.backend)
+        self.addCleanup(set_backend, None)
+
+    def test_program_changes_publish_events(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            program = make_program()
+        with self.captureOnCommitCallbacks(execute=True):
+            ProgramImage.objects.create(program=program, image='program_images/a.png')
+        with self.captureOnCommitCallbacks(execute=True):
+            program.delete()
+        events, complete = self.backend.read_since(0)
+        self.assertTrue(complete)
+        self.assertEqual(
+            [event['type'] for event in events],
+            ['program.created', 'program.image.created', 'program.image.deleted', 'program.deleted'],
+        )
+        self.assertEqual(self.backend.read_since(events[1]['id'])[0], events[2:])
+
+    def test_deleting_a_program_skips_per_image_and_link_work(self):
+        self.backend = InMemoryEventBackend(max_events=100)
+        set_backend(self.backend)
+        set_task_backend(ImmediateBackend())
+        self.addCleanup(set_task_backend, None)
+        requirement = Requirement.objects.create(description='Python')
+        programs = [make_program(f'Program {n}') for n in range(3)]
+        for program in programs:
+            ProgramRequirement.objects.create(program=program, requirement=requirement)
+            for name in 'abc':
+                ProgramImage.objects.create(program=program, image=f'program_images/{name}.png')
+
+        for deletion in (lambda: programs[0].delete(), lambda: Program.objects.filter(pk__in=[p.pk for p in programs[1:]]).delete()):
+            with (
+                self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries,
+                mock.patch('activities.tasks.refresh_related_for_requirement.delay') as delay,
+            ):
+                deletion()
+            delay.assert_not_called()
+            sql = [query['sql'] for query in queries]
+            self.assertFalse([query for query in sql if query.startswith('UPDATE "activities_program"')])
+            tenant_lookups = [query for query in sql if query.startswith((
+                'SELECT "activities_program"."tenant_id" FROM', 'SELECT "activities_program"."id", "activities_program"."tenant_id" FROM',
+            ))]
+            self.assertLessEqual(len(tenant_lookups), 1)
+        events = [event['type'] for event in self.backend.read_since(0)[0]]
+        self.assertEqual(events.count('program.image.deleted'), 9)
+        self.assertEqual(events.count('program.deleted'), 3)
+
+    def test_evicted_events_are_reported(self):
+        for index in range(12):
+            self.backend.publish({'type': 'program.updated', 'program': index})
+        events, complete = self.backend.read_since(0)
+        self.assertFalse(complete)
+        self.assertEqual(events[0]['id'], 3)
+
+    def test_ids_ahead_of_the_backend_are_reported(self):
+        self.backend.publish({'type': 'program.updated', 'program': 1})
+        self.assertEqual(self.backend.read_since(5), ([], False)) # e.g. the process restarted
+
+
+class CacheEventBackendTests(TestCase):
+    """
+    The cache backend waits out ids taken by concurrent publishers, and detects expired events and flushed caches.
+    """
+    def setUp(self):
+        cache.clear()
+        self.backend = CacheEventBackend(gap_timeout=60)
+
+    def test_an_event_still_being_written_is_waited_for(self):
+        first = self.backend.publish({'type': 'program.updated', 'program': 1})
+        # Publisher A took the next id but has not written its event yet; publisher B wrote the one after
+        cache.incr(CacheEventBackend.SEQUENCE_KEY)
+        third = self.backend.publish({'type': 'program.updated', 'program': 3})
+        self.assertEqual(self.backend.read_since(first), ([], True))
+        cache.set(self.backend.event_key(first + 1), {'type': 'program.updated', 'program': 2, 'id': first + 1})
+        events, complete = self.backend.read_since(first)
+        self.assertTrue(complete)
+        self.assertEqual([event['id'] for event in events], [first + 1, third])
+
+        cache.delete(self.backend.event_key(third)) # expired
+        self.backend.gap_timeout = 0
+        self.assertEqual(self.backend.read_since(first + 1), ([], False))
+
+    def test_a_flushed_cache_resets_the_client(self):
+        self.backend.publish({'type': 'program.updated', 'program': 1})
+        cache.clear()
+        self.assertEqual(self.backend.read_since(1), ([], False))
+
+
+@override_settings(CATALOG_EVENTS={**settings.CATALOG_EVENTS, 'STREAM_TIMEOUT': 0.05, 'POLL_INTERVAL': 0.01})
+class CatalogEventStreamTests(TestCase):
+    def setUp(self):
+        self.backend = InMemoryEventBackend()
+        set_backend(self.backend)
+        self.addCleanup(set_backend, None)
+        self.tenant = get_default_tenant()
+
+    async def test_stream_resumes_from_last_event_id(self):
+        for index in range(3):
+            self.backend.publish({'type': 'program.updated', 'program': index, 'tenant': self.tenant.pk})
+        self.backend.publish({'type': 'program.deleted', 'program': 9, 'tenant': self.tenant.pk + 1})
+        response = await self.async_client.get('/api/events/programs/', headers={'Last-Event-ID': '1'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = ''.join([chunk.decode() async for chunk in response.streaming_content])
+        self.assertNotIn('id: 1\n', body)
+        self.assertIn('id: 2\nevent: program.updated\n', body)
+        self.assertIn('id: 3\nevent: program.updated\n', body)
+        self.assertNotIn('program.deleted', body) # another tenant's event
+
+    async def test_stream_resets_clients_ahead_of_the_backend(self):
+        self.backend.publish({'type': 'program.updated', 'program': 1, 'tenant': self.tenant.pk})
+        response = await self.async_client.get('/api/events/programs/', headers={'Last-Event-ID': '50'})
+        body = ''.join([chunk.decode() async for chunk in response.streaming_content])
+        self.assertIn('id: 1\nevent: reset\n', body)
+
+
+class ProgramSyncTests(TestCase):
+    """
+    The delta sync pages updates and deletions with one `(time, id)` cursor, without losing or repeating a change.
+    """
+    def setUp(self):
+        self.tenant = get_default_tenant()
+        self.base = timezone.now() - timedelta(hours=1)
+
+    def at(self, program, minutes):
+        Program.objects.filter(pk=program.pk).update(updated_at=self.base + timedelta(minutes=minutes))
+
+    def sync_all(self, cursor=None, limit=2):
+        """Pages until `has_more` is false; returns the program ids, deleted ids and the last cursor."""
+        programs, deleted = [], []
+        while True:
+            changes = changes_since(cursor, limit, self.tenant.pk)
+            programs += [program.pk for program in changes['programs']]
+            deleted += changes['deleted']
+            cursor = changes['cursor']
+            if not changes['has_more']:
+                return programs, deleted, cursor
+
+    def test_same_timestamp_ties_are_split_across_pages(self):
+        programs = [make_program(f'Tie {n}') for n in range(5)]
+        for program in programs:
+            self.at(program, 1)
+        ids, deleted, _ = self.sync_all(limit=2)
+        self.assertEqual(ids, sorted(program.pk for program in programs))
+        self.assertEqual(deleted, [])
+
+    def test_deletes_between_pages_are_delivered_once(self):
+        programs = [make_program(f'Program {n}') for n in range(4)]
+        for minutes, program in enumerate(programs):
+            self.at(program, minutes)
+        first = changes_since(None, 2, self.tenant.pk)
+        self.assertEqual([program.pk for program in first['programs']], [programs[0].pk, programs[1].pk])
+
+        removed = [programs[0].pk, programs[2].pk] # delivered already, and not yet
+        Program.objects.filter(pk__in=removed).delete()
+        ProgramTombstone.objects.update(deleted_at=self.base + timedelta(minutes=10))
+        ids, deleted, cursor = self.sync_all(first['cursor'], limit=1)
+        self.assertEqual(ids, [programs[3].pk])
+        self.assertEqual(sorted(deleted), removed)
+        self.assertEqual(self.sync_all(cursor)[:2], ([], []))
+
+    def test_full_sync_skips_tombstones_and_pages_them_later(self):
+        self.at(make_program('Kept'), -30)
+        for n in range(5):
+            make_program(f'Deleted {n}').delete()
+        ProgramTombstone.objects.update(deleted_at=self.base)
+        changes = changes_since(None, 10, self.tenant.pk)
+        self.assertEqual((len(changes['programs']), changes['deleted']), (1, []))
+
+        old_cursor = format_cursor(self.base - timedelta(minutes=1))
+        first = changes_since(old_cursor, 2, self.tenant.pk)
+        self.assertEqual(len(first['deleted']), 2) # tombstones are paged too
+        self.assertTrue(first['has_more'])
+        self.assertEqual(len(self.sync_all(old_cursor)[1]), 5)
+
+    @override_settings(PROGRAM_SYNC={**settings.PROGRAM_SYNC, 'SAFETY_LAG': 0})
+    def test_touched_programs_are_resent(self):
+        program = make_program()
+        _, _, cursor = self.sync_all()
+        self.assertEqual(self.sync_all(cursor)[0], [])
+        ProgramImage.objects.create(program=program, image='program_images/a.png') # bumps updated_at
+        self.assertEqual(self.sync_all(cursor)[0], [program.pk])
+
+
+class MessageContactIngestionTests(TestCase):
+    """
+    Contact messages are stored once per submission and never wait for the staff notification.
+    """
+    url = '/api/messages/'
+
+    def payload(self, index=0):
+        return {'name': 'Name', 'email': f'user{index}@example.com', 'phone': '0100', 'message': f'Hello {index}'}
+
+    def test_duplicate_submission_returns_existing_message(self):
+        first = self.client.post(self.url, self.payload())
+        second = self.client.post(self.url, dict(self.payload(), email='USER0@example.com ', message='Hello   0'))
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json()['id'], first.json()['id'])
+        self.assertEqual(MessageContact.objects.count(), 1)
+
+    def test_idempotency_key(self):
+        headers = {'Idempotency-Key': 'key-1'}
+        first = self.client.post(self.url, self.payload(), headers=headers)
+        again = self.client.post(self.url, self.payload(), headers=headers)
+        other = self.client.post(self.url, self.payload(1), headers=headers)
+        self.assertEqual((first.status_code, again.status_code, other.status_code), (201, 200, 409))
+        self.assertEqual(MessageContact.objects.count(), 1)
+
+    def test_create_latency_is_flat_during_notification_bursts(self):
+        notification_time = 0.1
+        latencies = []
+        backend = MemoryBackend(workers=8)
+        set_task_backend(backend)
+        self.addCleanup(set_task_backend, None)
+        with mock.patch.object(notify_staff, 'func', side_effect=lambda pk: time.sleep(notification_time)):
+            for index in range(50):
+                started = time.perf_counter()
+                with self.captureOnCommitCallbacks(execute=True): # on-commit hooks run inline, as in autocommit
+                    response = self.client.post(self.url, self.payload(index))
+                latencies.append(time.perf_counter() - started)
+                self.assertEqual(response.status_code, 201)
+            backend.executor.shutdown(wait=True)
+        p99 = sorted(latencies)[int(len(latencies) * 0.99) - 1]
+        self.assertLess(p99, notification_time)
+
+
+flaky_calls = []
+
+
+@task(name='tests.flaky', max_retries=1, backoff=0)
+def flaky(fail_times):
+    flaky_calls.append(fail_times)
+    if len(flaky_calls) <= fail_times:
+        raise RuntimeError('flaky')
+
+
+@task(name='tests.slow', max_retries=0)
+def slow(seconds):
+    time.sleep(seconds)
+
+
+class TaskQueueTests(TestCase):
+    """
+    Tasks queued in the database are run, retried with backoff and recorded by the worker.
+    """
+    def setUp(self):
+        set_task_backend(DatabaseBackend())
+        self.addCleanup(set_task_backend, None)
+        flaky_calls.clear()
+
+    def test_task_is_retried_then_succeeds(self):
+        flaky.delay(1)
+        run_worker(concurrency=1, once=True)
+        background_task = BackgroundTask.objects.get()
+        self.assertEqual((background_task.status, background_task.attempts), (TaskStatus.SUCCEEDED, 2))
+
+    def test_task_fails_after_max_retries(self):
+        flaky.delay(5)
+        run_worker(concurrency=1, once=True)
+        background_task = BackgroundTask.objects.get()
+        self.assertEqual((background_task.status, background_task.attempts), (TaskStatus.FAILED, 2))
+        self.assertIn('RuntimeError', background_task.last_error)
+
+    def test_heartbeat_keeps_long_tasks_from_being_reclaimed(self):
+        flaky.delay(1)
+        [claimed] = claim_tasks(1)
+        expired = timezone.now() - timedelta(seconds=settings.TASKS['LEASE'] + 1)
+        BackgroundTask.objects.filter(pk=claimed.pk).update(updated_at=expired)
+        self.assertEqual(Heartbeat([claimed], interval=60).beat(), 1)
+        self.assertEqual(claim_tasks(1), [])
+
+        # Without renewal, the lease expires and another worker claims the task again
+        BackgroundTask.objects.filter(pk=claimed.pk).update(updated_at=expired)
+        [reclaimed] = claim_tasks(1)
+        self.assertEqual((reclaimed.pk, reclaimed.attempts), (claimed.pk, 2))
+
+    def test_worker_renews_leases_while_tasks_run(self):
+        slow.delay(0.1)
+        with mock.patch.object(Heartbeat, 'beat') as beat, override_settings(TASKS={**settings.TASKS, 'HEARTBEAT': 0.01}):
+            run_worker(concurrency=1, once=True)
+        self.assertGreater(beat.call_count, 0)
+        self.assertEqual(BackgroundTask.objects.get().status, TaskStatus.SUCCEEDED)
+
+    def test_worker_processes_stop_gracefully_on_sigterm(self):
+        from .management.commands import runworker
+        def run(stop_event, **options):
+            os.kill(os.getpid(), signal.SIGTERM)
+            self.assertTrue(stop_event.wait(1)) # set by the handler instead of killing the process
+        handlers = {signum: signal.getsignal(signum) for signum in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            with mock.patch.object(runworker, 'run_worker', side_effect=run) as worker:
+                runworker.run_until_signalled(concurrency=1, poll_interval=0.01, once=False)
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+        worker.assert_called_once()
+
+    def test_activation_email_is_sent_by_the_worker(self):
+        response = self.client.post('/api/auth/users/', {
+            'username': 'student', 'email': 'student@example.com', 'password': 'a-Strong-passw0rd',
+            'date_enrollment': '2030-01-01',
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(EmailLog.objects.get().status, EmailStatus.PENDING)
+        run_worker(concurrency=1, once=True)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['student@example.com'])
+        log = EmailLog.objects.get()
+        self.assertEqual((log.status, log.recipient.username, log.to_email), (EmailStatus.SENT, 'student', 'student@example.com'))
+
+
+class RequirementTaxonomyTests(TestCase):
+    """
+    Requirements are shared through a normalized key and programs are filtered by requirement sets.
+    """
+    def setUp(self):
+        self.python, self.sql, self.english = (
+            Requirement.objects.create(description=description) for description in ('Python', 'SQL', 'English')
+        )
+        self.both, self.python_only, self.none = make_program('Both'), make_program('Python only'), make_program('None')
+        for program, requirement in [(self.both, self.python), (self.both, self.sql), (self.python_only, self.python)]:
+            ProgramRequirement.objects.create(program=program, requirement=requirement)
+
+    def filtered_titles(self, query):
+        user = User.objects.create_user(f'user{User.objects.count()}', password='password')
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/programs/?{query}')
+        # One subquery over the through-table, not one join per requirement
+        listing = next(q['sql'] for q in queries if q['sql'].startswith('SELECT "activities_program"'))
+        self.assertEqual(listing.count('FROM "activities_programrequirement"'), 1)
+        self.assertNotIn('JOIN', listing)
+        return sorted(program['title'] for program in response.json())
+
+    def test_requirement_key_is_normalized_and_unique(self):
+        self.assertEqual(Requirement.objects.create(description='  Public   Speaking ').key, 'public speaking')
+        with self.assertRaises(IntegrityError):
+            Requirement.objects.create(description='PYTHON')
+
+    def test_colliding_description_is_a_validation_error(self):
+        with self.assertRaises(ValidationError) as raised:
+            Requirement(description='  PYTHON ').full_clean()
+        self.assertIn('description', raised.exception.message_dict)
+        self.python.description = 'python'
+        self.python.full_clean() # its own key does not collide
+
+        self.client.force_login(User.objects.create_superuser('admin', password='password'))
+        response = self.client.post('/admin/activities/requirement/add/', {'description': 'Sql'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'A requirement with this description already exists.')
+        self.assertEqual(Requirement.objects.count(), 3)
+
+    def test_filter_programs_by_all_or_any_requirements(self):
+        ids = f'{self.python.pk},{self.sql.pk}'
+        self.assertEqual(self.filtered_titles(f'requirements_all={ids}'), ['Both'])
+        self.assertEqual(self.filtered_titles(f'requirements_any={ids}'), ['Both', 'Python only'])
+        self.assertEqual(self.filtered_titles(f'requirements_all={self.english.pk}'), [])
+
+    def test_relink_merges_duplicates(self):
+        # Raw updates skip `save`, leaving a requirement that normalizes like another one
+        Requirement.objects.filter(pk=self.sql.pk).update(description=' python ')
+        ProgramRequirement.objects.create(program=self.none, requirement=self.sql)
+        call_command('relink_requirements', stdout=io.StringIO())
+        self.assertFalse(Requirement.objects.filter(pk=self.sql.pk).exists())
+        self.assertEqual(
+            sorted(ProgramRequirement.objects.values_list('program__title', 'requirement_id')),
+            [('Both', self.python.pk), ('None', self.python.pk), ('Python only', self.python.pk)],
+        )
+
+
+class RelatedProgramTests(TestCase):
+    """
+    Related programs are ranked by shared requirements, then category and audience, stored, refreshed
+    when requirements are linked, and served with the program page in a fixed number of queries.
+    """
+    def setUp(self):
+        cache.clear()
+        clear_tenant_cache()
+        set_task_backend(ImmediateBackend()) # related lists are refreshed inline
+        self.addCleanup(set_task_backend, None)
+        self.python, self.sql = (Requirement.objects.create(description=description) for description in ('Python', 'SQL'))
+        tech, beginner = ProgramCategory.TECHNOLOGY, ProgramAudience.BEGINNER
+        self.program = make_program('Program', category=tech, audience=beginner)
+        self.both = make_program('Both requirements', category=ProgramCategory.ART, audience=ProgramAudience.ADVANCED)
+        self.one = make_program('One requirement', category=tech, audience=beginner)
+        self.similar = make_program('Same category and audience', category=tech, audience=beginner)
+        make_program('Unrelated', category=ProgramCategory.ART, audience=ProgramAudience.ADVANCED)
+        other_tenant = Tenant.objects.create(name='Other Federation', slug='other')
+        self.elsewhere = make_program('Other tenant', tenant=other_tenant, category=tech, audience=beginner)
+        for program, requirement in [
+            (self.program, self.python), (self.program, self.sql), (self.both, self.python), (self.both, self.sql),
+            (self.one, self.python), (self.elsewhere, self.python), (self.elsewhere, self.sql),
+        ]:
+            ProgramRequirement.objects.create(program=program, requirement=requirement)
+
+    def ranking(self, program):
+        return list(RelatedProgram.objects.filter(program=program).order_by('rank').values_list('related__title', 'score'))
+
+    def test_ranking(self):
+        related = compute_related([self.program], top_n=6)[self.program.pk]
+        self.assertEqual([(other.title, score) for other, score in related], [
+            ('Both requirements', 2.0), ('One requirement', 1.75), ('Same category and audience', 0.75),
+        ])
+        self.assertEqual(len(compute_related([self.program], top_n=2)[self.program.pk]), 2)
+
+    def test_linking_a_requirement_refreshes_the_affected_lists(self):
+        refresh_related()
+        self.assertEqual(self.ranking(self.program)[0], ('Both requirements', 2.0))
+        ProgramRequirement.objects.create(program=self.one, requirement=self.sql)
+        self.assertEqual(self.ranking(self.program)[0], ('One requirement', 2.75))
+        ProgramRequirement.objects.filter(program=self.one, requirement=self.sql).delete()
+        self.assertEqual(self.ranking(self.program)[:2], [('Both requirements', 2.0), ('One requirement', 1.75)])
+
+    def test_overview_query_count(self):
+        refresh_related()
+        Favorite.objects.create(user=User.objects.create_user('fan', password='password'), program=self.program)
+        url = f'/api/programs/{self.program.pk}/overview/'
+        self.client.get(url) # resolves and caches the tenant
+        # The program with its favorite count, its requirements, its images and its related programs
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        data = response.json()
+        self.assertEqual(data['favorite_count'], 1)
+        self.assertEqual([program['title'] for program in data['related']], [
+            'Both requirements', 'One requirement', 'Same category and audience',
+        ])
+
+
+class AnalyticsTests(TestCase):
+    """
+    Views, searches and favorites are buffered in memory, written in batches and rolled up per day.
+    """
+    def setUp(self):
+        self.buffer = EventBuffer(size=100, batch_size=2, flush_interval=None)
+        set_analytics_buffer(self.buffer)
+        self.addCleanup(set_analytics_buffer, EventBuffer(size=0, flush_interval=None))
+        self.user = User.objects.create_user('viewer', password='password')
+        self.client.force_login(self.user)
+        self.program = make_program('Data Science')
+
+    def test_requests_buffer_events_without_writing(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(f'/api/programs/{self.program.pk}/')
+            self.client.get('/api/programs/?search=Astronomy')
+            self.client.get('/api/programs/search/?q=data')
+        self.assertFalse([q for q in queries if 'activities_analyticsevent' in q['sql']])
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=self.user, program=self.program)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.buffer.flush(), 4)
+        inserts = [q for q in queries if q['sql'].startswith('INSERT INTO "activities_analyticsevent"')]
+        self.assertEqual(len(inserts), 2) # batches of two
+        self.assertEqual(
+            sorted(AnalyticsEvent.objects.values_list('kind', 'program_id', 'query', 'results')),
+            [
+                (AnalyticsEventKind.FAVORITE, self.program.pk, '', None),
+                (AnalyticsEventKind.SEARCH, None, 'astronomy', 0),
+                (AnalyticsEventKind.SEARCH, None, 'data', 1),
+                (AnalyticsEventKind.VIEW, self.program.pk, '', None),
+            ],
+        )
+
+    def test_overflow_policies(self):
+        for overflow, kept in [('drop_oldest', ['c', 'd']), ('drop_newest', ['a', 'b'])]:
+            buffer = EventBuffer(size=2, flush_interval=None, overflow=overflow)
+            for query in 'abcd':
+                buffer.append(AnalyticsEvent(kind=AnalyticsEventKind.SEARCH, query=query))
+            with self.subTest(overflow=overflow):
+                self.assertEqual([event.query for event in buffer.events], kept)
+                self.assertEqual(buffer.dropped, 2)
+
+    def test_rollup_is_idempotent(self):
+        day = date(2030, 1, 1)
+        occurred_at = timezone.make_aware(datetime(2030, 1, 1, 12))
+        AnalyticsEvent.objects.bulk_create(
+            [AnalyticsEvent(kind=AnalyticsEventKind.VIEW, program_id=self.program.pk, occurred_at=occurred_at) for _ in range(3)]
+            + [AnalyticsEvent(kind=AnalyticsEventKind.SEARCH, query='mars', results=0, occurred_at=occurred_at)]
+        )
+        rollup(day)
+        self.assertEqual(rollup(day), (1, 1))
+        self.assertEqual(ProgramDailyStat.objects.get(program=self.program, date=day).views, 3)
+        self.assertEqual(SearchDailyStat.objects.get(query='mars', date=day).empty_searches, 1)
+
+    def test_purge_only_deletes_rolled_up_days(self):
+        def events(day, count):
+            occurred_at = timezone.make_aware(datetime.combine(day, datetime.min.time()) + timedelta(hours=12))
+            AnalyticsEvent.objects.bulk_create([AnalyticsEvent(kind=AnalyticsEventKind.SEARCH, query='mars', occurred_at=occurred_at)] * count)
+
+        rolled_up, pending, recent = date(2030, 1, 1), date(2030, 1, 2), date(2030, 1, 5)
+        for day in (rolled_up, pending, recent):
+            events(day, 5)
+        rollup(rolled_up)
+        rollup(recent)
+        with CaptureQueriesContext(connection) as queries:
+            deleted = purge_events(timezone.make_aware(datetime(2030, 1, 4)), batch_size=2)
+        self.assertEqual(deleted, 5)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('DELETE')]), 3)
+        self.assertEqual(
+            sorted({event.occurred_at.date() for event in AnalyticsEvent.objects.all()}), [pending, recent],
+        )
+
+
+@override_settings(TRENDING={'HALF_LIFE': 3600, 'WEIGHTS': {'favorite': 1.0, 'view': 0.5}})
+class TrendingTests(TestCase):
+    """
+    Trending scores decay over time and follow favorites and views incrementally.
+    """
+    def setUp(self):
+        self.old, self.new = make_program('Old'), make_program('New')
+        self.user = User.objects.create_user('fan', password='password')
+
+    def favorite(self, program):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Favorite.objects.create(user=self.user, program=program)
+
+    def test_favorites_bump_and_unbump(self):
+        favorite = self.favorite(self.new)
+        self.new.refresh_from_db()
+        self.assertAlmostEqual(self.new.trending_score, 1.0)
+        with self.captureOnCommitCallbacks(execute=True):
+            favorite.delete()
+        self.new.refresh_from_db()
+        self.assertAlmostEqual(self.new.trending_score, 0.0, places=3)
+
+    def test_saving_a_stale_program_keeps_the_score(self):
+        stale = Program.objects.get(pk=self.new.pk)
+        self.favorite(self.new)
+        stale.title = 'Renamed'
+        stale.save()
+        self.new.refresh_from_db()
+        self.assertEqual(self.new.title, 'Renamed')
+        self.assertAlmostEqual(self.new.trending_score, 1.0)
+
+    def test_flushed_views_bump(self):
+        buffer = EventBuffer(flush_interval=None)
+        set_analytics_buffer(buffer)
+        self.addCleanup(set_analytics_buffer, EventBuffer(size=0, flush_interval=None))
+        self.client.force_login(self.user)
+        for _ in range(3):
+            self.client.get(f'/api/programs/{self.old.pk}/')
+        buffer.flush()
+        self.old.refresh_from_db()
+        self.assertAlmostEqual(self.old.trending_score, 1.5)
+
+    def test_redecay_and_ordering(self):
+        self.favorite(self.old)
+        self.favorite(self.new)
+        # Two half-lives later the old program's favorite counts a quarter
+        Program.objects.filter(pk=self.old.pk).update(trending_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(redecay(batch_size=1), 2)
+        self.assertAlmostEqual(Program.objects.get(pk=self.old.pk).trending_score, 0.25, places=3)
+
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/programs/?ordering=-trending')
+        self.assertEqual([program['title'] for program in response.json()], ['New', 'Old'])
+        self.assertTrue(any('ORDER BY "activities_program"."trending_score" DESC' in q['sql'] for q in queries))
+
+
+class SuggestTests(TestCase):
+    """
+    Suggestions come from the in-process prefix index and follow catalog changes.
+    """
+    def setUp(self):
+        invalidate_suggestions() # an index built by another test holds other rows
+        self.addCleanup(invalidate_suggestions)
+        make_program('Data Science Bootcamp')
+        ProgramRequirement.objects.create(
+            program=make_program('Café Management'),
+            requirement=Requirement.objects.create(description='Basic Statistics'),
+        )
+
+    def suggestions(self, prefix):
+        response = self.client.get('/api/programs/suggest/', {'q': prefix})
+        self.assertEqual(response.status_code, 200)
+        return [(item['type'], item['title']) for item in response.json()]
+
+    def test_matches_word_prefixes(self):
+        self.suggestions('') # builds the index
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggestions('sci'), [('program', 'Data Science Bootcamp')])
+            self.assertEqual(self.suggestions('data  SC'), [('program', 'Data Science Bootcamp')])
+            self.assertEqual(self.suggestions('cafe'), [('program', 'Café Management')])
+            self.assertEqual(self.suggestions('stat'), [('requirement', 'Basic Statistics')])
+            self.assertEqual(self.suggestions('xyz'), [])
+
+    def test_catalog_changes_are_applied_to_the_index(self):
+        self.assertEqual(self.suggestions('astro'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            program = make_program('Astronomy Camp')
+        with self.assertNumQueries(0): # updated in place, not rebuilt
+            self.assertEqual(self.suggestions('astro'), [('program', 'Astronomy Camp')])
+        with self.captureOnCommitCallbacks(execute=True):
+            program.title = 'Rocketry Camp'
+            program.save()
+            requirement = Requirement.objects.get(description='Basic Statistics')
+            requirement.description = 'Advanced Statistics'
+            requirement.save()
+        self.assertEqual(self.suggestions('astro'), [])
+        self.assertEqual(self.suggestions('camp'), [('program', 'Rocketry Camp')])
+        self.assertEqual(self.suggestions('stat'), [('requirement', 'Advanced Statistics')])
+        with self.captureOnCommitCallbacks(execute=True):
+            program.delete()
+            ProgramRequirement.objects.all().delete()
+        self.assertEqual(self.suggestions('camp') + self.suggestions('stat'), [])
+
+    def test_changes_only_touch_the_tenants_they_concern(self):
+        other = Tenant.objects.create(name='Other Federation', slug='other')
+        other_index = suggest.get_index(other.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            make_program('Astronomy Camp')
+            requirement = Requirement.objects.get(description='Basic Statistics')
+            requirement.description = 'Advanced Statistics'
+            requirement.save()
+        self.assertIs(suggest.get_index(other.pk), other_index)
+
+    @override_settings(SUGGEST={**settings.SUGGEST, 'VERSION_CHECK_INTERVAL': 0})
+    def test_a_change_from_another_process_is_rebuilt_off_the_request(self):
+        index = suggest.get_index(get_default_tenant().pk)
+        cache.incr(suggest.version_key(get_default_tenant().pk)) # another process changed the catalog
+        with mock.patch('activities.suggest.threading.Thread') as thread:
+            self.assertIs(suggest.get_index(get_default_tenant().pk), index) # served while rebuilt
+            self.assertIs(suggest.get_index(get_default_tenant().pk), index)
+        thread.assert_called_once()
+        thread.return_value.start.assert_called_once()
+        suggest._tenant_lock(get_default_tenant().pk).release() # held for the rebuild that never ran
+
+    def test_lookup_is_fast(self):
+        index = SuggestIndex([(f'title {i:05d}', 'program', i, f'Title {i}') for i in range(50000)])
+        started = time.perf_counter()
+        for _ in range(1000):
+            index.lookup('title 4', 10)
+        self.assertLess((time.perf_counter() - started) / 1000, 0.001)
+
+
+class TenantScopingTests(TestCase):
+    """
+    Each federation only sees and writes its own rows, resolved from the tenant header or the host.
+    """
+    def setUp(self):
+        clear_tenant_cache() # resolved tenants are cached per process
+        self.addCleanup(clear_tenant_cache)
+        self.default = get_default_tenant()
+        self.other = Tenant.objects.create(name='Other Federation', slug='other', domain='other.example.com')
+        make_program('Default Program')
+        token = set_current_tenant(self.other) # rows created outside a request take the current tenant
+        self.other_program = make_program('Other Program')
+        self.other_user = User.objects.create_user('other-user', password='password')
+        reset_current_tenant(token)
+
+    def titles(self, **kwargs):
+        response = self.client.get('/api/programs/', **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return [program['title'] for program in response.json()]
+
+    @override_settings(ALLOWED_HOSTS=['testserver', 'other.example.com'])
+    def test_catalog_is_scoped_by_header_or_host(self):
+        self.assertEqual(self.other_program.tenant, self.other)
+        self.assertEqual(self.other_user.tenant, self.other)
+        self.assertEqual(self.titles(), ['Default Program'])
+        self.assertEqual(self.titles(headers={'X-Tenant': 'other'}), ['Other Program'])
+        self.assertEqual(self.titles(HTTP_HOST='other.example.com'), ['Other Program'])
+        self.assertEqual(self.client.get('/api/programs/', headers={'X-Tenant': 'missing'}).status_code, 404)
+        response = self.client.get(f'/api/programs/{self.other_program.pk}/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_users_cannot_act_on_another_tenant(self):
+        self.client.force_login(self.other_user)
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 403)
+        self.assertEqual(self.client.get('/api/users/me/', headers={'X-Tenant': 'other'}).status_code, 200)
+
+    def test_favorites_are_only_served_to_their_owner_within_the_tenant(self):
+        default_user = User.objects.create_user('default-fan', password='password')
+        Favorite.objects.create(user=default_user, program=Program.objects.get(title='Default Program'))
+        self.client.force_login(default_user)
+        self.assertEqual(self.client.get(f'/api/users/{default_user.pk}/favorites/').status_code, 200)
+        self.assertEqual(self.client.get(f'/api/users/{default_user.pk}/favorites/', headers={'X-Tenant': 'other'}).status_code, 404)
+        self.client.force_login(self.other_user)
+        self.assertEqual(self.client.get(f'/api/users/{default_user.pk}/favorites/').status_code, 403)
+        self.assertEqual(self.client.get(f'/api/users/{default_user.pk}/favorites/', headers={'X-Tenant': 'other'}).status_code, 404)
+        favorite = default_user.favorites.get()
+        response = self.client.get(f'/api/users/{default_user.pk}/favorites/{favorite.pk}/', headers={'X-Tenant': 'other'})
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(TENANTS={**settings.TENANTS, 'CACHE_SIZE': 2})
+    def test_resolved_tenants_are_bounded_and_misses_are_not_kept(self):
+        for n in range(5):
+            self.assertEqual(self.client.get('/api/programs/', headers={'X-Tenant': f'missing-{n}'}).status_code, 404)
+        self.assertEqual(len(tenants._resolved), 1) # the default tenant, from setUp
+        Tenant.objects.create(name='Late Federation', slug='missing-0')
+        self.assertEqual(self.client.get('/api/programs/', headers={'X-Tenant': 'missing-0'}).status_code, 200)
+        self.client.get('/api/programs/', headers={'X-Tenant': 'other'})
+        self.assertEqual(len(tenants._resolved), 2)
+        self.assertEqual(list(tenants._resolved), [('slug', 'missing-0'), ('slug', 'other')])
+
+    def test_writes_only_invalidate_the_tenants_own_cache(self):
+        default_user = User.objects.create_user('default-user', password='password')
+        Favorite.objects.create(user=default_user, program=Program.objects.get(title='Default Program'))
+        get_favorites_feed(default_user.pk, self.default.pk, serialize_feed)
+        self.other_program.save() # another tenant's catalog change
+        with self.assertNumQueries(0):
+            get_favorites_feed(default_user.pk, self.default.pk, serialize_feed)
+        Program.objects.get(title='Default Program').save()
+        with self.assertNumQueries(1):
+            get_favorites_feed(default_user.pk, self.default.pk, serialize_feed)
+
+
+class EmailLedgerTests(TestCase):
+    """
+    Every delivery is logged with its recipient and payload, failures are retried in bulk and old rows purged in batches.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user('reader', 'reader@example.com', 'password')
+
+    def queue(self, subject='Weekly picks'):
+        return queue_message(mail.EmailMessage(subject, 'Body', to=[self.user.email]), recipient=self.user)
+
+    def test_failed_deliveries_are_requeued_in_bulk(self):
+        logs = [self.queue(f'Email {index}') for index in range(3)]
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')):
+            for background_task in BackgroundTask.objects.all():
+                background_task.max_retries = 0
+                background_task.save()
+            run_worker(concurrency=1, once=True)
+        failed = EmailLog.objects.filter(status=EmailStatus.FAILED)
+        self.assertEqual(failed.count(), 3)
+        self.assertIn('down', failed.first().last_error)
+
+        BackgroundTask.objects.all().delete()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(requeue_failed(batch_size=10), 3)
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('INSERT INTO "activities_backgroundtask"')]), 1)
+        run_worker(concurrency=1, once=True)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(
+            list(EmailLog.objects.filter(pk__in=[log.pk for log in logs]).values_list('status', 'attempts').distinct()),
+            [(EmailStatus.SENT, 2)],
+        )
+
+    def test_delivery_stays_pending_while_retries_remain(self):
+        log = self.queue()
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')):
+            run_worker(concurrency=1, once=True) # the retry is scheduled later
+            log.refresh_from_db()
+            self.assertEqual((log.status, log.attempts), (EmailStatus.PENDING, 1))
+            self.assertIn('down', log.last_error)
+            self.assertEqual(requeue_failed(), 0) # still being retried: not queued twice
+
+            background_task = BackgroundTask.objects.get()
+            BackgroundTask.objects.filter(pk=background_task.pk).update(
+                attempts=background_task.max_retries, run_at=timezone.now(),
+            )
+            run_worker(concurrency=1, once=True)
+        log.refresh_from_db()
+        self.assertEqual((log.status, log.attempts), (EmailStatus.FAILED, 2))
+        self.assertEqual(BackgroundTask.objects.get().status, TaskStatus.FAILED)
+
+    def test_purge_deletes_old_rows_in_batches(self):
+        for _ in range(5):
+            self.queue()
+        EmailLog.objects.filter(pk__in=EmailLog.objects.order_by('pk').values('pk')[:4]).update(
+            timestamp=timezone.now() - timedelta(days=400)
+        )
+        EmailLog.objects.filter(pk=EmailLog.objects.order_by('pk').first().pk).update(status=EmailStatus.FAILED)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(purge_email_logs(timezone.now() - timedelta(days=1), statuses=[EmailStatus.PENDING], batch_size=2), 3)
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('DELETE')]), 2)
+        self.assertEqual(EmailLog.objects.count(), 2)
+
+
+def serialize_feed(favorites):
+    return FavoriteSerializer(favorites, many=True).data
+
+
+class FavoritesFeedTests(TestCase):
+    """
+    The favorites feed is built with one query and cached until the user's favorites change.
+    """
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('feed', password='password')
+        self.programs = [make_program(f'Program {n}') for n in range(3)]
+        for program in self.programs[:2]:
+            Favorite.objects.create(user=self.user, program=program)
+
+    def titles(self):
+        return [favorite['program']['title'] for favorite in get_favorites_feed(self.user.pk, get_default_tenant().pk, serialize_feed)]
+
+    def test_feed_is_one_query_then_cached(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.titles(), ['Program 1', 'Program 0'])
+        with self.assertNumQueries(0):
+            self.titles()
+
+    def test_adding_or_removing_a_favorite_invalidates_the_feed(self):
+        self.titles()
+        Favorite.objects.create(user=self.user, program=self.programs[2])
+        self.assertEqual(self.titles(), ['Program 2', 'Program 1', 'Program 0'])
+        Favorite.objects.filter(user=self.user, program=self.programs[1]).get().delete()
+        self.assertEqual(self.titles(), ['Program 2', 'Program 0'])
+
+        self.client.force_login(self.user)
+        response = self.client.get(f'/api/users/{self.user.pk}/favorites/')
+        self.assertEqual([favorite['program']['title'] for favorite in response.json()], ['Program 2', 'Program 0'])
+
+    @override_settings(ALLOWED_HOSTS=['testserver', 'www.example.com'])
+    def test_cached_feed_builds_image_urls_for_each_host(self):
+        clear_tenant_cache()
+        self.addCleanup(clear_tenant_cache)
+        Program.objects.filter(pk=self.programs[0].pk).update(image='programs/0.png')
+        self.client.force_login(self.user)
+        for host in ('testserver', 'www.example.com'):
+            response = self.client.get(f'/api/users/{self.user.pk}/favorites/', HTTP_HOST=host)
+            self.assertEqual(
+                [favorite['program']['image'] for favorite in response.json()],
+                [None, f'http://{host}{settings.MEDIA_URL}programs/0.png'],
+            )
+        cached = cache.get(feed_cache_key(self.user.pk, get_default_tenant().pk))[1]
+        self.assertEqual(cached[1]['program']['image'], f'{settings.MEDIA_URL}programs/0.png') # shared by both hosts
+
+
+class FavoriteStorageTests(TestCase):
+    """
+    A favorite is unique per user and program, and membership checks are served from a cached id array.
+    """
+    def setUp(self):
+        cache.clear() # the favorite ids are cached per user id
+        self.programs = [make_program(f'Program {n}') for n in range(3)]
+        self.user = User.objects.create_user('fan', password='password')
+
+    def test_favorite_is_unique_per_user_and_program(self):
+        Favorite.objects.create(user=self.user, program=self.programs[0])
+        with self.assertRaises(IntegrityError):
+            Favorite.objects.create(user=self.user, program=self.programs[0])
+
+    def test_membership_is_cached_and_invalidated(self):
+        for program in self.programs[:0:-1]:
+            Favorite.objects.create(user=self.user, program=program)
+        self.assertEqual(list(get_favorite_program_ids(self.user.pk)), sorted(p.pk for p in self.programs[1:]))
+        with self.assertNumQueries(0):
+            self.assertTrue(is_favorite(self.user.pk, self.programs[2].pk))
+            self.assertFalse(is_favorite(self.user.pk, self.programs[0].pk))
+
+        Favorite.objects.create(user=self.user, program=self.programs[0])
+        self.assertTrue(is_favorite(self.user.pk, self.programs[0].pk))
+
+        self.client.force_login(self.user)
+        response = self.client.get(f'/api/programs/{self.programs[0].pk}/favorite/')
+        self.assertEqual(response.json(), {'favorite': True})
+        self.client.delete(f'/api/programs/{self.programs[0].pk}/favorite/')
+        response = self.client.get(f'/api/programs/{self.programs[0].pk}/overview/')
+        self.assertIs(response.json()['is_favorite'], False)
+
+
+class ContentAddressedStorageTests(TestCase):
+    """
+    Files are named after the hash of their content, stored once, and relocated by migration 0006.
+    """
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.storage = ContentAddressedStorage(location=self.media_root)
+
+    def test_name_is_the_hash_of_the_content(self):
+        name = self.storage.save('program_images/Photo.JPG', ContentFile(b'image bytes'))
+        digest = hashlib.sha256(b'image bytes').hexdigest()
+        self.assertEqual(name, f'program_images/{digest[:2]}/{digest[2:4]}/{digest}.jpg')
+        self.assertRegex(name, HASHED_NAME_RE)
+        with self.storage.open(name) as content:
+            self.assertEqual(content.read(), b'image bytes')
+
+    def test_extensions_outside_the_layout_are_dropped(self):
+        for upload in ('program_images/photo.jpég', 'program_images/photo.averyverylongext', 'program_images/photo'):
+            name = self.storage.save(upload, ContentFile(upload.encode()))
+            self.assertRegex(name, HASHED_NAME_RE)
+            self.assertNotIn('.', posixpath.basename(name))
+
+    def test_identical_uploads_are_stored_once(self):
+        first = self.storage.save('program_images/a.png', ContentFile(b'same'))
+        with mock.patch.object(ContentAddressedStorage, '_save') as save:
+            second = self.storage.save('program_images/b.png', ContentFile(b'same'))
+        save.assert_not_called()
+        self.assertEqual(first, second)
+        other = self.storage.save('program_images/c.png', ContentFile(b'other'))
+        self.assertNotEqual(first, other)
+
+    def test_migration_relocates_old_files(self):
+        migration = importlib.import_module('activities.migrations.0006_relocate_media')
+        with override_settings(MEDIA_ROOT=self.media_root):
+            legacy = FileSystemStorage()
+            old_name = legacy.save('program_images/None/photo.png', ContentFile(b'legacy'))
+            program = make_program(image=old_name)
+            duplicate = make_program('Duplicate', image=legacy.save('program_images/None/copy.png', ContentFile(b'legacy')))
+            missing = make_program('Missing', image='program_images/None/missing.png')
+            with self.captureOnCommitCallbacks(execute=True):
+                migration.relocate_media(apps, None)
+
+            program.refresh_from_db()
+            duplicate.refresh_from_db()
+            digest = hashlib.sha256(b'legacy').hexdigest()
+            self.assertEqual(program.image.name, f'program_images/{digest[:2]}/{digest[2:4]}/{digest}.png')
+            self.assertEqual(duplicate.image.name, program.image.name)
+            self.assertTrue(legacy.exists(program.image.name))
+            self.assertFalse(legacy.exists(old_name))
+            missing.refresh_from_db()
+            self.assertEqual(missing.image.name, 'program_images/None/missing.png')
+
+            # A second run finds nothing left to move
+            with mock.patch.object(FileSystemStorage, '_save') as save:
+                migration.relocate_media(apps, None)
+            save.assert_not_called()
+
+
+    def test_migration_keeps_old_files_still_referenced(self):
+        migration = importlib.import_module('activities.migrations.0006_relocate_media')
+        with override_settings(MEDIA_ROOT=self.media_root):
+            legacy = FileSystemStorage()
+            old_name = legacy.save('program_images/None/shared.png', ContentFile(b'shared'))
+            program = make_program(image=old_name)
+            image = ProgramImage.objects.create(program=program, image=old_name)
+            references = [(Program, 'image'), (ProgramImage, 'image')]
+            with self.captureOnCommitCallbacks(execute=True):
+                migration.relocate_files(Program, 'image', references=references)
+            self.assertTrue(legacy.exists(old_name)) # the program image still points to it
+
+            with self.captureOnCommitCallbacks(execute=True):
+                migration.relocate_files(ProgramImage, 'image', references=references)
+            image.refresh_from_db()
+            program.refresh_from_db()
+            self.assertEqual(image.image.name, program.image.name)
+            self.assertFalse(legacy.exists(old_name))
+
+
+class MediaServingTests(TestCase):
+    """
+    Uploads are served with validators, ranges and caching; private ones only to authenticated users.
+    """
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.storage = FileSystemStorage()
+        self.public = ContentAddressedStorage().save('program_images/photo.png', ContentFile(b'0123456789'))
+        self.private = self.storage.save('user_profiles/avatar.png', ContentFile(b'private'))
+        self.user = User.objects.create_user('viewer', password='password')
+
+    def test_private_files_require_authentication(self):
+        self.assertEqual(self.client.get(f'/media/{self.private}').status_code, 404)
+        self.assertEqual(self.client.get(f'/media/{self.private}', HTTP_AUTHORIZATION='JWT invalid').status_code, 404)
+        self.client.force_login(self.user)
+        response = self.client.get(f'/media/{self.private}')
+        self.assertEqual(b''.join(response.streaming_content), b'private')
+        self.assertTrue(response['Cache-Control'].startswith('private, '))
+
+    def test_dot_segments_cannot_reach_private_files(self):
+        for path in (f'program_images/../{self.private}', f'./{self.private}', f'program_images/./../{self.private}'):
+            self.assertEqual(self.client.get(f'/media/{path}').status_code, 404, path)
+        self.assertEqual(self.client.get('/media/../settings.py').status_code, 404)
+
+    def test_hashed_files_are_immutable_and_revalidated(self):
+        response = self.client.get(f'/media/{self.public}')
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        response = self.client.get(f'/media/{self.public}', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_ranges(self):
+        response = self.client.get(f'/media/{self.public}', HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        response = self.client.get(f'/media/{self.public}', HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+
+        response = self.client.get(f'/media/{self.public}', HTTP_RANGE='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+        self.assertFalse(response.has_header('Cache-Control'))
+
+    def test_files_are_handed_to_the_front_server(self):
+        serving = {**settings.MEDIA_SERVING, 'SENDFILE_HEADER': 'X-Accel-Redirect'}
+        with override_settings(MEDIA_SERVING=serving):
+            response = self.client.get(f'/media/{self.public}')
+            self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.public}')
+            self.assertEqual(response.content, b'')
+            self.assertEqual(response['Content-Type'], 'image/png')
+            self.assertEqual(self.client.get(f'/media/program_images/../{self.private}').status_code, 404)
+
+
+class StartupImportTests(TestCase):
+    """
+    Loading the app imports neither DRF's serializers nor the modules only needed to handle a change.
+    """
+    # Imported on first use, by requests, tasks and signal receivers
+    DEFERRED_MODULES = [
+        'rest_framework.serializers', 'djoser.email', 'activities.serializer', 'activities.tasks',
+        'activities.email', 'activities.analytics', 'activities.events', 'activities.slowlog',
+        'activities.suggest', 'activities.trending',
+    ]
+
+    def test_setup_leaves_deferred_modules_unimported(self):
+        script = 'import sys, django; django.setup(); print("\\n".join(sys.modules))'
+        result = subprocess.run(
+            [sys.executable, '-c', script], cwd=settings.BASE_DIR, env=os.environ, capture_output=True, text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        imported = set(result.stdout.split())
+        self.assertEqual([module for module in self.DEFERRED_MODULES if module in imported], [])
+
+    def test_worker_boot_leaves_view_only_modules_unimported(self):
+        # What a WSGI worker loads before its first request: the application and the URLconf
+        script = (
+            'import sys; from SAF_backend.wsgi import application; from django.urls import get_resolver; '
+            'get_resolver().url_patterns; print("\\n".join(sys.modules))'
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', script], cwd=settings.BASE_DIR, env=os.environ, capture_output=True, text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        imported = set(result.stdout.split())
+        view_only = [
+            'activities.analytics', 'activities.batch', 'activities.calendar', 'activities.contact',
+            'activities.enrollment', 'activities.events', 'activities.revocation', 'activities.suggest',
+            'activities.sync', 'activities.tasks', 'activities.taskqueue', 'concurrent.futures.process',
+        ]
+        self.assertEqual([module for module in view_only if module in imported], [])
+
+    def test_parse_importtime(self):
+        output = (
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       120 |        120 |     _io\n'
+            'import time:      1500 |       1620 |   encodings.utf_8\n'
+            'import time:        30 |       1650 | encodings\n'
+            'unrelated line\n'
+        )
+        self.assertEqual(parse_importtime(output), [
+            ('_io', 120, 120, 2),
+            ('encodings.utf_8', 1500, 1620, 1),
+            ('encodings', 30, 1650, 0),
+        ])
+
+
+class EnrollmentTests(TestCase):
+    """
+    Cohorts are enrolled in bulk: invalid and duplicate rows are rejected, users without a password
+    are activated by email, and every user joins the enrolling tenant.
+    """
+    def setUp(self):
+        clear_tenant_cache()
+        self.addCleanup(clear_tenant_cache)
+        set_task_backend(ImmediateBackend())
+        self.addCleanup(set_task_backend, None)
+        User.objects.create_user('taken', email='taken@example.com', password='password')
+
+    rows = [
+        {'username': 'alice', 'email': 'Alice@Example.com'},
+        {'username': 'bob', 'email': 'bob@example.com', 'password': 'a-Strong-passw0rd'},
+        {'username': 'alice', 'email': 'alice2@example.com'}, # username already in this batch
+        {'username': 'carol', 'email': 'alice@example.com'}, # email already in this batch
+        {'username': 'dave', 'email': 'not an email'},
+        {'username': 'erin', 'email': 'erin@example.com', 'password': '123'},
+        {'username': 'frank', 'email': 'TAKEN@example.com'}, # email of an existing user
+    ]
+
+    def test_rows_are_validated_and_deduplicated(self):
+        result = enroll_users(self.rows, processes=1)
+        self.assertEqual(result.created, 2)
+        self.assertEqual(sorted(row for row, _ in result.errors), [3, 4, 5, 6, 7])
+        self.assertIn('password', dict(result.errors)[6])
+
+        alice, bob = User.objects.get(username='alice'), User.objects.get(username='bob')
+        self.assertEqual(alice.email, 'alice@example.com')
+        self.assertFalse(alice.is_active)
+        self.assertFalse(alice.has_usable_password())
+        self.assertTrue(bob.is_active)
+        self.assertTrue(bob.check_password('a-Strong-passw0rd'))
+
+        # Only the inactive user is sent the activation email
+        self.assertEqual([message.to for message in mail.outbox], [['alice@example.com']])
+        log = EmailLog.objects.get(recipient=alice)
+        self.assertEqual((log.status, log.attempts), (EmailStatus.SENT, 1))
+
+    def test_users_without_password_are_active_without_activation(self):
+        enroll_users(self.rows[:1], processes=1, send_activation=False)
+        self.assertTrue(User.objects.get(username='alice').is_active)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_users_join_the_enrolling_tenant(self):
+        other = Tenant.objects.create(name='Other Federation', slug='other')
+        enroll_users(self.rows[:2], processes=1, tenant=other)
+        self.assertEqual(set(User.objects.filter(username__in=['alice', 'bob']).values_list('tenant', flat=True)), {other.pk})
+
+        staff = User.objects.create_user('staff', password='password', is_staff=True)
+        self.client.force_login(staff)
+        upload = ContentFile(b'username,email\ncarol,carol@example.com\ncarol,carol2@example.com\n', name='cohort.csv')
+        response = self.client.post('/api/users/bulk/', {'file': upload})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.json()['created'], [error['row'] for error in response.json()['errors']]), (1, [2]))
+        self.assertEqual(User.objects.get(username='carol').tenant, get_default_tenant())
+
+    def test_existing_emails_match_any_case_and_concurrent_inserts_only_reject_their_row(self):
+        User.objects.create_user('mixed', email='Mixed@Example.com', password='password')
+        result = enroll_users([{'username': 'mia', 'email': 'mixed@example.com'}], processes=1)
+        self.assertEqual((result.created, [row for row, _ in result.errors]), (0, [1]))
+
+        # The usernames were free when checked, then a concurrent signup took one
+        rows = [{'username': 'taken', 'email': 'new@example.com'}, {'username': 'nina', 'email': 'nina@example.com'}]
+        nobody = User.objects.annotate(email_lower=models.F('email')).none()
+        with mock.patch.object(User.objects, 'annotate', return_value=nobody):
+            result = enroll_users(rows, processes=1)
+        self.assertEqual((result.created, [row for row, _ in result.errors]), (1, [1]))
+        self.assertTrue(User.objects.filter(username='nina').exists())
+
+    def test_api_enrollment_does_not_hash_passwords(self):
+        staff = User.objects.create_user('staff', password='password', is_staff=True)
+        self.client.force_login(staff)
+        upload = ContentFile(b'username,email,password\ngus,gus@example.com,a-Strong-passw0rd\n', name='cohort.csv')
+        with mock.patch('activities.enrollment.make_password') as make_password:
+            response = self.client.post('/api/users/bulk/', {'file': upload, 'send_activation': 'false'})
+        self.assertEqual(response.status_code, 201)
+        make_password.assert_not_called()
+        gus = User.objects.get(username='gus')
+        self.assertFalse(gus.has_usable_password())
+        self.assertFalse(gus.is_active)
+        self.assertEqual([message.to for message in mail.outbox], [['gus@example.com']])
+
+    def test_failed_activation_emails_are_recorded_and_not_resent(self):
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=[RuntimeError('down'), 1]):
+            enroll_users([{'username': 'alice', 'email': 'alice@example.com'}, {'username': 'bob', 'email': 'bob@example.com'}], processes=1)
+        logs = dict(EmailLog.objects.values_list('to_email', 'status'))
+        self.assertEqual(logs, {'alice@example.com': EmailStatus.FAILED, 'bob@example.com': EmailStatus.SENT})
+        self.assertIn('down', EmailLog.objects.get(to_email='alice@example.com').last_error)
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.open', side_effect=OSError('refused')):
+            enroll_users([{'username': 'carol', 'email': 'carol@example.com'}], processes=1)
+        log = EmailLog.objects.get(to_email='carol@example.com')
+        self.assertEqual((log.status, log.attempts), (EmailStatus.FAILED, 1))
+
+
+class CompressionTests(TestCase):
+    """
+    Responses are compressed with the negotiated encoding, above a minimum size, streaming ones chunk by chunk.
+    """
+    body = b'{"description":"' + b'A long program description. ' * 100 + b'"}'
+
+    def respond(self, response, accept_encoding='gzip'):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def test_negotiation(self):
+        self.assertEqual(negotiate('gzip, deflate').name, 'gzip')
+        self.assertEqual(negotiate('br;q=0.5, gzip').name, 'gzip')
+        self.assertIsNone(negotiate('gzip;q=0, identity'))
+        self.assertEqual(negotiate('*', preferences=['gzip']).name, 'gzip')
+
+    def test_compresses_large_json_only(self):
+        response = self.respond(HttpResponse(self.body, content_type='application/json'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(response.content), self.body)
+
+        self.assertFalse(self.respond(HttpResponse(b'{}', content_type='application/json')).has_header('Content-Encoding'))
+        self.assertFalse(self.respond(HttpResponse(self.body, content_type='image/png')).has_header('Content-Encoding'))
+        self.assertFalse(self.respond(HttpResponse(self.body, content_type='application/json'), 'identity').has_header('Content-Encoding'))
+
+    def test_partial_error_and_html_responses_are_left_alone(self):
+        partial = HttpResponse(self.body, content_type='application/json', status=206)
+        partial['Content-Range'] = f'bytes 0-{len(self.body) - 1}/{len(self.body) * 2}'
+        self.assertFalse(self.respond(partial).has_header('Content-Encoding'))
+        self.assertFalse(self.respond(HttpResponse(self.body, content_type='application/json', status=404)).has_header('Content-Encoding'))
+        self.assertFalse(self.respond(HttpResponse(self.body, content_type='text/html')).has_header('Content-Encoding'))
+
+    def test_streaming_chunks_are_flushed(self):
+        chunks = [self.body[:500], self.body[500:]]
+        response = self.respond(StreamingHttpResponse(iter(chunks), content_type='text/csv'))
+        compressed = list(response.streaming_content)
+        self.assertGreater(len(compressed[0]), 0) # the first chunk is sent before the second is produced
+        self.assertEqual(gzip.decompress(b''.join(compressed)), self.body)
+
+    @unittest.skipUnless({'br', 'zstd'} <= set(CODECS), 'brotli and zstandard are not installed')
+    def test_brotli_and_zstd(self):
+        import brotli, zstandard
+        response = self.respond(HttpResponse(self.body, content_type='application/json'), 'gzip, br, zstd')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), self.body)
+        response = self.respond(HttpResponse(self.body, content_type='application/json'), 'gzip, zstd')
+        self.assertEqual(zstandard.ZstdDecompressor().decompress(response.content), self.body)
+
+
+@unittest.skipIf(orjson is None, 'orjson is not installed')
+class FastJSONTests(TestCase):
+    """
+    The orjson renderer and parser are byte for byte interchangeable with DRF's.
+    """
+    def assertSameRendering(self, data, accepted_media_type=None):
+        self.assertEqual(
+            FastJSONRenderer().render(data, accepted_media_type, {}),
+            JSONRenderer().render(data, accepted_media_type, {}),
+        )
+
+    def test_rendering_is_byte_identical(self):
+        program = make_program('Données \u2028 "quoted"\n\x01', description='Ünïcode ✓ \u2029 tab\t')
+        ProgramImage.objects.create(program=program, image='programs/a.png', caption='Caption')
+        programs = self.client.get('/api/programs/').json()
+        self.assertEqual(programs[0]['additional_images'][0]['caption'], 'Caption')
+        self.assertSameRendering(programs)
+        self.assertSameRendering({
+            'decimal': Decimal('10.50'),
+            'datetime': timezone.make_aware(datetime(2030, 1, 1, 12, 30, 15, 123456)),
+            'date': date(2030, 1, 1),
+            'time': datetime(2030, 1, 1, 8, 5, 1, 999999).time(),
+            'uuid': uuid.UUID(int=1),
+            'lazy': gettext_lazy('Lazy'),
+            1: [True, None, (1, 2)],
+            'set': {3},
+            'big': 2 ** 70,
+            'float': 0.1,
+        })
+        self.assertSameRendering({'indented': [1]}, 'application/json; indent=2')
+
+    def test_parsing_matches_drf(self):
+        for body in [b'{"a":[1,2.5,"\\u00e9",null,true]}', b'{"big":' + str(2 ** 70).encode() + b'}']:
+            self.assertEqual(FastJSONParser().parse(io.BytesIO(body)), JSONParser().parse(io.BytesIO(body)))
+        with self.assertRaisesMessage(Exception, 'JSON parse error'):
+            FastJSONParser().parse(io.BytesIO(b'{"a": NaN}'))
+
+
+class JWTRevocationTests(TestCase):
+    """
+    Rotated and logged out refresh tokens are revoked in the database; logout-all invalidates every token.
+    """
+    def setUp(self):
+        cache.clear()
+        set_revocation_store(RevocationStore(capacity=1000, sync_interval=0))
+        self.addCleanup(set_revocation_store, None)
+        self.user = User.objects.create_user('jwt', password='password')
+        self.tokens = self.client.post('/api/auth/token/', {'username': 'jwt', 'password': 'password'}).json()
+
+    def refresh(self, token):
+        return self.client.post('/api/auth/token/refresh/', {'refresh': token})
+
+    def test_rotation_revokes_the_used_refresh_token(self):
+        response = self.refresh(self.tokens['refresh'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.refresh(self.tokens['refresh']).status_code, 401)
+        self.assertEqual(self.refresh(response.json()['refresh']).status_code, 200)
+
+    def test_logout_and_logout_all(self):
+        self.client.post('/api/auth/token/blacklist/', {'refresh': self.tokens['refresh']})
+        self.assertEqual(self.refresh(self.tokens['refresh']).status_code, 401)
+
+        tokens = self.client.post('/api/auth/token/', {'username': 'jwt', 'password': 'password'}).json()
+        auth = {'HTTP_AUTHORIZATION': f"JWT {tokens['access']}"}
+        self.assertEqual(self.client.get('/api/users/me/', **auth).status_code, 200)
+        self.assertEqual(self.client.post('/api/users/logout-all/', **auth).status_code, 204)
+        self.assertEqual(self.client.get('/api/users/me/', **auth).json()['detail'], 'Token has been revoked')
+        self.assertEqual(self.refresh(tokens['refresh']).status_code, 401)
+
+    def test_bloom_filter_spares_the_database_and_syncs_across_processes(self):
+        expires = timezone.now() + timedelta(hours=1)
+        here, elsewhere = RevocationStore(capacity=1000, sync_interval=60), RevocationStore(capacity=1000, sync_interval=60)
+        here.sync()
+        self.assertTrue(elsewhere.revoke('revoked-jti', expires))
+        self.assertFalse(elsewhere.revoke('revoked-jti', expires))
+        with self.assertNumQueries(0):
+            self.assertFalse(here.is_revoked('revoked-jti')) # not synced yet
+            self.assertFalse(here.is_revoked('other-jti'))
+
+        here.synced_at -= 60
+        self.assertTrue(here.is_revoked('revoked-jti'))
+        bloom = BloomFilter(1000, 0.01)
+        for n in range(1000):
+            bloom.add(f'jti-{n}')
+        self.assertLess(sum(f'other-{n}' in bloom for n in range(10000)), 300)
+
+    def test_revocations_outlive_the_cache_and_expired_ones_are_purged(self):
+        self.refresh(self.tokens['refresh'])
+        cache.clear()
+        set_revocation_store(RevocationStore(capacity=1000, sync_interval=0)) # a new process
+        self.assertEqual(self.refresh(self.tokens['refresh']).status_code, 401)
+
+        RevokedToken.objects.create(jti='expired-jti', expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertFalse(get_revocation_store().revoke('late-jti', timezone.now() - timedelta(seconds=1)))
+        call_command('purge_revoked_tokens', '--batch-size', '1', stdout=io.StringIO())
+        self.assertEqual(RevokedToken.objects.count(), 1)
+
+
+class BatchTests(TestCase):
+    """
+    A batch runs several API calls as the batch's user and returns their responses in order.
+    """
+    def setUp(self):
+        cache.clear()
+        self.program = make_program('Data Science')
+        self.user = User.objects.create_user('batch', password='password')
+        self.client.force_login(self.user)
+
+    def post(self, *requests):
+        return self.client.post('/api/batch/', {'requests': list(requests)}, content_type='application/json')
+
+    @override_settings(BATCH={'MAX_REQUESTS': 5, 'MAX_CONCURRENCY': 1})
+    def test_runs_calls_in_order_as_the_batch_user(self):
+        response = self.post(
+            {'method': 'POST', 'path': f'/api/programs/{self.program.pk}/favorite/'},
+            {'path': '/api/users/me/'},
+            {'path': f'/api/users/{self.user.pk}/favorites/'},
+            {'path': '/api/programs/?ordering=start_date&search=data'},
+            {'path': '/api/nowhere/'},
+        )
+        self.assertEqual(response.status_code, 200)
+        statuses = [result['status'] for result in response.json()['responses']]
+        self.assertEqual(statuses, [201, 200, 200, 200, 404])
+        me, favorites, programs = [result['body'] for result in response.json()['responses'][1:4]]
+        self.assertEqual(me['username'], 'batch')
+        self.assertEqual(favorites[0]['program']['id'], self.program.pk)
+        self.assertEqual([program['title'] for program in programs], ['Data Science'])
+
+    def test_rejects_malformed_batches(self):
+        self.assertEqual(self.post(*[{'path': '/api/users/me/'}] * 21).status_code, 400)
+        self.assertEqual(self.post({'path': 'https://example.com/api/users/me/'}).status_code, 400)
+        self.assertEqual(self.post({'path': '/api/batch/', 'method': 'POST'}).json()['responses'][0]['status'], 400)
+        self.client.logout()
+        self.assertEqual(self.post({'path': '/api/users/me/'}).json()['responses'][0]['status'], 403)
+
+
+class ConcurrentBatchTests(TransactionTestCase):
+    """Consecutive reads of a batch run in worker threads, each with its own database connection."""
+    serialized_rollback = True # keeps the default tenant created by the migrations
+
+    def test_reads_run_in_worker_threads(self):
+        make_program('Data Science')
+        user = User.objects.create_user('batch', password='password')
+        self.client.force_login(user)
+        response = self.client.post('/api/batch/', {'requests': [
+            {'path': '/api/users/me/'}, {'path': '/api/programs/'}, {'path': '/api/programs/suggest/?q=dat'},
+        ]}, content_type='application/json')
+        bodies = [result['body'] for result in response.json()['responses']]
+        self.assertEqual(bodies[0]['username'], 'batch')
+        self.assertEqual(bodies[1][0]['title'], 'Data Science')
+        self.assertEqual(bodies[2][0]['title'], 'Data Science')
+
+
+class BackfillTests(TestCase):
+    """
+    Backfills update rows in committed batches and resume after an interruption.
+    """
+    def setUp(self):
+        self.programs = [make_program(f'Program {n}') for n in range(5)]
+        self.addCleanup(BACKFILLS.pop, 'test_descriptions', None)
+
+    def test_interrupted_backfill_resumes(self):
+        batches = []
+
+        def rename(queryset):
+            if len(batches) == 2:
+                raise RuntimeError('connection lost')
+            batches.append(sorted(queryset.values_list('pk', flat=True)))
+            return queryset.update(description='Backfilled')
+
+        backfill = register_backfill(Backfill('test_descriptions', 'activities.Program', function=rename))
+        with self.assertRaises(RuntimeError):
+            run_backfill(backfill, Program, BackfillProgress, batch_size=2, pause=0)
+        progress = BackfillProgress.objects.get(name='test_descriptions')
+        self.assertEqual((progress.last_pk, progress.rows_updated, progress.completed_at), (self.programs[3].pk, 4, None))
+
+        batches.append('resumed')
+        out = io.StringIO()
+        call_command('resume_backfills', '--pause', '0', '--batch-size', '2', stdout=out)
+        self.assertIn('test_descriptions: done, 5 rows updated', out.getvalue())
+        self.assertEqual(batches[3], [self.programs[4].pk])
+        self.assertEqual(Program.objects.filter(description='Backfilled').count(), 5)
+        # Finished backfills are not run again
+        self.assertEqual(run_backfill(backfill, Program, BackfillProgress).rows_updated, 5)
+
+
+class ConcurrentIndexTests(TransactionTestCase):
+    """Outside PostgreSQL the concurrent index operations fall back to plain ones."""
+    serialized_rollback = True
+
+    def test_add_index_concurrently(self):
+        operation = AddIndexConcurrently('favorite', models.Index(fields=['updated_at'], name='favorite_updated_tmp_idx'))
+        from_state = ProjectState.from_apps(apps)
+        to_state = from_state.clone()
+        operation.state_forwards('activities', to_state)
+        with connection.schema_editor(atomic=False) as editor:
+            operation.database_forwards('activities', editor, from_state, to_state)
+        with connection.cursor() as cursor:
+            self.assertIn('favorite_updated_tmp_idx', connection.introspection.get_constraints(cursor, 'activities_favorite'))
+        with connection.schema_editor(atomic=False) as editor:
+            operation.database_backwards('activities', editor, to_state, from_state)
+        with connection.cursor() as cursor:
+            self.assertNotIn('favorite_updated_tmp_idx', connection.introspection.get_constraints(cursor, 'activities_favorite'))
+
+
+class RequirementMigrationTests(TransactionTestCase):
+    """Migration 0010 merges duplicate requirements and repeated links before adding its constraints."""
+    serialized_rollback = True
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([('activities', target)])
+        return executor.loader.project_state(('activities', target)).apps
+
+    def test_repeated_links_are_removed_before_the_constraint(self):
+        latest = MigrationExecutor(connection).loader.graph.leaf_nodes('activities')[0][1]
+        self.addCleanup(self.migrate, latest)
+        old_apps = self.migrate('0009_relatedprogram')
+        Program = old_apps.get_model('activities', 'Program')
+        Requirement = old_apps.get_model('activities', 'Requirement')
+        ProgramRequirement = old_apps.get_model('activities', 'ProgramRequirement')
+        program = Program.objects.create(
+            title='Program', description='Description', cost=0, start_date=date(2030, 1, 1),
+            end_date=date(2030, 2, 1), url='https://example.com',
+        )
+        python, python_again, sql = (Requirement.objects.create(description=d) for d in ('Python', ' python ', 'SQL'))
+        for requirement in (python, python_again, sql, sql):
+            ProgramRequirement.objects.create(program=program, requirement=requirement)
+
+        new_apps = self.migrate('0010_requirement_key')
+        links = new_apps.get_model('activities', 'ProgramRequirement').objects.order_by('requirement_id')
+        self.assertEqual(list(links.values_list('requirement_id', flat=True)), [python.pk, sql.pk])
+        self.assertEqual(sorted(new_apps.get_model('activities', 'Requirement').objects.values_list('key', flat=True)), ['python', 'sql'])
+
+
+class CalendarFeedTests(TestCase):
+    """
+    Calendar feeds are streamed iCalendar, and polls of an unchanged feed are answered 304 from the cache.
+    """
+    def setUp(self):
+        cache.clear() # the feed validators are cached per feed
+        self.tech = make_program('Data, science; and more', category='TECH', description='Line one\nLine two')
+        self.art = make_program('Painting', category='ART', start_date=date(2030, 3, 1), end_date=date(2030, 3, 1))
+        self.user = User.objects.create_user('subscriber', password='password')
+
+    def read(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_catalog_feed_is_filtered_and_revalidated(self):
+        response = self.client.get('/api/calendar/programs.ics')
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        body = self.read(response)
+        self.assertTrue(body.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertEqual(body.count('BEGIN:VEVENT'), 2)
+        self.assertIn('SUMMARY:Data\\, science\\; and more\r\n', body)
+        self.assertIn('DESCRIPTION:Line one\\nLine two\r\n', body)
+        self.assertIn('DTSTART;VALUE=DATE:20300301\r\nDTEND;VALUE=DATE:20300302\r\n', body) # DTEND is exclusive
+
+        art = self.read(self.client.get('/api/calendar/programs.ics?category=ART'))
+        self.assertEqual(art.count('BEGIN:VEVENT'), 1)
+        self.assertIn('SUMMARY:Painting', art)
+        self.assertEqual(self.client.get('/api/calendar/programs.ics?category=NOPE').status_code, 400)
+
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            poll = self.client.get('/api/calendar/programs.ics', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(poll.status_code, 304)
+        poll = self.client.get('/api/calendar/programs.ics', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(poll.status_code, 304)
+
+        self.art.title = 'Sculpture'
+        self.art.save()
+        changed = self.client.get('/api/calendar/programs.ics', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertIn('SUMMARY:Sculpture', self.read(changed))
+
+    def test_favorites_feed_is_private_to_its_token(self):
+        self.client.force_login(self.user)
+        url = self.client.get('/api/users/calendar/').json()['url']
+        self.client.logout()
+
+        Favorite.objects.create(user=self.user, program=self.tech)
+        response = self.client.get(url)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertEqual(self.read(response).count('BEGIN:VEVENT'), 1)
+
+        # Swapping a favorite keeps the count, and must still change the feed
+        Favorite.objects.filter(user=self.user).delete()
+        Favorite.objects.create(user=self.user, program=self.art)
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertIn('SUMMARY:Painting', self.read(changed))
+
+        self.assertEqual(self.client.get(url.replace('.ics', 'x.ics')).status_code, 404)
+        revoke_all_tokens(self.user)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_long_lines_are_folded_on_character_boundaries(self):
+        line = 'DESCRIPTION:' + 'é' * 100
+        folded = fold(line)
+        self.assertTrue(all(len(part.encode()) <= 75 for part in folded.split('\r\n')))
+        self.assertEqual(folded.replace('\r\n ', '').rstrip('\r\n'), line)
+
+
+class SlowQueryTests(TestCase):
+    """
+    Slow queries are aggregated by fingerprint, and the advisor suggests the indexes their plans lack.
+    """
+    def setUp(self):
+        self.recorder = SlowQueryRecorder( # every query is "slow"
+            threshold=0, flush_interval=None, sensitive_tables=settings.SLOW_QUERIES['SENSITIVE_TABLES'],
+        )
+        set_slow_query_recorder(self.recorder)
+        self.addCleanup(set_slow_query_recorder, None)
+
+    def test_queries_differing_by_values_share_a_fingerprint(self):
+        self.assertEqual(
+            normalize_sql("SELECT * FROM t WHERE a = 'x''y' AND b IN (%s, %s, %s) LIMIT 21"),
+            'SELECT * FROM t WHERE a = ? AND b IN (...) LIMIT ?',
+        )
+        # The recorder is installed on every connection as it opens
+        for ids in ([1], [1, 2, 3]):
+            list(Program.objects.filter(pk__in=ids))
+        self.recorder.flush()
+        list(Program.objects.filter(pk__in=[4]))
+        self.recorder.flush()
+        query = SlowQuery.objects.get(sql__contains='FROM "activities_program" WHERE')
+        self.assertEqual(query.calls, 3)
+        self.assertFalse(SlowQuery.objects.filter(sql__contains='activities_slowquery').exists()) # its own writes
+        self.assertIn('IN (...)', query.sql)
+
+    def test_example_params_are_redacted(self):
+        list(Program.objects.filter(title='Robotics', cost__lte=10))
+        list(User.objects.filter(email='secret@example.com', pk__gte=7))
+        User.objects.create_user('sampled', email='sampled@example.com', password='password')
+        self.recorder.flush()
+        program = SlowQuery.objects.get(sql__startswith='SELECT', sql__contains='FROM "activities_program" WHERE')
+        self.assertIn('Robotics', program.example_params)
+        user = SlowQuery.objects.get(sql__startswith='SELECT', sql__contains='"activities_user"."email" =')
+        self.assertNotIn('secret@example.com', user.example_params)
+        self.assertIn(REDACTED, user.example_params)
+        self.assertIn(7, user.example_params) # non-text values still let the advisor explain it
+        insert = SlowQuery.objects.get(sql__startswith='INSERT INTO "activities_user"')
+        self.assertEqual(set(insert.example_params), {None})
+
+    def test_advisor_suggests_missing_indexes_only(self):
+        list(MessageContact.objects.filter(status='NEW').order_by('-read_at')[:10])
+        list(Favorite.objects.filter(user_id=1).order_by('-created_at')[:10])
+        self.recorder.flush()
+        messages, favorites = (
+            SlowQuery.objects.get(sql__contains=f'FROM "activities_{table}"') for table in ('messagecontact', 'favorite')
+        )
+        plan, suggestions = advise(messages)
+        self.assertTrue(plan)
+        self.assertEqual([(s.model, s.fields) for s in suggestions], [(MessageContact, ['status', '-read_at'])])
+        self.assertLessEqual(len(suggestions[0].name), 30)
+        self.assertEqual(advise(favorites)[1], []) # served by favorite_user_created_idx
+
+        out = io.StringIO()
+        call_command('advise_indexes', '--reset', stdout=out)
+        self.assertIn("models.Index(fields=['status', '-read_at']", out.getvalue())
+        self.assertFalse(SlowQuery.objects.exists())
+
+
+class ReminderTests(TestCase):
+    """
+    Users are emailed once per favorited program start date, all their due programs in one email.
+    """
+    today = date(2030, 1, 1)
+
+    def setUp(self):
+        self.soon = make_program('Soon', start_date=self.today + timedelta(days=1))
+        self.later = make_program('Later', start_date=self.today + timedelta(days=2))
+        self.far = make_program('Far', start_date=self.today + timedelta(days=30))
+        self.alice = User.objects.create_user('alice', email='alice@example.com', password='password')
+        self.bob = User.objects.create_user('bob', email='bob@example.com', password='password')
+        inactive = User.objects.create_user('carol', email='carol@example.com', password='password', is_active=False)
+        for user, programs in ((self.alice, [self.soon, self.later, self.far]), (self.bob, [self.later]), (inactive, [self.soon])):
+            for program in programs:
+                Favorite.objects.create(user=user, program=program)
+
+    def test_reminders_are_coalesced_and_sent_once(self):
+        result = send_due_reminders(today=self.today, days_before=3, batch_size=1)
+        self.assertEqual(result, {'users': 2, 'reminders': 3, 'sent': 2, 'failed': 0})
+        alice, bob = sorted(mail.outbox, key=lambda message: message.to)
+        self.assertEqual(alice.subject, 'Reminder: 2 of your favorite programs start soon')
+        self.assertIn('Soon', alice.body)
+        self.assertNotIn('Far', alice.body)
+        self.assertEqual(bob.subject, 'Reminder: Later starts on 03 January 2030')
+        self.assertEqual(EmailLog.objects.filter(status=EmailStatus.SENT, attempts=1).count(), 2)
+        self.assertEqual(ProgramReminder.objects.exclude(email_log=None).count(), 3)
+
+        # A rerun sends nothing; a program moved to a new date is announced again
+        self.assertEqual(send_due_reminders(today=self.today, days_before=3)['sent'], 0)
+        self.later.start_date = self.today + timedelta(days=3)
+        self.later.save()
+        out = io.StringIO()
+        call_command('send_reminders', '--date', self.today.isoformat(), '--days', '3', stdout=out)
+        self.assertIn('2 reminders for 2 users', out.getvalue())
+        self.assertEqual(len(mail.outbox), 4)
+
+    def test_reminders_claimed_concurrently_are_left_out(self):
+        [batch] = user_batches(due_reminders(self.today, 3), 10)
+        # Another run claims one of Alice's reminders after the due pairs were read
+        ProgramReminder.objects.create(user=self.alice, program=self.soon, start_date=self.soon.start_date)
+        claimed = claim(batch)
+        self.assertEqual(
+            [(message.to, message.subject) for _, message, _ in claimed],
+            [(['alice@example.com'], 'Reminder: Later starts on 03 January 2030'), (['bob@example.com'], 'Reminder: Later starts on 03 January 2030')],
+        )
+        self.assertEqual(ProgramReminder.objects.count(), 3)
+        self.assertEqual(EmailLog.objects.count(), 2)
+        self.assertEqual(claim(batch), []) # everything is claimed now
+
+    def test_due_pairs_are_read_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            send_due_reminders(today=self.today, days_before=3, batch_size=10)
+        selects = [query['sql'] for query in queries if query['sql'].startswith('SELECT')]
+        self.assertEqual(len(selects), 1)
@@ -0,0 +1,89 @@
+"""
+Trending programs.
+
+Each program keeps an exponentially decayed score: every favorite adds `TRENDING['WEIGHTS']['favorite']`
+and every view `TRENDING['WEIGHTS']['view']`, and a contribution halves every `TRENDING['HALF_LIFE']`
+seconds. The score is stored on the program (`trending_score`, as of `trending_at`) and indexed, so
+`?ordering=-trending` is a plain index scan.
+- `bump` decays a program's score to now and adds to it, whenever a favorite is added or removed
+  or a batch of views is flushed by `activities.analytics`.
+- `redecay` (`manage.py decay_trending`) periodically decays every score to the same instant, so
+  programs nobody touched lately sink below the ones with recent activity.
+Both write with `update`/`bulk_update`, leaving `updated_at` (and the sync feed) alone.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import now
+
+from .models import Program
+
+# Scores below this are stored as 0 by `redecay`
+NEGLIGIBLE_SCORE = 1e-6
+
+
+def decay(score, since, until):
+    """Returns `score` as of `since`, decayed to `until`."""
+    if not score or since is None:
+        return score
+    elapsed = max((until - since).total_seconds(), 0)
+    return score * 0.5 ** (elapsed / settings.TRENDING['HALF_LIFE'])
+
+
+def bump(deltas, at=None):
+    """
+    Decays the scores of the programs in `deltas` (`{program id: amount}`) to `at` (default now)
+    and adds each amount; negative amounts remove activity, without going below 0.
+    Runs two queries for the whole mapping.
+    """
+    at = at or now()
+    with transaction.atomic():
+        # Locked in id order so concurrent bumps of the same programs queue instead of deadlocking
+        programs = list(
+            Program.objects.select_for_update().filter(pk__in=deltas)
+            .only('id', 'trending_score', 'trending_at').order_by('pk')
+        )
+        for program in programs:
+            program.trending_score = max(decay(program.trending_score, program.trending_at, at) + deltas[program.pk], 0)
+            program.trending_at = at
+        Program.objects.bulk_update(programs, ['trending_score', 'trending_at'])
+    return len(programs)
+
+
+def favorite_added(program_id):
+    bump({program_id: settings.TRENDING['WEIGHTS']['favorite']})
+
+
+def favorite_removed(program_id, created_at):
+    """Removes what a favorite added on `created_at` still contributes to its program's score."""
+    at = now()
+    bump({program_id: -decay(settings.TRENDING['WEIGHTS']['favorite'], created_at, at)}, at=at)
+
+
+def views_recorded(view_counts):
+    """Adds `{program id: views}` counted by an analytics flush."""
+    weight = settings.TRENDING['WEIGHTS']['view']
+    if weight and view_counts:
+        bump({program_id: count * weight for program_id, count in view_counts.items()})
+
+
+def redecay(batch_size=1000, at=None):
+    """
+    Decays every non-zero score to `at` (default now), `batch_size` programs per update.
+    Returns the number of programs updated.
+    """
+    at = at or now()
+    queryset = Program.objects.filter(trending_score__gt=0).only('id', 'trending_score', 'trending_at').order_by('pk')
+    updated = 0
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            programs = list(queryset.select_for_update().filter(pk__gt=last_pk)[:batch_size])
+            if not programs:
+                return updated
+            for program in programs:
+                score = decay(program.trending_score, program.trending_at, at)
+                program.trending_score = score if score >= NEGLIGIBLE_SCORE else 0
+                program.trending_at = at
+            Program.objects.bulk_update(programs, ['trending_score', 'trending_at'])
+        last_pk = programs[-1].pk
+        updated += len(programs)
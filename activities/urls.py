@@ -1,25 +1,16 @@
 # urls.py
 from django.urls import path, include
-from rest_framework.routers import DefaultRouter
-from rest_framework_nested import routers
-from .views import (
-    UserViewSet,
-    ProgramViewSet,
-    ProgramImageViewSet,
-    FavoriteViewSet
-)
-from rest_framework_simplejwt.views import (
-    TokenObtainPairView,
-    TokenRefreshView,
-)
-
 from rest_framework_nested import routers
 from .views import (
     UserViewSet,
     ProgramViewSet,
     ProgramImageViewSet,
     FavoriteViewSet,
-    MessageContactViewSet
+    MessageContactViewSet,
+    catalog_events,
+    batch,
+    program_calendar,
+    favorites_calendar,
 )
 
 router = routers.DefaultRouter()
@@ -38,4 +29,8 @@ urlpatterns = [
     path('', include(router.urls)),
     path('', include(programs_router.urls)),
     path('', include(users_router.urls)),
+    path('events/programs/', catalog_events, name='catalog-events'), # Server-Sent Events stream of catalog changes
+    path('batch/', batch, name='batch'), # several API calls in one round-trip
+    path('calendar/programs.ics', program_calendar, name='program-calendar'), # iCalendar feed of the catalog
+    path('calendar/favorites/<str:token>.ics', favorites_calendar, name='favorites-calendar'), # a user's favorites, see activities.calendar
 ]
\ No newline at end of file
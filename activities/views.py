@@ -1,25 +1,67 @@
+import asyncio
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_safe
 from rest_framework import viewsets, status, permissions
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, PermissionDenied
 from django.shortcuts import get_object_or_404
-from .models import User, Program, ProgramImage, Favorite, MessageContact
+from django.urls import reverse
+from .models import User, Program, ProgramImage, Favorite, MessageContact, RelatedProgram, AnalyticsEventKind, ProgramCategory, ProgramAudience
 from .serializer import (
     UserSerializer,
     ProgramSerializer,
     ProgramImageSerializer,
     FavoriteSerializer,
     MessageContactSerializer,
-    UserCreateWithProfileSerializer
+    UserCreateWithProfileSerializer,
+    ProgramOverviewSerializer
 )
+from .favorites import favorites_calendar_cache_key, favorites_queryset, get_favorites_feed, is_favorite
+from .filters import ProgramFilter
+from .authentication import revoke_all_tokens
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework import filters
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Q
-from rest_framework.decorators import action
-from rest_framework.response import Response
-from rest_framework import permissions
-class UserViewSet(viewsets.ModelViewSet):
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Prefetch, Q
+
+# The analytics, batch, calendar, contact, enrollment, events, suggest, sync and tasks modules are
+# imported by the views that use them, so that loading the URLconf (every worker boot) does not import them
+
+
+def record_event(kind, **fields):
+    """Records an analytics event (see `activities.analytics.record`)."""
+    from . import analytics
+
+    analytics.record(kind, **fields)
+
+
+class TenantScopedMixin:
+    """
+    Scopes a viewset to the request tenant (see `activities.tenants`): querysets are filtered on it,
+    created rows belong to it, and users of another tenant are refused.
+    """
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        user = request.user
+        if user.is_authenticated and not user.is_superuser and user.tenant_id != request.tenant.pk:
+            raise PermissionDenied('This account belongs to another federation.')
+
+    def get_queryset(self):
+        return super().get_queryset().filter(tenant=self.request.tenant)
+
+    def perform_create(self, serializer):
+        serializer.save(tenant=self.request.tenant)
+
+class UserViewSet(TenantScopedMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     parser_classes = (MultiPartParser, FormParser)
@@ -27,7 +69,7 @@ class UserViewSet(viewsets.ModelViewSet):
     def get_permissions(self):
         if self.action == 'create':
             permission_classes = [permissions.AllowAny]
-        elif self.action in ['update', 'partial_update', 'destroy', 'list']:
+        elif self.action in ['update', 'partial_update', 'destroy', 'list', 'bulk']:
             permission_classes = [IsAdminUser]
         else:
             permission_classes = [IsAuthenticated]
@@ -38,6 +80,37 @@ class UserViewSet(viewsets.ModelViewSet):
             return UserCreateWithProfileSerializer
         return UserSerializer
 
+    @action(detail=False, methods=['post'], permission_classes=[IsAdminUser])
+    def bulk(self, request):
+        """
+        Enrolls a cohort from an uploaded CSV (`file`), see `activities.enrollment.enroll_users`.
+        Rows without a password receive an activation email unless `send_activation` is `false`.
+        Passwords are not hashed in the request (thousands of PBKDF2 rounds per row): the `password`
+        column is ignored and those users pick a password through the activation email instead.
+        """
+        from .enrollment import enroll_users, read_csv
+
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'detail': 'A CSV file is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        send_activation = request.data.get('send_activation', 'true').lower() != 'false'
+        result = enroll_users(read_csv(upload), send_activation=send_activation, tenant=request.tenant, hash_passwords=False)
+        return Response(result.as_dict(), status=status.HTTP_201_CREATED if result.created else status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated], url_path='logout-all')
+    def logout_all(self, request):
+        """Invalidates every JWT issued to the requesting user (logout on all devices)."""
+        revoke_all_tokens(request.user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated], url_path='calendar')
+    def calendar_url(self, request):
+        """Returns the URL of the requesting user's favorites calendar feed, to subscribe to in a calendar app."""
+        from . import calendar
+
+        path = reverse('favorites-calendar', args=[calendar.feed_token(request.user)])
+        return Response({'url': request.build_absolute_uri(path)})
+
     @action(detail=False, methods=['get', 'put', 'patch'], permission_classes=[IsAuthenticated])
     def me(self, request):
         user = request.user
@@ -49,21 +122,21 @@ class UserViewSet(viewsets.ModelViewSet):
         serializer = UserSerializer(user)
         return Response(serializer.data)
 
-class ProgramViewSet(viewsets.ModelViewSet):
-    queryset = Program.objects.all()
+class ProgramViewSet(TenantScopedMixin, viewsets.ModelViewSet):
+    queryset = Program.objects.alias(trending=F('trending_score')) # ?ordering=-trending sorts on program_trending_idx
     serializer_class = ProgramSerializer
     permission_classes = [IsAuthenticated]
 
 
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
-    filterset_fields = ['type', 'category', 'audience', 'kind', 'target_academic']
+    filterset_class = ProgramFilter
     search_fields = ['title', 'description']
-    ordering_fields = ['start_date', 'end_date', 'cost', 'post_date']
+    ordering_fields = ['start_date', 'end_date', 'cost', 'post_date', 'trending']
 
     @action(detail=False, methods=['get'], permission_classes=[permissions.AllowAny])
     def search(self, request):
         query = request.query_params.get('q', '')
-        programs = Program.objects.filter(
+        programs = self.get_queryset().filter(
             Q(title__icontains=query) | 
             Q(description__icontains=query)
         )
@@ -87,10 +160,74 @@ class ProgramViewSet(viewsets.ModelViewSet):
             programs = programs.filter(kind=kind)
         
         serializer = self.get_serializer(programs, many=True)
+        if query:
+            record_event(AnalyticsEventKind.SEARCH, user_id=request.user.pk, query=query, results=len(serializer.data))
         return Response(serializer.data)
 
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        query = request.query_params.get('search')
+        if query:
+            record_event(AnalyticsEventKind.SEARCH, user_id=request.user.pk, query=query, results=len(response.data))
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        record_event(AnalyticsEventKind.VIEW, program_id=response.data['id'], user_id=request.user.pk)
+        return response
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.AllowAny])
+    def suggest(self, request):
+        """
+        Search-as-you-type: programs and requirements with a word starting with `q`, as ids and titles only.
+        Answered from the in-process prefix index, without touching the database.
+        """
+        from .suggest import get_suggestions
+
+        try:
+            limit = int(request.query_params.get('limit', 0)) or None
+        except ValueError:
+            return Response({'limit': 'Must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(get_suggestions(request.query_params.get('q', ''), request.tenant.pk, limit))
+
+    @action(detail=True, methods=['get'], permission_classes=[permissions.AllowAny])
+    def overview(self, request, pk=None):
+        """
+        Returns everything the program page needs in four queries: the program with its favorite
+        count, its requirements, its images and its precomputed related programs.
+        """
+        queryset = (
+            self.get_queryset()
+            .annotate(favorite_count=Count('favorites'))
+            .prefetch_related(
+                'requirements',
+                'additional_images',
+                Prefetch('related_entries', queryset=RelatedProgram.objects.select_related('related').order_by('rank')),
+            )
+        )
+        program = get_object_or_404(queryset, pk=pk)
+        record_event(AnalyticsEventKind.VIEW, program_id=program.pk, user_id=request.user.pk)
+        return Response(ProgramOverviewSerializer(program, context=self.get_serializer_context()).data)
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.AllowAny])
+    def sync(self, request):
+        """
+        Returns the programs created, updated or deleted since `?cursor=` (omit it for a full sync).
+        Clients store the returned `cursor` and call again while `has_more` is true.
+        """
+        from .sync import changes_since
+
+        page_size = settings.PROGRAM_SYNC['PAGE_SIZE']
+        try:
+            limit = min(int(request.query_params.get('limit', page_size)), settings.PROGRAM_SYNC['MAX_PAGE_SIZE'])
+            changes = changes_since(request.query_params.get('cursor'), max(limit, 1), request.tenant.pk)
+        except ValueError: # also raised for an InvalidCursor
+            return Response({'detail': 'Invalid cursor or limit.'}, status=status.HTTP_400_BAD_REQUEST)
+        changes['programs'] = self.get_serializer(changes['programs'], many=True).data
+        return Response(changes)
+
     def get_permissions(self):
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'sync', 'overview', 'suggest']:
             permission_classes = [permissions.AllowAny]
         elif self.action in ['create', 'update', 'partial_update', 'destroy']:
             permission_classes = [IsAdminUser]
@@ -98,11 +235,16 @@ class ProgramViewSet(viewsets.ModelViewSet):
             permission_classes = [IsAuthenticated]
         return [permission() for permission in permission_classes]
 
-    @action(detail=True, methods=['post', 'delete'], permission_classes=[IsAuthenticated])
+    @action(detail=True, methods=['get', 'post', 'delete'], permission_classes=[IsAuthenticated])
     def favorite(self, request, pk=None):
-        program = self.get_object()
         user = request.user
+        if request.method == 'GET':
+            # Membership comes from the user's cached favorite ids, without loading the program
+            if not pk.isdigit():
+                return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+            return Response({'favorite': is_favorite(user.pk, int(pk))})
 
+        program = self.get_object()
         if request.method == 'POST':
             favorite, created = Favorite.objects.get_or_create(user=user, program=program)
             if created:
@@ -120,26 +262,45 @@ class ProgramImageViewSet(viewsets.ModelViewSet):
     parser_classes = (MultiPartParser, FormParser)
 
     def get_queryset(self):
-        return ProgramImage.objects.filter(program_id=self.kwargs['program_pk'])
+        return ProgramImage.objects.filter(program_id=self.kwargs['program_pk'], program__tenant=self.request.tenant)
 
     def perform_create(self, serializer):
-        program = get_object_or_404(Program, pk=self.kwargs['program_pk'])
+        program = get_object_or_404(Program, pk=self.kwargs['program_pk'], tenant=self.request.tenant)
         serializer.save(program=program)
 
 class FavoriteViewSet(viewsets.ModelViewSet):
     serializer_class = FavoriteSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_owner(self):
+        """Returns the user of the URL, who must be the requester, within the request tenant."""
+        user = get_object_or_404(User, pk=self.kwargs['user_pk'], tenant=self.request.tenant)
+        if user != self.request.user:
+            raise PermissionDenied("You can only access your own favorites")
+        return user
+
     def get_queryset(self):
-        return Favorite.objects.filter(user_id=self.kwargs['user_pk'])
+        return favorites_queryset(self.get_owner().pk)
+
+    def list(self, request, *args, **kwargs):
+        # The feed is cached per user and tenant and invalidated by the Favorite/Program signals.
+        # It is serialized without the request, so the cache holds relative image URLs that are made
+        # absolute for the host of each request.
+        data = get_favorites_feed(
+            self.get_owner().pk, request.tenant.pk, lambda favorites: self.serializer_class(favorites, many=True).data,
+        )
+        return Response([
+            {**favorite, 'program': {
+                **favorite['program'],
+                'image': favorite['program']['image'] and request.build_absolute_uri(favorite['program']['image']),
+            }}
+            for favorite in data
+        ])
 
     def perform_create(self, serializer):
-        user = get_object_or_404(User, pk=self.kwargs['user_pk'])
-        if user != self.request.user:
-            raise permissions.PermissionDenied("You can only add favorites to your own account")
-        serializer.save(user=user)
+        serializer.save(user=self.get_owner())
 
-class MessageContactViewSet(viewsets.ModelViewSet):
+class MessageContactViewSet(TenantScopedMixin, viewsets.ModelViewSet):
     queryset = MessageContact.objects.all()
     serializer_class = MessageContactSerializer
     permission_classes = [permissions.AllowAny]  # Allow anyone to send messages
@@ -147,4 +308,185 @@ class MessageContactViewSet(viewsets.ModelViewSet):
     def get_permissions(self):
         if self.action in ['list', 'retrieve', 'update', 'partial_update', 'destroy']:
             return [IsAdminUser()]
-        return [permissions.AllowAny()]
\ No newline at end of file
+        return [permissions.AllowAny()]
+
+    def create(self, request, *args, **kwargs):
+        """
+        Stores a contact message once, even when the form is submitted twice.
+        - A repeated `Idempotency-Key` header returns the message created with it (200), or 409
+          when the key was used for a different message.
+        - The same email and message inside `CONTACT_MESSAGES['DEDUPE_WINDOW']` returns the earlier message (200).
+        The staff notification is queued as a background task.
+        """
+        from .contact import message_hash, find_recent_duplicate
+        from .tasks import notify_staff
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        key = request.headers.get('Idempotency-Key') or None
+        dedupe_hash = message_hash(serializer.validated_data['email'], serializer.validated_data['message'])
+
+        existing = None
+        if key:
+            existing = self.get_queryset().filter(idempotency_key=key).first()
+        if existing is None:
+            existing = find_recent_duplicate(dedupe_hash, request.tenant.pk)
+        if existing is None:
+            try:
+                with transaction.atomic():
+                    message = serializer.save(idempotency_key=key, dedupe_hash=dedupe_hash, tenant=request.tenant)
+            except IntegrityError: # a concurrent request with the same key won the race
+                existing = self.get_queryset().filter(idempotency_key=key).first()
+                if existing is None:
+                    raise
+            else:
+                notify_staff.delay(message.pk)
+                return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+        if existing.dedupe_hash != dedupe_hash:
+            return Response({'detail': 'Idempotency-Key was already used for a different message.'},
+                            status=status.HTTP_409_CONFLICT)
+        return Response(self.get_serializer(existing).data, status=status.HTTP_200_OK)
+
+def _format_event(event_id, event_type, data):
+    """Formats one Server-Sent Events frame."""
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+async def catalog_events(request):
+    """
+    Streams catalog change events as Server-Sent Events.
+    Clients resume from the `Last-Event-ID` header (or `?last_event_id=`); when the requested
+    events are no longer retained a `reset` event tells the client to resynchronise the catalog.
+    Served by the ASGI application, where the open stream does not hold a worker thread.
+    Only the events of the request tenant are forwarded.
+    """
+    from .events import get_backend
+
+    options = settings.CATALOG_EVENTS
+    tenant_id = request.tenant.pk
+    backend = get_backend()
+    read_since = sync_to_async(backend.read_since, thread_sensitive=False)
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        last_id = int(last_event_id)
+    except (TypeError, ValueError):
+        last_id = await sync_to_async(backend.current_id, thread_sensitive=False)()
+
+    async def stream():
+        nonlocal last_id
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + options['STREAM_TIMEOUT']
+        next_heartbeat = loop.time() + options['HEARTBEAT_INTERVAL']
+        yield f"retry: {options['RETRY_MS']}\n\n"
+        while loop.time() < deadline:
+            events, complete = await read_since(last_id)
+            if not complete:
+                last_id = await sync_to_async(backend.current_id, thread_sensitive=False)()
+                yield _format_event(last_id, 'reset', {'id': last_id})
+                continue
+            for event in events:
+                last_id = event['id']
+                if event.get('tenant') == tenant_id:
+                    yield _format_event(last_id, event['type'], event)
+            if loop.time() >= next_heartbeat:
+                next_heartbeat = loop.time() + options['HEARTBEAT_INTERVAL']
+                yield ': keep-alive\n\n'
+            if not events:
+                await asyncio.sleep(options['POLL_INTERVAL'])
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no' # stop nginx from buffering the stream
+    return response
+
+
+@csrf_exempt # as for DRF views, CSRF is enforced by the session authentication only
+async def batch(request):
+    """
+    Runs several API calls in one round-trip (see `activities.batch`).
+    The batch is authenticated once; every call is still subject to its own view's permissions.
+    """
+    from . import batch as batching
+
+    if request.method != 'POST':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    try:
+        specs = batching.parse_batch(request.body)
+        user, auth = await sync_to_async(batching.authenticate)(request)
+    except batching.BatchError as exc:
+        return JsonResponse({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    except APIException as exc:
+        return JsonResponse({'detail': exc.detail}, status=exc.status_code)
+    results = await batching.run_batch(request, specs, user, auth)
+    parts = b','.join(batching.encode_response(response, code) for response, code in results)
+    return HttpResponse(b'{"responses":[%s]}' % parts, content_type='application/json')
+
+
+def _calendar_response(request, name, programs, validators, private):
+    """
+    Answers a calendar feed request: a 304 when the client's copy is current, else the feed streamed
+    from `programs`. `validators` is the feed's `(etag, last_modified)`.
+    """
+    from . import calendar
+
+    etag, last_modified = validators
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified.timestamp()) if last_modified else None,
+    )
+    if response is None:
+        response = StreamingHttpResponse(
+            calendar.stream_calendar(name, programs, request.get_host().split(':')[0]),
+            content_type='text/calendar; charset=utf-8',
+        )
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    if private:
+        patch_cache_control(response, private=True, max_age=settings.CALENDAR['MAX_AGE'])
+    else:
+        patch_cache_control(response, public=True, max_age=settings.CALENDAR['MAX_AGE'])
+    return response
+
+
+@require_safe
+def program_calendar(request):
+    """
+    Streams the tenant's catalog as an iCalendar feed (see `activities.calendar`), optionally filtered
+    on one `category` and one `audience`.
+    """
+    from . import calendar
+
+    category = request.GET.get('category') or None
+    audience = request.GET.get('audience') or None
+    if category is not None and category not in ProgramCategory.values:
+        return JsonResponse({'detail': f'Unknown category {category!r}.'}, status=status.HTTP_400_BAD_REQUEST)
+    if audience is not None and audience not in ProgramAudience.values:
+        return JsonResponse({'detail': f'Unknown audience {audience!r}.'}, status=status.HTTP_400_BAD_REQUEST)
+    tenant = request.tenant
+    programs = Program.objects.filter(tenant=tenant)
+    if category is not None:
+        programs = programs.filter(category=category)
+    if audience is not None:
+        programs = programs.filter(audience=audience)
+    validators = calendar.feed_validators(
+        calendar.catalog_cache_key(tenant.pk, category, audience), tenant.pk, programs, ['updated_at'],
+    )
+    return _calendar_response(request, f'{tenant.name} programs', programs, validators, private=False)
+
+
+@require_safe
+def favorites_calendar(request, token):
+    """Streams a user's favorite programs as an iCalendar feed, authenticated by the signed token of its URL."""
+    from . import calendar
+
+    user = calendar.user_from_token(token)
+    if user is None or user.tenant_id != request.tenant.pk:
+        return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+    # Favorites are counted (not programs) so that swapping one favorite for another changes the ETag
+    validators = calendar.feed_validators(
+        favorites_calendar_cache_key(user.pk), user.tenant_id,
+        Favorite.objects.filter(user_id=user.pk), ['updated_at', 'program__updated_at'],
+    )
+    programs = Program.objects.filter(favorites__user_id=user.pk)
+    return _calendar_response(request, 'My favorite programs', programs, validators, private=True)